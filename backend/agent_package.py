@@ -0,0 +1,117 @@
+"""
+Desktop agent package served by /api/download-agent
+The zip is built once per distinct set of agent sources and stored under
+its content hash, so repeated and concurrent downloads just stream a file
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+import zipfile
+from pathlib import Path
+from typing import Optional, Tuple
+
+AGENT_DIR = Path(__file__).parent.parent / "desktop-agent"
+
+# Files copied from desktop-agent/ into the package
+PACKAGE_FILES = ("agent.py", "wire.py", "capture.py", "delta.py", "quality.py", "resize.py", "video.py",
+                 "region.py", "requirements.txt", "requirements-optional.txt", "install.py")
+
+# Simple installer script for Mac/Linux
+INSTALLER_SCRIPT = """#!/bin/bash
+# 24/7 AI Control Assistant Installer
+
+echo "Installing 24/7 AI Control Assistant..."
+echo "======================================"
+
+# Check if Python 3 is installed
+if ! command -v python3 &> /dev/null; then
+    echo "Error: Python 3 is required but not installed."
+    echo "Please install Python 3 and try again."
+    exit 1
+fi
+
+# Install Python dependencies
+echo "Installing dependencies..."
+python3 -m pip install -r requirements.txt
+python3 -m pip install -r requirements-optional.txt || echo "Optional extras (video mode, box resize) not installed; continuing without them"
+
+# Run the installer
+echo "Running installer..."
+python3 install.py
+
+echo ""
+echo "Installation complete!"
+echo "You can now run the agent with: python3 agent.py"
+"""
+
+
+def _entry(name: str, mode: int) -> zipfile.ZipInfo:
+    info = zipfile.ZipInfo(f"24ai-desktop-agent/{name}")
+    info.compress_type = zipfile.ZIP_DEFLATED
+    info.external_attr = (0o100000 | mode) << 16
+    return info
+
+
+class AgentPackage:
+    """Content-addressed cache of the desktop agent zip"""
+
+    def __init__(self, agent_dir: Path = AGENT_DIR, cache_dir: Optional[Path] = None):
+        self.agent_dir = agent_dir
+        self.cache_dir = cache_dir or Path(tempfile.gettempdir()) / "24ai-agent-packages"
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._current: Optional[Tuple[str, Path]] = None
+        self.builds = 0
+
+    def _sources(self):
+        return [(name, self.agent_dir / name) for name in PACKAGE_FILES if (self.agent_dir / name).exists()]
+
+    def current(self) -> Tuple[str, Path]:
+        """Return (digest, zip path), rebuilding only if the sources changed
+
+        Blocking; call it from a worker thread.
+        """
+        if not self.agent_dir.exists():
+            raise FileNotFoundError("Desktop agent files not found")
+
+        with self._lock:
+            sources = self._sources()
+            # Cheap change detection; the content hash is only recomputed when this moves
+            stamp = tuple((name, path.stat().st_mtime_ns, path.stat().st_size) for name, path in sources)
+            if stamp == self._stamp and self._current is not None and self._current[1].exists():
+                return self._current
+
+            digest = hashlib.sha256()
+            contents = []
+            for name, path in sources:
+                data = path.read_bytes()
+                contents.append((name, data))
+                digest.update(name.encode() + b"\0" + len(data).to_bytes(8, "big") + data)
+            digest.update(INSTALLER_SCRIPT.encode())
+            digest = digest.hexdigest()
+
+            zip_path = self.cache_dir / f"24ai-desktop-agent-{digest[:16]}.zip"
+            if not zip_path.exists():
+                self._build(zip_path, contents)
+
+            self._stamp = stamp
+            self._current = (digest, zip_path)
+            return self._current
+
+    def _build(self, zip_path: Path, contents):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # Build beside the target and rename, so readers (including other
+        # processes) never see a half-written zip
+        fd, tmp_name = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f, zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED) as zipf:
+                for name, data in contents:
+                    zipf.writestr(_entry(name, 0o644), data)
+                zipf.writestr(_entry("24ai-installer.command", 0o755), INSTALLER_SCRIPT)
+            os.replace(tmp_name, zip_path)
+            self.builds += 1
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
@@ -0,0 +1,73 @@
+"""
+Microbenchmark for the wire codecs
+Encode and decode cost, and encoded size, of each codec available here for
+the message types that dominate /ws traffic.
+
+    cd backend
+    python -m bench.codec_bench --frame-kb 150 --number 2000
+"""
+
+import argparse
+import base64
+import os
+import timeit
+
+import wire
+
+# Binary frame header + raw JPEG (?frames=binary), used whatever the codec
+FRAME = wire.Codec('frame', True, wire.pack_frame, wire.unpack_frame)
+
+
+def sample_messages(frame_kb: int) -> dict:
+    jpeg = os.urandom(frame_kb * 1024)
+    action = {"type": "keyboard_type", "params": {"text": "hello world"}}
+    return {
+        # JSON clients get the JPEG as base64; msgpack carries the bytes
+        "screen_frame": lambda codec: {
+            "type": "screen_frame",
+            "data": jpeg if codec.binary else base64.b64encode(jpeg).decode(),
+            "timestamp": 1234.5678,
+        },
+        "action_result": lambda codec: {
+            "type": "action_result", "step": 3, "total": 5, "action": action,
+            "result": {"status": "success", "message": "Typed: hello world"},
+        },
+        "execute_sequence": lambda codec: {
+            "type": "execute_sequence",
+            "actions": [
+                {"type": "open_url", "params": {"url": "https://www.youtube.com"}},
+                {"type": "wait", "params": {"seconds": 2}},
+                {"type": "mouse_click", "params": {"x": 640, "y": 120}},
+                action,
+                {"type": "keyboard_press", "params": {"key": "enter"}},
+            ],
+        },
+        "ping": lambda codec: {"type": "ping", "ts": 1700000000.123},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare wire codec cost per message type")
+    parser.add_argument("--frame-kb", type=int, default=150, help="JPEG size before base64")
+    parser.add_argument("--number", type=int, default=1000, help="iterations per measurement")
+    args = parser.parse_args()
+
+    print(f"Codecs available: {', '.join(wire.CODECS)}\n")
+    print(f"{'message':<18}{'codec':<9}{'bytes':>10}{'encode µs':>12}{'decode µs':>12}")
+    for name, build in sample_messages(args.frame_kb).items():
+        # Frames are fewer per second but much larger; keep the run time comparable
+        number = max(10, args.number // 50) if name == "screen_frame" else args.number
+        codecs = list(wire.CODECS.values())
+        if name == "screen_frame":
+            codecs.append(FRAME)
+        for codec in codecs:
+            message = build(codec)
+            encoded = codec.dumps(message)
+            encode = min(timeit.repeat(lambda: codec.dumps(message), number=number, repeat=3)) / number
+            decode = min(timeit.repeat(lambda: codec.loads(encoded), number=number, repeat=3)) / number
+            print(f"{name:<18}{codec.name:<9}{len(encoded):>10}{encode * 1e6:>12.1f}{decode * 1e6:>12.1f}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+"""
+Load test for the /ws hub
+Starts backend/main.py under uvicorn with the OpenAI API pointed at a local
+stub, then simulates N agents streaming synthetic screen frames and M
+viewers per code sending commands. Reports relay throughput, frame latency
+percentiles, dropped frames and server CPU/RSS, and writes everything to a
+JSON file so runs can be compared across versions.
+
+    cd backend
+    python bench/hub_bench.py --agents 20 --viewers 2 --frame-kb 150 --fps 5 --duration 30
+    python bench/hub_bench.py --agents 20 --baseline bench/results/<previous>.json
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import websockets
+
+from openai_stub import start_stub
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class ProcessSampler:
+    """Samples CPU time and RSS of the server process (psutil, or /proc on Linux)"""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.rss_samples = []
+        try:
+            import psutil
+            self._proc = psutil.Process(pid)
+        except ImportError:
+            self._proc = None
+
+    def cpu_seconds(self) -> float:
+        if self._proc is not None:
+            times = self._proc.cpu_times()
+            return times.user + times.system
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    def rss_bytes(self) -> int:
+        if self._proc is not None:
+            return self._proc.memory_info().rss
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+        return 0
+
+    async def run(self, interval: float = 1.0):
+        while True:
+            self.rss_samples.append(self.rss_bytes())
+            await asyncio.sleep(interval)
+
+
+class Stats:
+    def __init__(self):
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.frames_received = 0
+        self.bytes_received = 0
+        self.latencies = []
+        self.gaps = 0
+        self.commands_sent = 0
+        self.command_replies = 0
+        self.command_latencies = []
+        self.sequences = 0
+        self.errors = 0
+
+
+async def run_agent(ws_url: str, code: str, frame: str, fps: float, stats: Stats, stop: asyncio.Event, stream: bool):
+    caps = "&caps=stream_actions" if stream else ""
+    async with websockets.connect(f"{ws_url}?code={code}&client_type=agent{caps}", max_size=None) as ws:
+        async def reply_to_commands():
+            async for message in ws:
+                data = json.loads(message)
+                if data.get("type") in ("execute_sequence", "sequence_end"):
+                    stats.sequences += 1
+                    await ws.send(json.dumps({"type": "sequence_complete", "results": []}))
+
+        replies = asyncio.create_task(reply_to_commands())
+        seq = 0
+        interval = 1 / fps
+        next_frame = time.perf_counter()
+        try:
+            while not stop.is_set():
+                seq += 1
+                # Same key order as the real agent, so the hub's type peek applies
+                message = json.dumps({"type": "screen_frame", "data": frame, "timestamp": time.time(), "seq": seq})
+                await ws.send(message)
+                stats.frames_sent += 1
+                stats.bytes_sent += len(message)
+                next_frame += interval
+                await asyncio.sleep(max(0, next_frame - time.perf_counter()))
+        finally:
+            replies.cancel()
+
+
+async def run_viewer(ws_url: str, code: str, command_interval: float, stats: Stats, stop: asyncio.Event, viewer: int):
+    async with websockets.connect(f"{ws_url}?code={code}&client_type=web", max_size=None) as ws:
+        pending = {}
+
+        async def receive():
+            last_seq = None
+            async for message in ws:
+                now = time.time()
+                if message.startswith('{"type": "screen_frame"'):
+                    data = json.loads(message)
+                    stats.frames_received += 1
+                    stats.bytes_received += len(message)
+                    stats.latencies.append(now - data["timestamp"])
+                    if last_seq is not None and data["seq"] > last_seq + 1:
+                        stats.gaps += data["seq"] - last_seq - 1
+                    last_seq = data["seq"]
+                    continue
+                data = json.loads(message)
+                if data.get("type") in ("command_processing", "error"):
+                    if data.get("type") == "error":
+                        stats.errors += 1
+                    stats.command_replies += 1
+                    if pending:
+                        sent_at = pending.pop(min(pending))
+                        stats.command_latencies.append(now - sent_at)
+
+        receiver = asyncio.create_task(receive())
+        n = 0
+        try:
+            while command_interval > 0 and not stop.is_set():
+                await asyncio.sleep(command_interval)
+                n += 1
+                # Unique wording so neither the fast path nor the plan cache answers it
+                await ws.send(json.dumps({"type": "command", "command": f"benchmark task {viewer}-{n}: summarise the open document"}))
+                pending[n] = time.time()
+                stats.commands_sent += 1
+            await stop.wait()
+        finally:
+            receiver.cancel()
+
+
+async def wait_for_server(port: int, timeout: float = 20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError("backend did not start")
+
+
+async def bench(args) -> dict:
+    stub = start_stub(0, args.llm_latency)
+    port = args.port or free_port()
+    env = {
+        **os.environ,
+        "OPENAI_API_KEY": "sk-bench",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{stub.server_port}/v1",
+        "PLAN_CACHE_MAX_ENTRIES": "0",
+    }
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env,
+    )
+    try:
+        await wait_for_server(port)
+        sampler = ProcessSampler(server.pid)
+        ws_url = f"ws://127.0.0.1:{port}/ws"
+        frame = base64.b64encode(os.urandom(args.frame_kb * 1024 * 3 // 4)).decode()
+        stats = Stats()
+        stop = asyncio.Event()
+
+        tasks = []
+        for a in range(args.agents):
+            code = f"bench-{a}"
+            for v in range(args.viewers):
+                tasks.append(asyncio.create_task(run_viewer(ws_url, code, args.command_interval, stats, stop, a * args.viewers + v)))
+        await asyncio.sleep(0.5)
+        for a in range(args.agents):
+            tasks.append(asyncio.create_task(run_agent(ws_url, f"bench-{a}", frame, args.fps, stats, stop, args.stream)))
+
+        sampling = asyncio.create_task(sampler.run())
+        await asyncio.sleep(args.warmup)
+        # Measure only the steady state after warm-up
+        warm = vars(Stats())
+        warm.update({k: v for k, v in vars(stats).items() if isinstance(v, int)})
+        stats.latencies.clear()
+        stats.command_latencies.clear()
+        cpu_start = sampler.cpu_seconds()
+        started = time.perf_counter()
+
+        await asyncio.sleep(args.duration)
+
+        elapsed = time.perf_counter() - started
+        cpu_used = sampler.cpu_seconds() - cpu_start
+        stop.set()
+        sampling.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+        stub.shutdown()
+
+    def delta(name):
+        return getattr(stats, name) - warm[name]
+
+    expected = delta("frames_sent") * args.viewers
+    ms = lambda v: None if v is None else round(v * 1000, 2)
+    return {
+        "config": {
+            "agents": args.agents, "viewers_per_agent": args.viewers, "frame_kb": args.frame_kb,
+            "fps": args.fps, "duration": args.duration, "llm_latency": args.llm_latency,
+            "command_interval": args.command_interval, "stream": args.stream,
+        },
+        "environment": {
+            "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+            "git": subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                                  capture_output=True, text=True).stdout.strip() or None,
+        },
+        "throughput": {
+            "frames_sent_per_s": round(delta("frames_sent") / elapsed, 1),
+            "frames_received_per_s": round(delta("frames_received") / elapsed, 1),
+            "mb_in_per_s": round(delta("bytes_sent") / elapsed / 1e6, 2),
+            "mb_out_per_s": round(delta("bytes_received") / elapsed / 1e6, 2),
+        },
+        "relay_latency_ms": {
+            "p50": ms(percentile(stats.latencies, 50)),
+            "p99": ms(percentile(stats.latencies, 99)),
+            "max": ms(max(stats.latencies, default=None)),
+        },
+        "frames": {
+            "expected": expected,
+            "received": delta("frames_received"),
+            "dropped": max(0, expected - delta("frames_received")),
+            "seq_gaps": delta("gaps"),
+        },
+        "commands": {
+            "sent": delta("commands_sent"),
+            "replies": delta("command_replies"),
+            "errors": delta("errors"),
+            "sequences_dispatched": delta("sequences"),
+            "reply_p50_ms": ms(percentile(stats.command_latencies, 50)),
+            "reply_p99_ms": ms(percentile(stats.command_latencies, 99)),
+        },
+        "server": {
+            "cpu_percent": round(cpu_used / elapsed * 100, 1),
+            "rss_mb_max": round(max(sampler.rss_samples, default=0) / 1e6, 1),
+            "rss_mb_last": round((sampler.rss_samples or [0])[-1] / 1e6, 1),
+        },
+    }
+
+
+# (section, key, higher_is_better)
+REGRESSION_CHECKS = [
+    ("throughput", "frames_received_per_s", True),
+    ("relay_latency_ms", "p50", False),
+    ("relay_latency_ms", "p99", False),
+    ("server", "cpu_percent", False),
+    ("server", "rss_mb_max", False),
+]
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list:
+    """Return human-readable regressions beyond ``tolerance`` (fraction)"""
+    regressions = []
+    for section, key, higher_is_better in REGRESSION_CHECKS:
+        new, old = result[section].get(key), baseline.get(section, {}).get(key)
+        if not new or not old:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        marker = "REGRESSION" if worse > tolerance else "ok"
+        print(f"  {section}.{key}: {old} -> {new} ({change:+.1%}) {marker}")
+        if worse > tolerance:
+            regressions.append(f"{section}.{key}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the /ws relay hub")
+    parser.add_argument("--agents", type=int, default=10)
+    parser.add_argument("--viewers", type=int, default=1, help="viewers per access code")
+    parser.add_argument("--frame-kb", type=int, default=150, help="base64 frame payload size")
+    parser.add_argument("--fps", type=float, default=5)
+    parser.add_argument("--duration", type=float, default=20, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--command-interval", type=float, default=5, help="seconds between commands per viewer (0 = none)")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="stub completion latency in seconds")
+    parser.add_argument("--stream", action="store_true", help="agents advertise streamed action plans")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="result file (default bench/results/<time>-<git>.json)")
+    parser.add_argument("--baseline", type=Path, help="earlier result to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed regression fraction")
+    args = parser.parse_args()
+
+    result = asyncio.run(bench(args))
+    print(json.dumps(result, indent=2))
+
+    output = args.output
+    if output is None:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        output = RESULTS_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}-{result['environment']['git'] or 'local'}.json"
+    output.write_text(json.dumps(result, indent=2))
+    print(f"\nResults written to {output}")
+
+    if args.baseline:
+        print(f"\nCompared with {args.baseline}:")
+        regressions = compare(result, json.loads(args.baseline.read_text()), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Local stand-in for the OpenAI chat completions API
+Answers POST /v1/chat/completions with a fixed action plan after a
+configurable delay, streamed (SSE) or not, so the hub can be benchmarked
+without network access or API spend
+
+    python bench/openai_stub.py --port 8765 --latency 1.5
+"""
+
+import argparse
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_PLAN = [
+    {"type": "open_url", "params": {"url": "https://www.youtube.com"}},
+    {"type": "wait", "params": {"seconds": 0}},
+    {"type": "keyboard_type", "params": {"text": "benchmark"}},
+    {"type": "keyboard_press", "params": {"key": "enter"}},
+]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 1.0
+    plan = DEFAULT_PLAN
+    requests = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        type(self).requests += 1
+
+        content = json.dumps(self.plan)
+        usage = {"prompt_tokens": 420, "completion_tokens": len(content) // 4, "total_tokens": 420 + len(content) // 4}
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+
+        if not body.get("stream"):
+            time.sleep(self.latency)
+            payload = json.dumps({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "stub"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": usage,
+            }).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        # Spread the latency over ~8 token chunks, like a real stream
+        pieces = [content[i:i + max(1, len(content) // 8)] for i in range(0, len(content), max(1, len(content) // 8))]
+        for piece in pieces:
+            time.sleep(self.latency / len(pieces))
+            self._send_event({
+                "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": body.get("model", "stub"),
+                "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+            })
+        self._send_event({
+            "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+            "model": body.get("model", "stub"), "choices": [], "usage": usage,
+        })
+        self._send_chunk(b"data: [DONE]\n\n")
+        self._send_chunk(b"")
+
+    def _send_event(self, event: dict):
+        self._send_chunk(f"data: {json.dumps(event)}\n\n".encode())
+
+    def _send_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+def start_stub(port: int = 0, latency: float = 1.0):
+    """Run the stub in a daemon thread; returns the server (server.server_port is the bound port)"""
+    handler = type("ConfiguredStubHandler", (StubHandler,), {"latency": latency})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI chat completions stub")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=1.0, help="seconds per completion")
+    args = parser.parse_args()
+
+    server = start_stub(args.port, args.latency)
+    print(f"OpenAI stub listening on http://127.0.0.1:{server.server_port}/v1 ({args.latency}s latency)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
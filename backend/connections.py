@@ -0,0 +1,443 @@
+"""
+WebSocket connection management for the AI Control backend
+Every socket gets its own outbound queue and writer task, so a slow peer
+never stalls the receive loop that is feeding it
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Optional, Set, Tuple, Union
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+import metrics
+import wire
+from routing import InMemoryRouter
+
+Payload = Union[str, bytes]
+
+# Agent messages are relayed without decoding; the type is read from the
+# first bytes, which json.dumps always writes as {"type": "..."
+_TYPE_PEEK = re.compile(r'\s*\{\s*"type"\s*:\s*"([A-Za-z_]+)"')
+PEEK_BYTES = 64
+
+# Message types where only the newest one matters to a viewer
+DROPPABLE_TYPES = {'screen_frame', 'screen_delta'}
+
+# Screen updates that only apply on top of every earlier one since the last
+# keyframe (screen_frame); losing one means the viewer needs a new keyframe
+DELTA_TYPES = {'screen_delta'}
+
+# Deltas a slow viewer may have queued before it is resynced with a keyframe
+MAX_PENDING_DELTAS = int(os.getenv('WS_MAX_PENDING_DELTAS', '8'))
+
+# Shortest gap between keyframe requests sent to one agent
+KEYFRAME_REQUEST_INTERVAL = 1.0
+
+# A socket write that takes longer than this is treated as a dead peer
+SEND_TIMEOUT = float(os.getenv('WS_SEND_TIMEOUT', '10'))
+
+
+def peek_message_type(raw: Payload) -> str:
+    """Return the message type of a JSON or msgpack message without parsing it"""
+    if not isinstance(raw, str):
+        return wire.peek_msgpack_type(raw[:PEEK_BYTES])
+    match = _TYPE_PEEK.match(raw, 0, PEEK_BYTES)
+    return match.group(1) if match else ''
+
+
+def transcode(raw: Payload, codec: wire.Codec, cache: dict, binary_frames: bool = False) -> Payload:
+    """``raw`` re-encoded for ``codec``, decoding and encoding at most once per message
+
+    ``cache`` is shared by every receiver of the same message. JSON and
+    orjson produce the same text, so text is only re-encoded for msgpack
+    receivers and the other way round. Binary screen frames pass through
+    to receivers that accept them and are turned into ordinary messages
+    for the rest.
+    """
+    if wire.is_frame(raw):
+        if binary_frames:
+            return raw
+    elif codec.binary == (not isinstance(raw, str)):
+        return raw
+    payload = cache.get(codec.name)
+    if payload is None:
+        if 'decoded' not in cache:
+            cache['decoded'] = wire.loads(raw)
+        payload = cache[codec.name] = codec.dumps(cache['decoded'])
+    return payload
+
+
+async def receive_raw(websocket: WebSocket) -> Payload:
+    """Receive the next text or bytes message as-is"""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    text = message.get("text")
+    return text if text is not None else message.get("bytes")
+
+
+def session_id(access_code: str) -> str:
+    """Stable, non-secret identifier for an access code, safe to expose in stats"""
+    return hashlib.sha256(access_code.encode()).hexdigest()[:10]
+
+
+class ClientChannel:
+    """Bounded outbound queue plus writer task for one websocket
+
+    Control and result messages are queued in order and never dropped; when
+    the queue is full, senders wait, except relays (``wait=False``), which
+    close the channel instead so one stuck viewer can't hold up the agent
+    or the other viewers; the heartbeat then reaps it. A keyframe replaces any screen updates
+    the viewer has not received yet. Deltas queue behind it up to
+    MAX_PENDING_DELTAS; past that, or once one has been dropped, further
+    deltas are dropped and ``needs_keyframe`` is set until the next keyframe.
+    """
+
+    def __init__(self, websocket: WebSocket, max_depth: int = 64, access_code: str = '', role: str = 'web',
+                 codec: wire.Codec = wire.JSON, binary_frames: bool = False, wants_frames: bool = True):
+        self.websocket = websocket
+        self.codec = codec
+        # Screen frames go out in wire.pack_frame form instead of through the codec
+        self.binary_frames = binary_frames
+        # Unset for viewers that only want control messages and results
+        self.wants_frames = wants_frames
+        self.max_depth = max_depth
+        self.access_code = access_code
+        self.role = role
+        self._control: Deque[Tuple[Payload, float]] = deque()
+        self._frames: Deque[Tuple[Payload, float]] = deque()
+        # Set until a keyframe reaches the queue; new viewers start without one
+        self.needs_keyframe = role == 'web' and wants_frames
+        self._ready = asyncio.Event()
+        self._space = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.closed = False
+        self.connected_at = time.time()
+        # Liveness, see heartbeat.Heartbeat
+        self.last_seen = time.monotonic()
+        self.reader: Optional[asyncio.Task] = None
+        self.reaped = False
+        self.rtt: Optional[float] = None
+
+        self.messages_sent = 0
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.deltas_skipped = 0
+        self.max_queue_depth = 0
+        self.overflowed = False
+
+    def start(self):
+        self._task = asyncio.create_task(self._writer())
+
+    def close(self):
+        self.closed = True
+        self._space.set()
+        # Wakes the writer so it exits even if wait_for swallowed the cancel
+        self._ready.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    def touch(self):
+        """Record that the peer sent something, so it is alive"""
+        self.last_seen = time.monotonic()
+
+    @property
+    def control_depth(self) -> int:
+        return len(self._control)
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._control) + len(self._frames)
+
+    def _drop_frames(self, count: int):
+        self.frames_dropped += count
+        metrics.frames_dropped.inc(count)
+
+    async def send(self, payload: Payload, droppable: bool = False, delta: bool = False, wait: bool = True) -> bool:
+        """Queue an encoded message; returns False if the channel is closed
+
+        With ``wait`` unset this never blocks: a full control queue closes
+        the channel.
+        """
+        if self.closed:
+            return False
+
+        if delta:
+            if self.needs_keyframe:
+                # Useless without the keyframe it builds on; not a sign of congestion
+                self.deltas_skipped += 1
+                return True
+            if len(self._frames) >= MAX_PENDING_DELTAS:
+                self.needs_keyframe = True
+                self._drop_frames(1)
+                return True
+            self._frames.append((payload, time.monotonic()))
+        elif droppable:
+            if self._frames:
+                self._drop_frames(len(self._frames))
+                self._frames.clear()
+            self._frames.append((payload, time.monotonic()))
+            self.needs_keyframe = False
+        else:
+            if not wait and len(self._control) >= self.max_depth:
+                print(f"Control queue full ({self.max_depth}), closing {self.role} channel")
+                self.overflowed = True
+                self.close()
+                return False
+            while len(self._control) >= self.max_depth and not self.closed:
+                self._space.clear()
+                await self._space.wait()
+            if self.closed:
+                return False
+            self._control.append((payload, time.monotonic()))
+
+        depth = self.queue_depth
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+        self._ready.set()
+        return True
+
+    async def send_json(self, message: dict) -> bool:
+        """Encode a message with the channel's codec and queue it"""
+        return await self.send(self.codec.dumps(message))
+
+    async def _writer(self):
+        try:
+            while not self.closed:
+                await self._ready.wait()
+                while (self._control or self._frames) and not self.closed:
+                    if self._control:
+                        payload, _ = self._control.popleft()
+                        self._space.set()
+                        queued_at = None
+                    else:
+                        payload, queued_at = self._frames.popleft()
+                        self.frames_sent += 1
+
+                    if isinstance(payload, str):
+                        await asyncio.wait_for(self.websocket.send_text(payload), SEND_TIMEOUT)
+                    else:
+                        await asyncio.wait_for(self.websocket.send_bytes(payload), SEND_TIMEOUT)
+                    self.messages_sent += 1
+                    if queued_at is not None:
+                        metrics.relay_latency.observe(time.monotonic() - queued_at)
+                self._ready.clear()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Send failed, closing channel: {e!r}")
+            self.closed = True
+            self._space.set()
+
+    def stats(self) -> dict:
+        return {
+            "codec": self.codec.name,
+            "binary_frames": self.binary_frames,
+            "wants_frames": self.wants_frames,
+            "connected_seconds": round(time.time() - self.connected_at, 1),
+            "idle_seconds": round(time.monotonic() - self.last_seen, 1),
+            "rtt_ms": None if self.rtt is None else round(self.rtt * 1000, 1),
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "messages_sent": self.messages_sent,
+            "frames_sent": self.frames_sent,
+            "frames_dropped": self.frames_dropped,
+            "deltas_skipped": self.deltas_skipped,
+            "overflowed": self.overflowed,
+        }
+
+
+# Store active connections
+class ConnectionManager:
+    """Local sockets for this worker, plus a router to reach peers on other workers"""
+
+    def __init__(self, router=None):
+        # Any number of viewers (dashboard tabs, admin, support) per access code
+        self.active_connections: Dict[str, Set[ClientChannel]] = {}
+        self.agent_connections: Dict[str, ClientChannel] = {}
+        self.agent_caps: Dict[str, Set[str]] = {}
+        self.router = router if router is not None else InMemoryRouter()
+        # access_code -> monotonic time of the last request_keyframe sent for it
+        self._keyframe_requested: Dict[str, float] = {}
+        # Called with (access_code, msg_type, payload) for every non-frame agent
+        # message, whether the agent is local or on another worker
+        self.on_agent_event: Optional[Callable[[str, str, Payload], None]] = None
+
+    async def start(self):
+        await self.router.start(self.deliver_routed)
+
+    async def stop(self):
+        await self.router.stop()
+
+    async def deliver_routed(self, access_code: str, role: str, payload: Payload, droppable: bool):
+        """Deliver a message another worker published for a peer we hold"""
+        if role == "agent":
+            channel = self.agent_connections.get(access_code)
+            if channel is not None:
+                await channel.send(transcode(payload, channel.codec, {}, channel.binary_frames), droppable)
+        else:
+            msg_type = peek_message_type(payload)
+            if not droppable and self.on_agent_event is not None:
+                self.on_agent_event(access_code, msg_type, payload)
+            await self._fan_out(access_code, payload, droppable, msg_type in DELTA_TYPES)
+
+    @staticmethod
+    async def _open(websocket: WebSocket, access_code: str, role: str, codec: Optional[wire.Codec],
+                    binary_frames: bool, wants_frames: bool = True) -> ClientChannel:
+        await websocket.accept()
+        channel = ClientChannel(websocket, access_code=access_code, role=role, codec=codec or wire.JSON,
+                                binary_frames=binary_frames, wants_frames=wants_frames)
+        channel.start()
+        if codec is not None or binary_frames or not wants_frames:
+            # Plain JSON, since the client doesn't know the codec until it reads this
+            await channel.send(json.dumps({
+                "type": "hello",
+                "codec": channel.codec.name,
+                "frames": "none" if not wants_frames else "binary" if binary_frames else "json",
+            }))
+        return channel
+
+    async def connect_web(self, access_code: str, websocket: WebSocket, codec: Optional[wire.Codec] = None,
+                          binary_frames: bool = False, wants_frames: bool = True) -> ClientChannel:
+        """Accept a viewer; ``codec`` is set when the client negotiated one"""
+        channel = await self._open(websocket, access_code, "web", codec, binary_frames, wants_frames)
+        self.active_connections.setdefault(access_code, set()).add(channel)
+        await self.router.join(access_code, "web")
+        metrics.connects.labels("web").inc()
+        if wants_frames:
+            # Agents sending deltas only send a full screen every few seconds otherwise
+            await self.request_keyframe(access_code)
+        return channel
+
+    async def connect_agent(self, access_code: str, websocket: WebSocket, caps: Set[str] = frozenset(),
+                            codec: Optional[wire.Codec] = None, binary_frames: bool = False) -> ClientChannel:
+        channel = await self._open(websocket, access_code, "agent", codec, binary_frames)
+        previous = self.agent_connections.get(access_code)
+        if previous is not None:
+            # The reconnecting agent wins; the heartbeat evicts the old socket
+            previous.close()
+            metrics.disconnects.labels("agent").inc()
+        else:
+            await self.router.join(access_code, "agent")
+        self.agent_connections[access_code] = channel
+        self.agent_caps[access_code] = set(caps)
+        metrics.connects.labels("agent").inc()
+        return channel
+
+    async def disconnect_web(self, access_code: str, channel: ClientChannel):
+        """Forget a viewer; safe to call more than once"""
+        channel.close()
+        viewers = self.active_connections.get(access_code)
+        if viewers is not None and channel in viewers:
+            metrics.disconnects.labels("web").inc()
+            viewers.discard(channel)
+            if not viewers:
+                del self.active_connections[access_code]
+                self._keyframe_requested.pop(access_code, None)
+            await self.router.leave(access_code, "web")
+
+    async def disconnect_agent(self, access_code: str, channel: ClientChannel):
+        """Forget an agent; safe to call more than once"""
+        channel.close()
+        if self.agent_connections.get(access_code) is channel:
+            metrics.disconnects.labels("agent").inc()
+            del self.agent_connections[access_code]
+            self.agent_caps.pop(access_code, None)
+            await self.router.leave(access_code, "agent")
+
+    async def disconnect(self, channel: ClientChannel):
+        if channel.role == "agent":
+            await self.disconnect_agent(channel.access_code, channel)
+        else:
+            await self.disconnect_web(channel.access_code, channel)
+
+    def channels(self):
+        """Every local channel, agents and viewers"""
+        yield from self.agent_connections.values()
+        for viewers in self.active_connections.values():
+            yield from viewers
+
+    def agent_reachable(self, access_code: str) -> bool:
+        """True if the agent is local, or might be held by another worker"""
+        return access_code in self.agent_connections or self.router.distributed
+
+    async def send_to_agent(self, access_code: str, message: dict) -> bool:
+        channel = self.agent_connections.get(access_code)
+        if channel is not None:
+            return await channel.send_json(message)
+        if self.router.distributed:
+            await self.router.publish(access_code, "agent", wire.TEXT.dumps(message))
+            return True
+        return False
+
+    def agent_supports(self, access_code: str, cap: str) -> bool:
+        # Capabilities of agents held by other workers are unknown, so
+        # callers fall back to the baseline protocol for them
+        return cap in self.agent_caps.get(access_code, ())
+
+    def viewer_count(self, access_code: Optional[str] = None) -> int:
+        if access_code is not None:
+            return len(self.active_connections.get(access_code, ()))
+        return sum(len(viewers) for viewers in self.active_connections.values())
+
+    async def send_to_web(self, access_code: str, message: dict):
+        if access_code in self.active_connections:
+            await self.relay_to_web(access_code, wire.TEXT.dumps(message), message.get('type', ''))
+
+    async def relay_to_web(self, access_code: str, raw: Payload, msg_type: str = ''):
+        """Fan an already-encoded message out to every viewer of a code
+
+        The same buffer is queued for each local viewer without waiting on
+        any of them; a viewer whose control queue is full is closed rather
+        than waited for. Viewers on other workers get it through the router.
+        """
+        droppable = msg_type in DROPPABLE_TYPES
+        if not droppable and self.on_agent_event is not None:
+            self.on_agent_event(access_code, msg_type, raw)
+        await self._fan_out(access_code, raw, droppable, msg_type in DELTA_TYPES)
+        if self.router.distributed:
+            await self.router.publish(access_code, "web", raw, droppable)
+
+    async def _fan_out(self, access_code: str, raw: Payload, droppable: bool, delta: bool = False):
+        viewers = self.active_connections.get(access_code)
+        if not viewers:
+            return
+        # One encoding per codec in use, shared by every viewer using it
+        encoded = {}
+        for channel in list(viewers):
+            if droppable and not channel.wants_frames:
+                continue
+            try:
+                payload = transcode(raw, channel.codec, encoded, channel.binary_frames)
+            except ValueError as e:
+                # Only this viewer's codec is affected; the rest still get it
+                metrics.json_parse_failures.labels('relay').inc()
+                print(f"Could not transcode message for a {channel.codec.name} viewer: {e}")
+                continue
+            await channel.send(payload, droppable, delta, wait=False)
+        if delta and any(channel.needs_keyframe for channel in viewers):
+            await self.request_keyframe(access_code)
+
+    async def request_keyframe(self, access_code: str):
+        """Ask the agent for a full frame, at most once per KEYFRAME_REQUEST_INTERVAL"""
+        now = time.monotonic()
+        if now - self._keyframe_requested.get(access_code, float('-inf')) < KEYFRAME_REQUEST_INTERVAL:
+            return
+        self._keyframe_requested[access_code] = now
+        if await self.send_to_agent(access_code, {"type": "request_keyframe"}):
+            metrics.keyframe_requests.inc()
+
+    def session_stats(self) -> Dict[str, dict]:
+        """Per-session queue and drop counters, keyed by session_id()"""
+        sessions: Dict[str, dict] = {}
+        for access_code, channel in self.agent_connections.items():
+            sessions.setdefault(session_id(access_code), {})["agent"] = channel.stats()
+        for access_code, viewers in self.active_connections.items():
+            sessions.setdefault(session_id(access_code), {})["viewers"] = [channel.stats() for channel in viewers]
+        return sessions
@@ -0,0 +1,262 @@
+"""
+Local fast-path planner
+Deterministic rules for simple commands ("open youtube.com", "type hello",
+"press cmd+c", "scroll down") that produce the same action list the LLM
+would, without a round trip. Anything it can't parse confidently returns
+None and goes to the LLM.
+"""
+
+import re
+from typing import List, Optional, Sequence
+from urllib.parse import quote_plus
+
+import metrics
+
+KNOWN_SITES = {
+    'youtube': 'https://www.youtube.com',
+    'google': 'https://www.google.com',
+    'gmail': 'https://mail.google.com',
+    'github': 'https://github.com',
+    'facebook': 'https://www.facebook.com',
+    'twitter': 'https://twitter.com',
+    'linkedin': 'https://www.linkedin.com',
+    'reddit': 'https://www.reddit.com',
+    'netflix': 'https://www.netflix.com',
+    'amazon': 'https://www.amazon.com',
+    'wikipedia': 'https://www.wikipedia.org',
+    'chatgpt': 'https://chat.openai.com',
+}
+
+# Lower-case spoken name -> name passed to open_app. These are the macOS
+# application names, which every agent version launches with ``open -a``;
+# newer agents map them to what other platforms launch (APP_NAMES in
+# desktop-agent/agent.py)
+KNOWN_APPS = {
+    'safari': 'Safari',
+    'chrome': 'Google Chrome',
+    'google chrome': 'Google Chrome',
+    'firefox': 'Firefox',
+    'edge': 'Microsoft Edge',
+    'microsoft edge': 'Microsoft Edge',
+    'terminal': 'Terminal',
+    'vscode': 'Visual Studio Code',
+    'vs code': 'Visual Studio Code',
+    'visual studio code': 'Visual Studio Code',
+    'finder': 'Finder',
+    'notes': 'Notes',
+    'calculator': 'Calculator',
+    'calendar': 'Calendar',
+    'mail': 'Mail',
+    'messages': 'Messages',
+    'music': 'Music',
+    'spotify': 'Spotify',
+    'slack': 'Slack',
+    'zoom': 'zoom.us',
+    'notepad': 'notepad',
+    'textedit': 'TextEdit',
+    'system settings': 'System Settings',
+    'system preferences': 'System Settings',
+    'settings': 'System Settings',
+}
+
+KEY_NAMES = {
+    'enter', 'return', 'tab', 'space', 'backspace', 'delete', 'esc', 'escape',
+    'up', 'down', 'left', 'right', 'home', 'end', 'pageup', 'pagedown',
+    'cmd', 'command', 'ctrl', 'control', 'alt', 'option', 'shift', 'win', 'fn',
+} | {f'f{i}' for i in range(1, 13)}
+
+_KEY_ALIASES = {'command': 'cmd', 'control': 'ctrl', 'option': 'alt', 'escape': 'esc', 'return': 'enter'}
+
+# Seconds to let a page or app load before the next step, as the LLM plans it
+LOAD_WAIT = 2
+
+# Words that point back at an earlier command ("now pause it", "type that
+# again"); with session history those need the LLM to resolve them
+_BACK_REFERENCE = re.compile(r'\b(?:it|its|that|this|these|those|them|there|again|same|previous|last one)\b', re.I)
+_QUOTED = re.compile(r'"[^"]*"|\'[^\']*\'')
+# Unquoted text to type containing one of these may be several steps
+# ("type hello and press enter"); only quoted text is typed verbatim
+_CONNECTOR = re.compile(r',|\n|\b(?:and|then)\b', re.I)
+
+_SPLIT = re.compile(r'\s*(?:,\s*and\s+then|,\s*then|\band\s+then|\bthen|\band|,)\s+', re.I)
+_DOMAIN = re.compile(r'^(https?://)?([\w-]+\.)+[a-z]{2,}(/\S*)?$', re.I)
+
+_OPEN = re.compile(r'^(?:open|launch|start|go to|goto|visit|navigate to)\s+(?:the\s+)?(.+?)(?:\s+app)?$', re.I)
+# Not "write": "write a script that ..." is a task for the LLM, not text to type
+_TYPE = re.compile(r'^(?:type|enter text)\s+(.+)$', re.I | re.S)
+_PRESS = re.compile(r'^(?:press|hit|push)\s+(?:the\s+)?([\w+\- ]+?)(?:\s+key)?$', re.I)
+_SCROLL = re.compile(r'^scroll\s+(up|down)(?:\s+(\d+))?(?:\s+times)?$', re.I)
+_WAIT = re.compile(r'^(?:wait|sleep|pause)(?:\s+for)?\s+(\d+(?:\.\d+)?)\s*(?:s|sec|secs|seconds?)?$', re.I)
+_BARE_SEARCH = re.compile(r'^(?:search|look up)\s+(?:for\s+)?(.+)$', re.I)
+_SEARCH = re.compile(r'^(?:search|look up)\s+(?:on\s+)?(google|youtube)\s+for\s+(.+)$'
+                     r'|^(?:search|look up)\s+(?:for\s+)?(.+?)\s+on\s+(google|youtube)$'
+                     r'|^(google)\s+(.+)$', re.I)
+
+
+def refers_back(command: str) -> bool:
+    """Whether the command mentions something from earlier, outside quoted text"""
+    return bool(_BACK_REFERENCE.search(_QUOTED.sub(' ', command)))
+
+
+def _unquote(text: str) -> str:
+    text = text.strip()
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in '"\'':
+        return text[1:-1]
+    return text
+
+
+def _search_url(engine: str, query: str) -> str:
+    query = quote_plus(_unquote(query))
+    if engine.lower() == 'youtube':
+        return f'https://www.youtube.com/results?search_query={query}'
+    return f'https://www.google.com/search?q={query}'
+
+
+def _parse_key(spec: str) -> Optional[str]:
+    parts = [p.strip().lower() for p in re.split(r'\s*\+\s*|\s+', spec.strip()) if p.strip()]
+    if not parts:
+        return None
+    keys = []
+    for part in parts:
+        if part in KEY_NAMES:
+            keys.append(_KEY_ALIASES.get(part, part))
+        elif len(part) == 1:
+            keys.append(part)
+        else:
+            return None
+    return '+'.join(keys)
+
+
+def _parse_step(step: str) -> Optional[List[dict]]:
+    """Plan one clause, or None if it doesn't match a rule exactly"""
+    step = step.strip().rstrip('.!')
+    if not step:
+        return None
+
+    match = _TYPE.match(step)
+    if match:
+        text = match.group(1).strip()
+        unquoted = _unquote(text)
+        if unquoted == text and _CONNECTOR.search(text):
+            return None
+        return [{"type": "keyboard_type", "params": {"text": unquoted}}]
+
+    match = _SEARCH.match(step)
+    if match:
+        if match.group(1):
+            engine, query = match.group(1), match.group(2)
+        elif match.group(4):
+            engine, query = match.group(4), match.group(3)
+        else:
+            engine, query = match.group(5), match.group(6)
+        return [{"type": "open_url", "params": {"url": _search_url(engine, query)}}]
+
+    match = _OPEN.match(step)
+    if match:
+        target = match.group(1).strip()
+        lowered = target.lower()
+        if lowered in KNOWN_APPS:
+            return [{"type": "open_app", "params": {"app": KNOWN_APPS[lowered]}}]
+        if lowered in KNOWN_SITES:
+            return [{"type": "open_url", "params": {"url": KNOWN_SITES[lowered]}}]
+        if _DOMAIN.match(target):
+            url = target if target.lower().startswith(('http://', 'https://')) else f'https://{target}'
+            return [{"type": "open_url", "params": {"url": url}}]
+        return None
+
+    match = _PRESS.match(step)
+    if match:
+        key = _parse_key(match.group(1))
+        return [{"type": "keyboard_press", "params": {"key": key}}] if key else None
+
+    match = _SCROLL.match(step)
+    if match:
+        amount = int(match.group(2) or 3)
+        # Positive scrolls down, matching the action schema in the system prompt
+        return [{"type": "scroll", "params": {"amount": amount if match.group(1).lower() == 'down' else -amount}}]
+
+    match = _WAIT.match(step)
+    if match:
+        seconds = float(match.group(1))
+        return [{"type": "wait", "params": {"seconds": int(seconds) if seconds.is_integer() else seconds}}]
+
+    return None
+
+
+class FastPlanner:
+    """Rule-based planner tried before the LLM"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def plan(self, command: str, history: Optional[Sequence] = None) -> Optional[List[dict]]:
+        """Actions for ``command``, or None; with session ``history``, back-references are left to the LLM"""
+        if history and refers_back(command or ''):
+            actions = None
+        else:
+            actions = self._plan(command or '')
+        if actions is None:
+            self.misses += 1
+            metrics.fast_planner.labels('miss').inc()
+        else:
+            self.hits += 1
+            metrics.fast_planner.labels('hit').inc()
+        return actions
+
+    def _plan(self, command: str) -> Optional[List[dict]]:
+        command = command.strip()
+        if not command or len(command) > 300:
+            return None
+
+        # "open safari and type hello" splits into clauses; 'type "rock and
+        # roll"' doesn't because "roll" isn't a clause, so it is parsed whole below
+        clauses = _SPLIT.split(command)
+        if len(clauses) > 1:
+            steps = []
+            for clause in clauses:
+                step = _parse_step(clause)
+                if step is None and steps:
+                    step = self._search_on_previous(steps, clause)
+                    if step is not None:
+                        # The search URL replaces opening the site's home page
+                        steps.pop()
+                if step is None:
+                    break
+                steps.append(step)
+            else:
+                return self._with_load_waits(steps)
+
+        return _parse_step(command)
+
+    @staticmethod
+    def _search_on_previous(steps: List[List[dict]], clause: str) -> Optional[List[dict]]:
+        """Turn "open youtube and search for X" into the YouTube results page for X"""
+        match = _BARE_SEARCH.match(clause.strip().rstrip('.!'))
+        previous = steps[-1]
+        if not match or len(previous) != 1 or previous[0]["type"] != "open_url":
+            return None
+        url = previous[0]["params"]["url"]
+        for engine in ('youtube', 'google'):
+            if url == KNOWN_SITES[engine]:
+                return [{"type": "open_url", "params": {"url": _search_url(engine, match.group(1))}}]
+        return None
+
+    @staticmethod
+    def _with_load_waits(steps: List[List[dict]]) -> List[dict]:
+        actions = []
+        for i, step in enumerate(steps):
+            actions.extend(step)
+            is_last = i == len(steps) - 1
+            next_is_wait = not is_last and steps[i + 1][0]["type"] == "wait"
+            if step[-1]["type"] in ("open_url", "open_app") and not is_last and not next_is_wait:
+                actions.append({"type": "wait", "params": {"seconds": LOAD_WAIT}})
+        return actions
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
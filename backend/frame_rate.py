@@ -0,0 +1,261 @@
+"""
+Adaptive capture rate for desktop agents
+Watches how fast each session's viewers actually receive frames and how
+much is being dropped, and sends ``set_fps`` to the agent: faster while a
+command sequence runs, slower when nobody is watching, the viewer is idle
+or the viewer can't keep up. Agents that stream video (caps=video) get a
+higher default and maximum, since an inter-frame codec makes 15-30 fps
+cheaper than 5 fps of JPEGs.
+"""
+
+import asyncio
+import os
+import time
+from typing import Callable, Dict, Optional
+
+import metrics
+from connections import session_id
+
+# Frame drop ratio (per viewer, smoothed) above which the rate is lowered,
+# and below which it may be raised again; the gap between them is the dead band
+DROP_HIGH = 0.25
+DROP_LOW = 0.05
+# Control queue depth that counts as back-pressure even without frame drops
+QUEUE_PRESSURE = 16
+# Weight of the newest interval in the smoothed rates
+SMOOTHING = 0.5
+# Agents start at this rate, see AIControlAgent.fps (desktop-agent/agent.py)
+# and CaptureWorker.fps (desktop-agent/capture.py)
+AGENT_DEFAULT_FPS = 5
+
+
+class SessionRate:
+    def __init__(self, agent, fps: float, default_fps: float, max_fps: float):
+        self.agent = agent
+        self.fps = fps
+        self.default_fps = default_fps
+        self.max_fps = max_fps
+        self.ceiling = max_fps
+        self.changed_at = time.monotonic()
+        self.active_until = 0.0
+        self.last_input = time.monotonic()
+        self.drop_ratio = 0.0
+        self.delivered = 0.0
+        # ClientChannel -> (frames_sent, frames_dropped) at the previous tick
+        self.counters: Dict[object, tuple] = {}
+
+
+class FrameRateController:
+    """Per-session set_fps control loop with hysteresis
+
+    The target comes from the session's state (sequence running, viewer
+    active, viewer idle, no viewer) capped by a ceiling that backs off
+    while the best-served viewer is dropping frames and creeps back up one
+    fps at a time once it isn't. Ceiling increases wait ``hold`` seconds
+    after the last change and lowering under pressure happens at most once
+    per tick; state changes use ``idle_after`` and ``active_linger`` so a
+    pause between commands doesn't flip the rate back and forth.
+    """
+
+    def __init__(self, manager, is_busy: Callable[[str], bool], enabled: bool = True,
+                 min_fps: float = 1, idle_fps: float = 2, default_fps: float = 5, max_fps: float = 10,
+                 video_default_fps: float = 15, video_max_fps: float = 30,
+                 interval: float = 2.0, hold: float = 6.0, idle_after: float = 30.0, active_linger: float = 5.0):
+        self.manager = manager
+        self.is_busy = is_busy
+        self.enabled = enabled
+        self.min_fps = min_fps
+        self.idle_fps = idle_fps
+        self.default_fps = default_fps
+        self.max_fps = max_fps
+        self.video_default_fps = video_default_fps
+        self.video_max_fps = video_max_fps
+        self.interval = interval
+        self.hold = hold
+        self.idle_after = idle_after
+        self.active_linger = active_linger
+        self.sessions: Dict[str, SessionRate] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.changes = 0
+
+    @classmethod
+    def from_env(cls, manager, is_busy) -> "FrameRateController":
+        return cls(
+            manager, is_busy,
+            enabled=os.getenv('ADAPTIVE_FPS', '1') == '1',
+            min_fps=float(os.getenv('FPS_MIN', '1')),
+            idle_fps=float(os.getenv('FPS_IDLE', '2')),
+            default_fps=float(os.getenv('FPS_DEFAULT', '5')),
+            max_fps=float(os.getenv('FPS_MAX', '10')),
+            video_default_fps=float(os.getenv('FPS_DEFAULT_VIDEO', '15')),
+            video_max_fps=float(os.getenv('FPS_MAX_VIDEO', '30')),
+            interval=float(os.getenv('FPS_INTERVAL', '2')),
+            hold=float(os.getenv('FPS_HOLD', '6')),
+            idle_after=float(os.getenv('FPS_IDLE_AFTER', '30')),
+        )
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def viewer_input(self, access_code: str):
+        """Record viewer activity (commands, remote input) for idle detection"""
+        session = self.sessions.get(access_code)
+        if session is not None:
+            session.last_input = time.monotonic()
+
+    async def command_started(self, access_code: str):
+        """Raise the rate right away when a command is about to run
+
+        Called before the plan is dispatched, so the agent sees set_fps
+        ahead of the sequence rather than after it.
+        """
+        if not self.enabled:
+            return
+        session = self._session(access_code)
+        if session is None:
+            return
+        now = time.monotonic()
+        session.last_input = now
+        session.active_until = now + self.active_linger
+        target = min(session.max_fps, session.ceiling)
+        if target > session.fps:
+            await self._apply(access_code, session, target, now)
+
+    def _session(self, access_code: str) -> Optional[SessionRate]:
+        agent = self.manager.agent_connections.get(access_code)
+        if agent is None:
+            # The agent is on another worker; that worker controls its rate
+            self.sessions.pop(access_code, None)
+            return None
+        session = self.sessions.get(access_code)
+        if session is None or session.agent is not agent:
+            # New agent connection, which starts at its built-in rate
+            if self.manager.agent_supports(access_code, 'video'):
+                session = SessionRate(agent, AGENT_DEFAULT_FPS, self.video_default_fps, self.video_max_fps)
+            else:
+                session = SessionRate(agent, AGENT_DEFAULT_FPS, self.default_fps, self.max_fps)
+            self.sessions[access_code] = session
+        return session
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.tick()
+            except Exception as e:
+                print(f"Frame rate control error: {e}")
+
+    async def tick(self):
+        for access_code in [code for code in self.sessions if code not in self.manager.agent_connections]:
+            del self.sessions[access_code]
+        for access_code in list(self.manager.agent_connections):
+            session = self._session(access_code)
+            if session is not None:
+                await self._update(access_code, session)
+
+    async def _update(self, access_code: str, session: SessionRate):
+        now = time.monotonic()
+        # Viewers that opted out of frames (frames=none) aren't watching
+        viewers = [channel for channel in self.manager.active_connections.get(access_code, ())
+                   if channel.wants_frames]
+
+        if not viewers:
+            if self.manager.router.distributed:
+                # Viewers may be on another worker; we can't see their queues
+                return
+            target = self.min_fps
+            limited = False
+            session.counters.clear()
+        else:
+            if any(channel not in session.counters for channel in viewers):
+                # A viewer that just opened the dashboard is watching
+                session.last_input = now
+            self._measure(session, viewers)
+            pressure = session.drop_ratio > DROP_HIGH or any(
+                channel.control_depth >= QUEUE_PRESSURE for channel in viewers)
+            if pressure:
+                # One step down per tick. Not towards the delivered rate: a quiet
+                # screen sends few frames, so that would pin the rate near zero
+                session.ceiling = max(self.min_fps, session.fps - 1)
+            elif session.drop_ratio < DROP_LOW and now - session.changed_at >= self.hold:
+                session.ceiling = min(session.max_fps, session.ceiling + 1)
+
+            if self.is_busy(access_code):
+                session.active_until = now + self.active_linger
+            if now < session.active_until:
+                target = session.max_fps
+            elif now - session.last_input >= self.idle_after:
+                target = self.idle_fps
+            else:
+                target = session.default_fps
+            limited = target > session.ceiling
+            target = min(target, session.ceiling)
+
+        target = max(self.min_fps, target)
+        if target == session.fps:
+            return
+        if target > session.fps and limited and now - session.changed_at < self.hold:
+            # Recovering from back-pressure; give the last step time to settle
+            return
+        await self._apply(access_code, session, target, now)
+
+    def _measure(self, session: SessionRate, viewers):
+        """Smoothed delivered fps and drop ratio of the best-served viewer
+
+        A background tab that can't keep up shouldn't slow the stream for a
+        viewer that can; it just keeps dropping to the newest frame.
+        """
+        elapsed = self.interval
+        best_delivered, best_ratio = None, 0.0
+        counters = {}
+        for channel in viewers:
+            sent, dropped = channel.frames_sent, channel.frames_dropped
+            counters[channel] = (sent, dropped)
+            previous = session.counters.get(channel)
+            if previous is None:
+                continue
+            d_sent, d_dropped = sent - previous[0], dropped - previous[1]
+            delivered = d_sent / elapsed
+            ratio = d_dropped / (d_sent + d_dropped) if d_sent + d_dropped else 0.0
+            if best_delivered is None or delivered > best_delivered:
+                best_delivered, best_ratio = delivered, ratio
+        session.counters = counters
+
+        if best_delivered is not None:
+            session.delivered += SMOOTHING * (best_delivered - session.delivered)
+            session.drop_ratio += SMOOTHING * (best_ratio - session.drop_ratio)
+
+    async def _apply(self, access_code: str, session: SessionRate, fps: float, now: float):
+        fps = int(fps) if float(fps).is_integer() else round(fps, 1)
+        if not await self.manager.send_to_agent(access_code, {"type": "set_fps", "fps": fps}):
+            return
+        metrics.fps_changes.labels('up' if fps > session.fps else 'down').inc()
+        self.changes += 1
+        session.fps = fps
+        session.changed_at = now
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "changes": self.changes,
+            "sessions": {
+                session_id(code): {
+                    "fps": session.fps,
+                    "ceiling": session.ceiling,
+                    "max_fps": session.max_fps,
+                    "delivered_fps": round(session.delivered, 2),
+                    "drop_ratio": round(session.drop_ratio, 3),
+                }
+                for code, session in self.sessions.items()
+            },
+        }
@@ -0,0 +1,109 @@
+"""
+Application-level heartbeat for WebSocket clients
+Pings every tracked connection and evicts the ones that stop answering:
+half-open sockets from sleeping laptops, peers whose writes time out, and
+agent sockets replaced by a reconnect. Eviction cancels the connection's
+receive loop, whose ``finally`` block does the cleanup.
+"""
+
+import asyncio
+import os
+import time
+from typing import Optional, Set
+
+import metrics
+from connections import ClientChannel
+
+
+class Heartbeat:
+    """Ping loop plus reaper for every open /ws connection on this worker"""
+
+    def __init__(self, manager, interval: float = 20.0, timeout: float = 60.0):
+        self.manager = manager
+        self.interval = interval
+        self.timeout = timeout
+        self.channels: Set[ClientChannel] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.reaped = 0
+
+    @classmethod
+    def from_env(cls, manager) -> "Heartbeat":
+        return cls(
+            manager,
+            interval=float(os.getenv('HEARTBEAT_INTERVAL', '20')),
+            timeout=float(os.getenv('HEARTBEAT_TIMEOUT', '60')),
+        )
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def track(self, channel: ClientChannel):
+        """Register a connection whose receive loop runs in the current task"""
+        channel.reader = asyncio.current_task()
+        channel.touch()
+        self.channels.add(channel)
+
+    def untrack(self, channel: ClientChannel):
+        self.channels.discard(channel)
+
+    def pong(self, channel: ClientChannel, message: dict):
+        """Handle a pong; the echoed timestamp gives the round-trip time"""
+        sent_at = message.get('ts')
+        if isinstance(sent_at, (int, float)):
+            rtt = time.time() - sent_at
+            if 0 <= rtt < self.timeout:
+                channel.rtt = rtt
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.beat()
+            except Exception as e:
+                print(f"Heartbeat error: {e}")
+
+    async def beat(self):
+        now = time.monotonic()
+        ping = {"type": "ping", "ts": time.time()}
+        for channel in list(self.channels):
+            if channel.closed:
+                # Writer failed or the agent reconnected on a new socket
+                await self.reap(channel, "closed")
+            elif now - channel.last_seen > self.timeout:
+                await self.reap(channel, "timeout")
+            elif now - channel.last_seen >= self.interval:
+                # Frames and messages count as liveness; only quiet peers get pinged
+                await channel.send_json(ping)
+
+    async def reap(self, channel: ClientChannel, reason: str):
+        print(f"Reaping {channel.role} connection ({reason}, idle {time.monotonic() - channel.last_seen:.0f}s)")
+        self.untrack(channel)
+        self.reaped += 1
+        metrics.reaped.labels(channel.role, reason).inc()
+        channel.reaped = True
+        await self.manager.disconnect(channel)
+        if channel.reader is not None and channel.reader is not asyncio.current_task():
+            channel.reader.cancel()
+
+    def live(self) -> int:
+        cutoff = time.monotonic() - self.timeout
+        return sum(1 for channel in self.channels if not channel.closed and channel.last_seen >= cutoff)
+
+    def stats(self) -> dict:
+        return {
+            "tracked": len(self.channels),
+            "live": self.live(),
+            "reaped": self.reaped,
+            "interval": self.interval,
+            "timeout": self.timeout,
+        }
@@ -3,21 +3,58 @@ Backend API Server for AI Control Assistant
 Handles authentication, WebSocket connections, and ChatGPT API integration
 """
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
-import openai
-import json
 import asyncio
-from typing import Dict, Set
+from contextlib import aclosing, asynccontextmanager
+from typing import Optional, Tuple
 import os
+import uuid
 from datetime import datetime
-import zipfile
-import tempfile
-from pathlib import Path
 
-app = FastAPI(title="AI Control API")
+from planner import PlanningService, PlannerUnavailable, PROMPT_VERSION
+from plan_decoder import ActionStreamParser, PlanDecodeError, decode_plan, record, validate_action
+from plan_cache import PlanCache
+from connections import ClientChannel, ConnectionManager, peek_message_type, receive_raw
+from routing import create_router
+from scheduler import CommandScheduler, FairLimiter, QueuedCommand
+from fast_planner import FastPlanner
+from frame_rate import FrameRateController
+from heartbeat import Heartbeat
+from recorder import SessionRecorder, read_spans
+from session_memory import SessionMemory
+from agent_package import AgentPackage
+import metrics
+import wire
+
+planner = PlanningService()
+agent_package = AgentPackage()
+plan_cache = PlanCache.from_env()
+planner_limiter = FairLimiter.from_env()
+fast_planner = FastPlanner()
+recorder = SessionRecorder.from_env()
+session_memory = SessionMemory.from_env()
+
+# Stream actions to agents that advertise support for it (set to 0 to disable)
+PLAN_STREAMING = os.getenv('PLAN_STREAMING', '1') == '1'
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await planner.start()
+    await manager.start()
+    frame_rate.start()
+    heartbeat.start()
+    recorder.start()
+    yield
+    await recorder.stop()
+    await heartbeat.stop()
+    await frame_rate.stop()
+    await manager.stop()
+    await planner.close()
+
+app = FastAPI(title="AI Control API", lifespan=lifespan)
 
 # CORS configuration
 app.add_middleware(
@@ -28,37 +65,30 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Store active connections
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
-        self.agent_connections: Dict[str, WebSocket] = {}
-    
-    async def connect_web(self, access_code: str, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections[access_code] = websocket
-    
-    async def connect_agent(self, access_code: str, websocket: WebSocket):
-        await websocket.accept()
-        self.agent_connections[access_code] = websocket
-    
-    def disconnect_web(self, access_code: str):
-        if access_code in self.active_connections:
-            del self.active_connections[access_code]
-    
-    def disconnect_agent(self, access_code: str):
-        if access_code in self.agent_connections:
-            del self.agent_connections[access_code]
-    
-    async def send_to_agent(self, access_code: str, message: dict):
-        if access_code in self.agent_connections:
-            await self.agent_connections[access_code].send_json(message)
-    
-    async def send_to_web(self, access_code: str, message: dict):
-        if access_code in self.active_connections:
-            await self.active_connections[access_code].send_json(message)
+manager = ConnectionManager(create_router())
+heartbeat = Heartbeat.from_env(manager)
+
+# Hot-path metric children, bound once
+AGENT_MESSAGES = metrics.relay_messages.labels(metrics.AGENT_TO_VIEWER)
+AGENT_FRAMES = metrics.relay_frames.labels(metrics.AGENT_TO_VIEWER)
+AGENT_BYTES = metrics.relay_bytes.labels(metrics.AGENT_TO_VIEWER)
+VIEWER_MESSAGES = metrics.relay_messages.labels(metrics.VIEWER_TO_AGENT)
+VIEWER_BYTES = metrics.relay_bytes.labels(metrics.VIEWER_TO_AGENT)
 
-manager = ConnectionManager()
+metrics.REGISTRY.register(metrics.Gauge(
+    'ws_active_viewers', 'Viewer connections on this worker', manager.viewer_count))
+metrics.REGISTRY.register(metrics.Gauge(
+    'ws_active_agents', 'Agent connections on this worker', lambda: len(manager.agent_connections)))
+metrics.REGISTRY.register(metrics.Gauge(
+    'ws_live_connections', 'Connections heard from within the heartbeat timeout', heartbeat.live))
+metrics.REGISTRY.register(metrics.Gauge(
+    'ws_tracked_connections', 'Connections with a running receive loop', lambda: len(heartbeat.channels)))
+metrics.REGISTRY.register(metrics.Gauge(
+    'plan_cache_hits_total', 'Plan cache hits', lambda: plan_cache.hits, kind='counter'))
+metrics.REGISTRY.register(metrics.Gauge(
+    'plan_cache_misses_total', 'Plan cache misses', lambda: plan_cache.misses, kind='counter'))
+metrics.REGISTRY.register(metrics.Gauge(
+    'plan_cache_entries', 'Plans currently cached', lambda: len(plan_cache)))
 
 # Models
 class AccessRequest(BaseModel):
@@ -83,214 +113,452 @@ async def request_access(request: AccessRequest):
         "message": "Access request submitted. You'll receive your code within 24 hours."
     }
 
-@app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket, code: str, client_type: str = "web"):
-    """WebSocket endpoint for real-time communication"""
+async def stream_command(code: str, command_text: str, history: list) -> Tuple[list, bool]:
+    """Stream a plan to the agent one action at a time as the LLM produces it
+
+    Returns the actions sent and whether the plan was complete; a reply cut
+    off after some actions went out can't be replanned, but isn't a plan to
+    cache or report as whole either.
+    """
+    sequence_id = uuid.uuid4().hex[:8]
+    parser = ActionStreamParser()
+    actions = []
+    repairs = []
+    ended = False
+    
+    try:
+        async with asyncio.timeout(planner.timeout):
+            async with aclosing(planner.stream_plan(command_text, parser, history)) as stream:
+                async for action in stream:
+                    try:
+                        action = validate_action(action, repairs)
+                    except PlanDecodeError:
+                        if actions:
+                            # Steps already sent still run; the rest of the plan is dropped
+                            record('failed')
+                            raise
+                        # Nothing sent yet, so the whole reply can still be replaced
+                        break
+                    if not actions:
+                        # Same list the loop appends to, so the turn fills in as actions are sent
+                        session_memory.add_turn(code, command_text, actions)
+                        await manager.send_to_agent(code, {
+                            "type": "sequence_start",
+                            "sequence_id": sequence_id
+                        })
+                    actions.append(action)
+                    await manager.send_to_agent(code, {
+                        "type": "sequence_action",
+                        "sequence_id": sequence_id,
+                        "step": len(actions),
+                        "action": action
+                    })
+        
+        if not actions:
+            # Nothing usable while streaming; repair the whole reply, or plan again
+            try:
+                actions, repairs = decode_plan(parser.text)
+                record('repaired' if repairs else 'clean')
+            except PlanDecodeError:
+                record('replanned')
+                actions = await planner.plan(command_text, history)
+            session_memory.add_turn(code, command_text, actions)
+            await manager.send_to_agent(code, {
+                "type": "execute_sequence",
+                "actions": actions
+            })
+            return actions, True
+        
+        # The array never closed: the reply stopped part way through the plan
+        complete = parser.done
+        record(('repaired' if repairs else 'clean') if complete else 'truncated')
+        await manager.send_to_agent(code, {
+            "type": "sequence_end",
+            "sequence_id": sequence_id,
+            "total": len(actions)
+        })
+        ended = True
+        return actions, complete
+    finally:
+        if actions and not ended:
+            # Let the agent finish what it already has instead of waiting forever
+            await manager.send_to_agent(code, {
+                "type": "sequence_end",
+                "sequence_id": sequence_id,
+                "total": len(actions),
+                "aborted": True
+            })
+
+async def notify_viewer(channel: ClientChannel, message: dict):
+    await channel.send_json(message)
+
+async def run_command(queued: QueuedCommand) -> bool:
+    """Plan a command with the LLM and dispatch the actions to the agent
+
+    Returns True if a sequence was handed to the agent.
+    """
+    channel, code, command_text = queued.requester, queued.access_code, queued.text
+    
+    if not manager.agent_reachable(code):
+        await channel.send_json({
+            'type': 'error',
+            'message': 'Desktop agent is not connected'
+        })
+        return False
     
+    # Before dispatch, so the agent is already capturing faster when it starts
+    await frame_rate.command_started(code)
+    
+    try:
+        # Earlier commands in this session, so follow-ups like "now pause it" make sense
+        history = session_memory.context(code)
+        actions = fast_planner.plan(command_text, history)
+        if actions is None and not history:
+            # Cached plans were made without session context, so they only fit commands without any
+            actions = plan_cache.get(PROMPT_VERSION, command_text)
+        if actions is not None:
+            session_memory.add_turn(code, command_text, actions)
+            await manager.send_to_agent(code, {
+                "type": "execute_sequence",
+                "actions": actions
+            })
+        else:
+            if planner_limiter.would_wait():
+                await channel.send_json({
+                    'type': 'command_queued',
+                    'command': command_text,
+                    'position': 0,
+                    'waiting_for': 'planner',
+                    'planner_queue': planner_limiter.waiting + 1
+                })
+            await planner_limiter.acquire(code)
+            try:
+                complete = True
+                if PLAN_STREAMING and manager.agent_supports(code, 'stream_actions'):
+                    actions, complete = await stream_command(code, command_text, history)
+                else:
+                    actions = await planner.plan(command_text, history)
+                    session_memory.add_turn(code, command_text, actions)
+                    
+                    # Send actions to agent
+                    await manager.send_to_agent(code, {
+                        "type": "execute_sequence",
+                        "actions": actions
+                    })
+            finally:
+                planner_limiter.release()
+            if not complete:
+                await channel.send_json({
+                    'type': 'error',
+                    'message': f'The plan was cut off; only its first {len(actions)} actions were run',
+                    'actions': actions
+                })
+                return True
+            if not history:
+                # A plan made with session context may not fit the same words elsewhere
+                plan_cache.put(PROMPT_VERSION, command_text, actions)
+        
+        # Notify web client
+        await channel.send_json({
+            'type': 'command_processing',
+            'message': f'Executing {len(actions)} actions...',
+            'actions': actions
+        })
+        return True
+        
+    except PlannerUnavailable as e:
+        await channel.send_json({
+            'type': 'error',
+            'message': str(e)
+        })
+    except asyncio.TimeoutError:
+        await channel.send_json({
+            'type': 'error',
+            'message': f'Planning timed out after {planner.timeout:.0f}s'
+        })
+    except PlanDecodeError as e:
+        metrics.json_parse_failures.labels('plan').inc()
+        await channel.send_json({
+            'type': 'error',
+            'message': f'Failed to parse AI response: {str(e)}'
+        })
+    except Exception as e:
+        await channel.send_json({
+            'type': 'error',
+            'message': f'Error processing command: {str(e)}'
+        })
+    return False
+
+scheduler = CommandScheduler.from_env(run_command, notify_viewer)
+frame_rate = FrameRateController.from_env(manager, scheduler.is_busy)
+
+def on_agent_event(code: str, msg_type: str, payload):
+    if msg_type == 'sequence_complete':
+        scheduler.sequence_finished(code)
+    if msg_type in ('action_result', 'sequence_complete') and session_memory.has_history(code):
+        try:
+            message = wire.loads(payload)
+        except ValueError:
+            return
+        if isinstance(message, dict):
+            session_memory.record_result(code, message)
+
+manager.on_agent_event = on_agent_event
+
+@app.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket, code: str, client_type: str = "web", caps: str = "",
+                             codec: Optional[str] = None, frames: str = "json"):
+    """WebSocket endpoint for real-time communication
+
+    ``codec`` lists the client's wire codecs in order of preference; the
+    first one the server supports is confirmed in a ``hello`` message.
+    Without it the connection uses plain JSON. ``frames=binary`` asks for
+    screen frames as binary messages (wire.pack_frame), also confirmed in
+    the ``hello``; ``frames=none`` opts a viewer out of screen frames.
+    """
+    negotiated = wire.negotiate(codec) if codec else None
+    binary_frames = frames == "binary"
     if client_type == "web":
-        await manager.connect_web(code, websocket)
+        channel = await manager.connect_web(code, websocket, negotiated, binary_frames, frames != "none")
     else:
-        await manager.connect_agent(code, websocket)
+        channel = await manager.connect_agent(code, websocket, set(filter(None, caps.split(','))), negotiated,
+                                              binary_frames)
+    heartbeat.track(channel)
     
     try:
         while True:
-            data = await websocket.receive_json()
-            
+            if channel.closed:
+                # Writer failed, or a reconnecting agent took over the code
+                break
             if client_type == "agent":
-                # Forward screen frames and results to web client
-                await manager.send_to_web(code, data)
+                # Forward screen frames and results to web client as opaque
+                # payloads; only the type at the head of the message is inspected
+                raw = await receive_raw(websocket)
+                channel.touch()
+                msg_type = peek_message_type(raw)
+                AGENT_MESSAGES.inc()
+                AGENT_BYTES.inc(len(raw))
+                if msg_type in ('screen_frame', 'screen_delta'):
+                    AGENT_FRAMES.inc()
+                elif msg_type in ('ping', 'pong'):
+                    await handle_heartbeat(channel, msg_type, raw)
+                    continue
+                await manager.relay_to_web(code, raw, msg_type)
+                recorder.record(code, raw, msg_type)
             else:
+                raw = await receive_raw(websocket)
+                channel.touch()
+                VIEWER_MESSAGES.inc()
+                VIEWER_BYTES.inc(len(raw))
+                try:
+                    data = wire.loads(raw)
+                    if not isinstance(data, dict):
+                        raise ValueError('message is not an object')
+                except ValueError:
+                    metrics.json_parse_failures.labels('message').inc()
+                    await channel.send_json({
+                        'type': 'error',
+                        'message': 'Invalid JSON message'
+                    })
+                    continue
+                
+                if data.get('type') in ('ping', 'pong'):
+                    await handle_heartbeat(channel, data['type'], data)
+                    continue
+                
+                if data.get('type') == 'request_keyframe':
+                    # Rate-limited per code, however many viewers ask
+                    await manager.request_keyframe(code)
+                    continue
+                
+                frame_rate.viewer_input(code)
+                
                 # Handle command from web client
                 if data.get('type') == 'command':
-                    command_text = data.get('command')
-                    
-                    # Get API key from environment variable
-                    api_key = os.getenv('OPENAI_API_KEY')
-                    
-                    if not api_key or not api_key.startswith('sk-'):
-                        await websocket.send_json({
-                            'type': 'error',
-                            'message': 'OpenAI API key not configured on server. Please contact administrator.'
-                        })
-                        continue
-                    
-                    try:
-                        # Use OpenAI to process the command intelligently
-                        client = openai.OpenAI(api_key=api_key)
-                        
-                        response = client.chat.completions.create(
-                            model="gpt-4o",
-                            messages=[
-                                {
-                                    "role": "system",
-                                    "content": """You are an expert AI assistant that controls computers through natural language commands. You can:
-
-1. **Browser Control**: Open browsers, navigate URLs, search
-2. **Application Control**: Open/close apps, switch windows
-3. **Mouse & Keyboard**: Click, type, move cursor, keyboard shortcuts
-4. **File Operations**: Create, edit, save files
-5. **Coding Tasks**: Write code, debug, create projects
-6. **Problem Solving**: Research, analyze, execute complex multi-step tasks
-
-For EVERY command, break it down into atomic actions and return a JSON array of steps.
-
-Available action types:
-- open_url: {url: "https://..."} - Opens URL in default browser
-- open_app: {app: "Safari"/"Chrome"/"VSCode"/"Terminal"/etc} - Opens application
-- keyboard_type: {text: "text to type"} - Types text
-- keyboard_press: {key: "enter"/"tab"/"cmd+c"/etc} - Presses key/shortcut
-- mouse_click: {x: 100, y: 200} - Clicks at coordinates (requires screen analysis)
-- mouse_move: {x: 100, y: 200} - Moves mouse
-- scroll: {amount: 3} - Scrolls (positive=down, negative=up)
-- wait: {seconds: 2} - Waits before next action
-
-For complex tasks like "open YouTube and search for sad music":
-1. open_url with YouTube URL
-2. wait for page load
-3. mouse_click on search box (estimate coordinates)
-4. keyboard_type the search query
-5. keyboard_press enter
-
-Return ONLY valid JSON array: [{"type": "action_type", "params": {...}}, ...]
-
-Be intelligent and break down ANY task into executable steps."""
-                                },
-                                {
-                                    "role": "user",
-                                    "content": command_text
-                                }
-                            ],
-                            temperature=0.7
-                        )
-                        
-                        # Parse the AI response
-                        ai_response = response.choices[0].message.content.strip()
-                        
-                        # Try to extract JSON from the response
-                        if '```json' in ai_response:
-                            ai_response = ai_response.split('```json')[1].split('```')[0].strip()
-                        elif '```' in ai_response:
-                            ai_response = ai_response.split('```')[1].split('```')[0].strip()
-                        
-                        actions = json.loads(ai_response)
-                        
-                        # Ensure it's a list
-                        if not isinstance(actions, list):
-                            actions = [actions]
-                        
-                        # Send actions to agent
-                        await manager.send_to_agent(code, {
-                            "type": "execute_sequence",
-                            "actions": actions
-                        })
-                        
-                        # Notify web client
-                        await websocket.send_json({
-                            'type': 'command_processing',
-                            'message': f'Executing {len(actions)} actions...',
-                            'actions': actions
-                        })
-                        
-                    except json.JSONDecodeError as e:
-                        await websocket.send_json({
-                            'type': 'error',
-                            'message': f'Failed to parse AI response: {str(e)}'
-                        })
-                    except Exception as e:
-                        await websocket.send_json({
-                            'type': 'error',
-                            'message': f'Error processing command: {str(e)}'
-                        })
+                    # Planning runs in the scheduler's task, so this loop keeps
+                    # serving the socket (and notices disconnects) meanwhile
+                    await scheduler.submit(code, data.get('command'), channel, supersede=bool(data.get('supersede')))
                 else:
                     # Forward other messages to agent
                     await manager.send_to_agent(code, data)
                 
     except WebSocketDisconnect:
+        pass
+    except asyncio.CancelledError:
+        # Cancelled by the heartbeat reaper; anything else is a real cancellation
+        if not channel.reaped:
+            raise
+    except Exception as e:
+        print(f"WebSocket error ({client_type}): {e!r}")
+    finally:
+        # Every exit path ends here, so no socket outlives its connection
+        heartbeat.untrack(channel)
+        replaced = client_type == "agent" and manager.agent_connections.get(code) not in (None, channel)
+        await manager.disconnect(channel)
         if client_type == "web":
-            manager.disconnect_web(code)
-        else:
-            manager.disconnect_agent(code)
+            # Abort planning calls nobody is waiting for anymore
+            scheduler.drop_requester(code, channel)
+        elif not replaced:
+            # A sequence can't complete without its agent
+            scheduler.sequence_finished(code)
+            session_memory.forget(code)
+        if channel.reaped:
+            try:
+                await asyncio.wait_for(websocket.close(code=1001), 5)
+            except Exception:
+                pass
 
-@app.get("/api/download-agent")
-async def download_agent():
-    """Generate and serve the desktop agent package as a zip file"""
+async def handle_heartbeat(channel: ClientChannel, msg_type: str, message):
+    """Answer a client's ping, or record the round trip of our own"""
+    if msg_type == 'ping':
+        await channel.send_json({'type': 'pong'})
+        return
+    if not isinstance(message, dict):
+        try:
+            message = wire.loads(message)
+        except ValueError:
+            return
+    heartbeat.pong(channel, message)
+
+def _package_headers(digest: str, cache_control: str) -> dict:
+    return {
+        "ETag": f'"{digest}"',
+        "Cache-Control": cache_control,
+        "Accept-Ranges": "bytes",
+    }
+
+def _etag_matches(request: Request, digest: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    tags = {tag.strip() for tag in if_none_match.split(",")}
+    return "*" in tags or f'"{digest}"' in tags
+
+async def _serve_agent_package(request: Request, digest: Optional[str], cache_control: str):
     try:
-        # Get the desktop-agent directory path
-        backend_dir = Path(__file__).parent
-        project_root = backend_dir.parent
-        agent_dir = project_root / "desktop-agent"
-        
-        if not agent_dir.exists():
-            raise HTTPException(status_code=404, detail="Desktop agent files not found")
-        
-        # Create a temporary zip file
-        temp_dir = tempfile.gettempdir()
-        zip_path = os.path.join(temp_dir, "24ai-desktop-agent.zip")
-        
-        # Create the zip file
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            # Add agent.py
-            agent_py = agent_dir / "agent.py"
-            if agent_py.exists():
-                zipf.write(agent_py, "24ai-desktop-agent/agent.py")
-            
-            # Add requirements.txt
-            requirements = agent_dir / "requirements.txt"
-            if requirements.exists():
-                zipf.write(requirements, "24ai-desktop-agent/requirements.txt")
-            
-            # Add install.py
-            install_py = agent_dir / "install.py"
-            if install_py.exists():
-                zipf.write(install_py, "24ai-desktop-agent/install.py")
-            
-            # Create a simple installer script for Mac/Linux
-            installer_script = """#!/bin/bash
-# 24/7 AI Control Assistant Installer
-
-echo "Installing 24/7 AI Control Assistant..."
-echo "======================================"
-
-# Check if Python 3 is installed
-if ! command -v python3 &> /dev/null; then
-    echo "Error: Python 3 is required but not installed."
-    echo "Please install Python 3 and try again."
-    exit 1
-fi
-
-# Install Python dependencies
-echo "Installing dependencies..."
-python3 -m pip install -r requirements.txt
-
-# Run the installer
-echo "Running installer..."
-python3 install.py
-
-echo ""
-echo "Installation complete!"
-echo "You can now run the agent with: python3 agent.py"
-"""
-            zipf.writestr("24ai-desktop-agent/24ai-installer.command", installer_script)
-        
-        # Return the zip file
-        return FileResponse(
-            path=zip_path,
-            media_type="application/zip",
-            filename="24ai-desktop-agent.zip"
-        )
-        
+        current_digest, zip_path = await asyncio.to_thread(agent_package.current)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Desktop agent files not found")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating package: {str(e)}")
+    
+    if digest is not None and digest != current_digest:
+        raise HTTPException(status_code=404, detail="Unknown agent package version")
+    
+    headers = _package_headers(current_digest, cache_control)
+    if _etag_matches(request, current_digest):
+        return Response(status_code=304, headers=headers)
+    
+    # FileResponse streams the file and answers Range / If-Range requests
+    return FileResponse(
+        path=zip_path,
+        media_type="application/zip",
+        filename="24ai-desktop-agent.zip",
+        headers=headers
+    )
+
+@app.get("/api/download-agent")
+async def download_agent(request: Request):
+    """Serve the desktop agent package as a zip file"""
+    # Revalidate periodically; the ETag makes that a 304 until the agent changes
+    return await _serve_agent_package(request, None, "public, max-age=300, must-revalidate")
+
+@app.get("/api/download-agent/{digest}")
+async def download_agent_version(request: Request, digest: str):
+    """Serve a specific agent package by content hash; safe to cache forever"""
+    return await _serve_agent_package(request, digest.removesuffix(".zip"), "public, max-age=31536000, immutable")
 
 @app.get("/api/health")
 async def health_check():
     return {
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
-        "active_connections": len(manager.active_connections),
-        "active_agents": len(manager.agent_connections)
+        "active_connections": manager.viewer_count(),
+        "active_agents": len(manager.agent_connections),
+        "plan_cache": plan_cache.stats(),
+        "fast_planner": fast_planner.stats(),
+        "router": manager.router.stats(),
+        "scheduler": scheduler.stats(),
+        "planner_limiter": planner_limiter.stats(),
+        "frame_rate": frame_rate.stats(),
+        "heartbeat": heartbeat.stats(),
+        "recorder": recorder.stats(),
+        "session_memory": session_memory.stats(),
+        "agent_package_builds": agent_package.builds
     }
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus text exposition of relay, planning and connection metrics"""
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/sessions")
+async def session_stats():
+    """Per-session send queue depth and dropped frame counters"""
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "sessions": manager.session_stats()
+    }
+
+def _parse_range(header: str, total: int) -> Optional[tuple]:
+    """(start, end exclusive) for a single-range "bytes=" header, None if unsatisfiable"""
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if not first:
+            length = int(last)
+            return (max(total - length, 0), total) if length > 0 else None
+        start = int(first)
+        end = min(int(last) + 1, total) if last else total
+    except ValueError:
+        return None
+    return (start, end) if start < end else None
+
+@app.get("/api/recordings")
+async def list_recordings(code: str):
+    """Recorded segments of a session, with their time spans"""
+    if not recorder.enabled:
+        raise HTTPException(status_code=404, detail="Session recording is disabled")
+    return {"segments": await asyncio.to_thread(recorder.segments, code)}
+
+@app.get("/api/recordings/replay")
+async def replay_recording(request: Request, code: str, start: float = 0, end: float = float("inf")):
+    """Recorded messages between two unix timestamps as NDJSON
+
+    Byte ranges are relative to the whole replay, so a player can fetch an
+    hour-long session piece by piece.
+    """
+    if not recorder.enabled:
+        raise HTTPException(status_code=404, detail="Session recording is disabled")
+    spans = await asyncio.to_thread(recorder.spans, code, start, end)
+    if not spans:
+        raise HTTPException(status_code=404, detail="Nothing recorded in that range")
+    
+    total = sum(stop - begin for _, begin, stop in spans)
+    headers = {"Accept-Ranges": "bytes", "Cache-Control": "no-store"}
+    status_code = 200
+    offset, length = 0, total
+    range_header = request.headers.get("range")
+    if range_header:
+        byte_range = _parse_range(range_header, total)
+        if byte_range is None:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{total}"})
+        offset, stop = byte_range
+        length = stop - offset
+        status_code = 206
+        headers["Content-Range"] = f"bytes {offset}-{stop - 1}/{total}"
+    headers["Content-Length"] = str(length)
+    
+    # A sync iterator, so Starlette reads the mapped segments on its threadpool
+    return StreamingResponse(
+        read_spans(spans, offset, length),
+        status_code=status_code,
+        media_type="application/x-ndjson",
+        headers=headers
+    )
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,179 @@
+"""
+Prometheus-style metrics for the AI Control backend
+Dependency-free counters, gauges and histograms rendered in the text
+exposition format at /metrics. Label children are bound once at import so
+the hot path is a dict-free integer add.
+"""
+
+from bisect import bisect_left
+from typing import Callable, Dict, List, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+PLANNING_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _CounterChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], _CounterChild] = {}
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def labels(self, *values: str) -> _CounterChild:
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = _CounterChild()
+        return child
+
+    def inc(self, amount=1):
+        self._default.value += amount
+
+    def render(self) -> List[str]:
+        return [f'{self.name}{_format_labels(self.labelnames, values)} {child.value}'
+                for values, child in self._children.items()]
+
+
+class Gauge:
+    """Gauge read from a callback at scrape time"""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, read: Callable[[], float], kind: str = 'gauge'):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.kind = kind
+
+    def render(self) -> List[str]:
+        return [f'{self.name} {self.read()}']
+
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._children: Dict[Tuple[str, ...], _HistogramChild] = {}
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def labels(self, *values: str) -> _HistogramChild:
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = _HistogramChild(self.buckets)
+        return child
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+    def render(self) -> List[str]:
+        lines = []
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), child.counts):
+                cumulative += count
+                le = 'le="%s"' % ('+Inf' if bound == float('inf') else repr(bound))
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, values)} {child.sum}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, values)} {child.count}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# Relay
+relay_messages = REGISTRY.register(Counter(
+    'relay_messages_total', 'Messages relayed between agents and viewers', ('direction',)))
+relay_frames = REGISTRY.register(Counter(
+    'relay_frames_total', 'Screen frames relayed from agents', ('direction',)))
+relay_bytes = REGISTRY.register(Counter(
+    'relay_bytes_total', 'Payload bytes relayed between agents and viewers', ('direction',)))
+relay_latency = REGISTRY.register(Histogram(
+    'relay_frame_latency_seconds', 'Time a frame spends in the server between receipt and socket write'))
+frames_dropped = REGISTRY.register(Counter(
+    'relay_frames_dropped_total', 'Frames replaced by a newer one before reaching a slow viewer'))
+keyframe_requests = REGISTRY.register(Counter(
+    'relay_keyframe_requests_total', 'Keyframes requested from agents for viewers that missed a delta'))
+
+AGENT_TO_VIEWER = 'agent_to_viewer'
+VIEWER_TO_AGENT = 'viewer_to_agent'
+
+# Connections
+connects = REGISTRY.register(Counter(
+    'ws_connects_total', 'WebSocket connections accepted', ('role',)))
+disconnects = REGISTRY.register(Counter(
+    'ws_disconnects_total', 'WebSocket connections closed', ('role',)))
+reaped = REGISTRY.register(Counter(
+    'ws_reaped_total', 'Connections evicted by the heartbeat', ('role', 'reason')))
+
+# Planning
+planning_latency = REGISTRY.register(Histogram(
+    'planner_latency_seconds', 'LLM planning time per command', ('mode',), buckets=PLANNING_BUCKETS))
+planning_tokens = REGISTRY.register(Counter(
+    'planner_tokens_total', 'LLM tokens used for planning', ('kind',)))
+json_parse_failures = REGISTRY.register(Counter(
+    'json_parse_failures_total', 'JSON documents that failed to parse', ('source',)))
+fast_planner = REGISTRY.register(Counter(
+    'fast_planner_total', 'Commands tried on the local fast-path planner', ('result',)))
+plan_decode = REGISTRY.register(Counter(
+    'plan_decode_total', 'LLM plan replies by outcome: clean, repaired, replanned, truncated, failed', ('result',)))
+
+# Agent capture
+fps_changes = REGISTRY.register(Counter(
+    'agent_fps_changes_total', 'set_fps messages sent to agents', ('direction',)))
@@ -0,0 +1,115 @@
+"""
+Plan cache for repeated natural language commands
+LRU + TTL cache of planned action lists, bounded by entry count and bytes
+"""
+
+import json
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+_WHITESPACE = re.compile(r'\s+')
+# Quoted text is usually typed verbatim, so it keeps its case and punctuation
+_QUOTED = re.compile(r'("[^"]*"|\'[^\']*\')')
+
+
+def _strip_punctuation(text: str) -> str:
+    return ''.join(ch for ch in text if not unicodedata.category(ch).startswith('P'))
+
+
+def normalize_command(command: str) -> str:
+    """Normalize case, whitespace and punctuation outside of quoted text"""
+    parts = []
+    for i, part in enumerate(_QUOTED.split(command)):
+        if i % 2:
+            parts.append(part)
+        else:
+            parts.append(_strip_punctuation(part.casefold()))
+    return _WHITESPACE.sub(' ', ''.join(parts)).strip()
+
+
+class PlanCache:
+    """Maps (prompt version, normalized command) to a planned action list"""
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 8 * 1024 * 1024, ttl: float = 3600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # key -> (expires_at, size, actions)
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, int, List[dict]]]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @classmethod
+    def from_env(cls) -> "PlanCache":
+        return cls(
+            max_entries=int(os.getenv('PLAN_CACHE_MAX_ENTRIES', '1024')),
+            max_bytes=int(os.getenv('PLAN_CACHE_MAX_BYTES', str(8 * 1024 * 1024))),
+            ttl=float(os.getenv('PLAN_CACHE_TTL', '3600')),
+        )
+
+    def get(self, prompt_version: str, command: str) -> Optional[List[dict]]:
+        key = (prompt_version, normalize_command(command))
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, size, actions = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return actions
+
+    def put(self, prompt_version: str, command: str, actions: List[dict]):
+        if self.max_entries <= 0:
+            return
+        key = (prompt_version, normalize_command(command))
+        # Approximate footprint by the serialized size of the plan
+        size = len(key[1]) + len(json.dumps(actions))
+        if size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl, size, actions)
+        self.bytes += size
+
+        while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: Tuple[str, str]):
+        _, size, _ = self._entries.pop(key)
+        self.bytes -= size
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
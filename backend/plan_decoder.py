@@ -0,0 +1,386 @@
+"""
+Tolerant decoder for LLM action plans
+Extracts the action array from a model reply, repairs the usual damage
+(prose or code fences around it, trailing commas, a single object or an
+{"actions": [...]} wrapper) and checks every action against the schema of
+the action types the desktop agent runs. Only a reply that can't be
+repaired needs a new planning call; that includes output cut off
+mid-array, since running the first half of a plan isn't what was asked.
+"""
+
+import json
+import re
+from typing import Callable, Dict, List, Tuple
+
+import metrics
+
+
+class PlanDecodeError(ValueError):
+    """The reply has no usable plan, even after repair"""
+
+
+class PlanTruncated(PlanDecodeError):
+    """The reply was cut off; ``actions`` holds the complete ones before the cut"""
+
+    def __init__(self, message: str, actions: List[dict]):
+        super().__init__(message)
+        self.actions = actions
+
+
+def parse_plan(ai_response: str) -> List[dict]:
+    """Extract the JSON action list from a model reply"""
+    ai_response = ai_response.strip()
+
+    # Try to extract JSON from the response
+    if '```json' in ai_response:
+        ai_response = ai_response.split('```json')[1].split('```')[0].strip()
+    elif '```' in ai_response:
+        ai_response = ai_response.split('```')[1].split('```')[0].strip()
+
+    actions = json.loads(ai_response)
+
+    # Ensure it's a list
+    if not isinstance(actions, list):
+        actions = [actions]
+
+    return actions
+
+
+class ActionStreamParser:
+    """Incremental parser that pulls complete action objects out of a streamed JSON array
+
+    Feed it completion text as it arrives; every ``{...}`` element of the
+    top-level array is returned as soon as its closing brace is seen. Code
+    fences and prose before the array are skipped. A bare object reply (no
+    array) is returned once it closes.
+    """
+
+    def __init__(self):
+        self.text = ''
+        self._pos = 0
+        self._depth = 0
+        self._container = None  # '[' or '{' once the top-level value starts
+        self._in_string = False
+        self._escape = False
+        self._object_start = -1
+        self.done = False
+
+    def feed(self, chunk: str) -> List[dict]:
+        self.text += chunk
+        actions = []
+        text = self.text
+        # Objects close at depth 1 inside an array, at depth 0 for a bare object
+        element_depth = 1 if self._container == '[' else 0
+
+        while self._pos < len(text) and not self.done:
+            ch = text[self._pos]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif self._container is None:
+                if ch in '[{':
+                    self._container = ch
+                    element_depth = 1 if ch == '[' else 0
+                    self._depth = 1
+                    if ch == '{':
+                        self._object_start = self._pos
+            elif ch == '"':
+                self._in_string = True
+            elif ch in '[{':
+                if ch == '{' and self._depth == element_depth:
+                    self._object_start = self._pos
+                self._depth += 1
+            elif ch in ']}':
+                self._depth -= 1
+                if ch == '}' and self._depth == element_depth and self._object_start >= 0:
+                    try:
+                        action = json.loads(text[self._object_start:self._pos + 1])
+                    except json.JSONDecodeError:
+                        action = None
+                    if isinstance(action, dict):
+                        actions.append(action)
+                    self._object_start = -1
+                if self._depth == 0:
+                    self.done = True
+
+            self._pos += 1
+
+        return actions
+
+
+# Param kinds: (python types accepted as-is, coercion for anything else)
+def _to_str(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    raise ValueError('expected a string')
+
+
+def _to_int(value):
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, float):
+        return round(value)
+    if isinstance(value, str) and re.fullmatch(r'\s*-?\d+(\.\d+)?\s*', value):
+        return round(float(value))
+    raise ValueError('expected an integer')
+
+
+def _to_number(value):
+    if isinstance(value, str) and re.fullmatch(r'\s*-?\d+(\.\d+)?\s*', value):
+        return float(value)
+    raise ValueError('expected a number')
+
+
+KINDS = {
+    'str': ((str,), _to_str),
+    'int': ((int,), _to_int),
+    'number': ((int, float), _to_number),
+}
+
+# Longest wait a plan may ask for; longer ones are clamped
+MAX_WAIT = 60
+
+# action type -> {param: (kind, required)}, matching AIControlAgent.execute_action
+ACTION_SCHEMAS: Dict[str, Dict[str, Tuple[str, bool]]] = {
+    'open_url': {'url': ('str', True)},
+    'open_app': {'app': ('str', True)},
+    'keyboard_type': {'text': ('str', True)},
+    'keyboard_press': {'key': ('str', True)},
+    'mouse_click': {'x': ('int', False), 'y': ('int', False)},
+    'mouse_move': {'x': ('int', True), 'y': ('int', True)},
+    'scroll': {'amount': ('int', True)},
+    'wait': {'seconds': ('number', True)},
+}
+
+# Names models use instead of the ones in the system prompt
+TYPE_ALIASES = {
+    'click': 'mouse_click',
+    'left_click': 'mouse_click',
+    'move_mouse': 'mouse_move',
+    'mouse_moveto': 'mouse_move',
+    'type': 'keyboard_type',
+    'type_text': 'keyboard_type',
+    'press': 'keyboard_press',
+    'key_press': 'keyboard_press',
+    'hotkey': 'keyboard_press',
+    'navigate': 'open_url',
+    'open_website': 'open_url',
+    'launch_app': 'open_app',
+    'sleep': 'wait',
+}
+
+_URL_SCHEME = re.compile(r'^[a-z][a-z0-9+.-]*://', re.I)
+_BARE_DOMAIN = re.compile(r'^([\w-]+\.)+[a-z]{2,}(:\d+)?(/\S*)?$', re.I)
+
+
+def _compile(action_type: str, schema: Dict[str, Tuple[str, bool]]) -> Callable[[dict, List[str]], dict]:
+    """Build the params validator for one action type
+
+    The validator returns cleaned params and appends a note to ``repairs``
+    for every fix it makes; it raises ValueError if the params are unusable.
+    """
+    fields = [(name, required, *KINDS[kind]) for name, (kind, required) in schema.items()]
+
+    def validate(params: dict, repairs: List[str]) -> dict:
+        cleaned = {}
+        for name, required, accepted, coerce in fields:
+            if name not in params or params[name] is None:
+                if required:
+                    raise ValueError(f'{action_type} needs "{name}"')
+                continue
+            value = params[name]
+            if not isinstance(value, accepted) or isinstance(value, bool):
+                value = coerce(value)
+                repairs.append(f'{action_type}.{name} coerced')
+            cleaned[name] = value
+        extra = set(params) - set(schema)
+        if extra:
+            repairs.append(f'{action_type} dropped {", ".join(sorted(extra))}')
+        return cleaned
+
+    return validate
+
+
+VALIDATORS = {action_type: _compile(action_type, schema) for action_type, schema in ACTION_SCHEMAS.items()}
+
+
+def _check_semantics(action_type: str, params: dict, repairs: List[str]):
+    """Rules a type check can't express"""
+    if action_type == 'open_url':
+        url = params['url'].strip()
+        if not _URL_SCHEME.match(url):
+            if not _BARE_DOMAIN.match(url):
+                raise ValueError(f'open_url has no usable URL: {url!r}')
+            url = f'https://{url}'
+            repairs.append('open_url scheme added')
+        params['url'] = url
+    elif action_type in ('open_app', 'keyboard_press'):
+        name = next(iter(params))
+        params[name] = params[name].strip()
+        if not params[name]:
+            raise ValueError(f'{action_type} has an empty "{name}"')
+    elif action_type == 'mouse_click':
+        if ('x' in params) != ('y' in params):
+            raise ValueError('mouse_click needs both x and y, or neither')
+    elif action_type == 'wait':
+        seconds = params['seconds']
+        if not 0 <= seconds <= MAX_WAIT:
+            params['seconds'] = min(max(seconds, 0), MAX_WAIT)
+            repairs.append('wait clamped')
+
+
+def validate_action(action, repairs: List[str]) -> dict:
+    """Return the action in canonical {"type", "params"} form, or raise PlanDecodeError"""
+    if not isinstance(action, dict):
+        raise PlanDecodeError(f'action is not an object: {action!r}'[:200])
+
+    action_type = action.get('type', action.get('action'))
+    if not isinstance(action_type, str):
+        raise PlanDecodeError('action has no type')
+    canonical = TYPE_ALIASES.get(action_type.strip().lower(), action_type.strip().lower())
+    if canonical != action_type:
+        repairs.append(f'{action_type} renamed')
+    validator = VALIDATORS.get(canonical)
+    if validator is None:
+        raise PlanDecodeError(f'unknown action type {action_type!r}')
+
+    params = action.get('params', action.get('parameters', action.get('args')))
+    if params is None:
+        # Flat form: {"type": "open_url", "url": "..."}
+        params = {k: v for k, v in action.items() if k not in ('type', 'action')}
+        if params:
+            repairs.append(f'{canonical} params unflattened')
+    if not isinstance(params, dict):
+        raise PlanDecodeError(f'{canonical} params are not an object')
+
+    try:
+        cleaned = validator(params, repairs)
+        _check_semantics(canonical, cleaned, repairs)
+    except ValueError as e:
+        raise PlanDecodeError(str(e)) from None
+    return {"type": canonical, "params": cleaned}
+
+
+def _scan(text: str, start: int) -> Tuple[str, int]:
+    """Copy the JSON value starting at ``start`` minus trailing commas
+
+    Returns the cleaned text and the index just past the closing bracket,
+    or -1 if the value never closes; everything after the closing bracket
+    (prose, a second fence) is left out.
+    """
+    out = []
+    depth = 0
+    in_string = escape = False
+    pending_comma = -1
+    for pos in range(start, len(text)):
+        ch = text[pos]
+        if in_string:
+            out.append(ch)
+            if escape:
+                escape = False
+            elif ch == '\\':
+                escape = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch in ']}':
+            if pending_comma >= 0:
+                out[pending_comma] = ''
+            pending_comma = -1
+            depth -= 1
+            out.append(ch)
+            if depth == 0:
+                return ''.join(out), pos + 1
+            continue
+        if ch == ',':
+            pending_comma = len(out)
+        elif not ch.isspace():
+            pending_comma = -1
+            if ch == '"':
+                in_string = True
+            elif ch in '[{':
+                depth += 1
+        out.append(ch)
+    return ''.join(out), -1
+
+
+_VALUE_START = re.compile(r'[\[{]')
+
+
+def _repair(text: str, repairs: List[str]):
+    """Find the plan in ``text``: the first bracketed value that parses
+
+    Brackets in prose ("Sure [here is the plan]:") close but don't parse
+    and are skipped. A value that never closes is the cut-off plan, since
+    everything after its start is inside it.
+    """
+    broken = []
+    match = _VALUE_START.search(text)
+    if match is None:
+        raise PlanDecodeError('no JSON in reply')
+    while match is not None:
+        start = match.start()
+        cleaned, end = _scan(text, start)
+        if end < 0:
+            broken.append(cleaned)
+            break
+        try:
+            value = json.loads(cleaned)
+        except json.JSONDecodeError:
+            broken.append(cleaned)
+            match = _VALUE_START.search(text, end)
+            continue
+        if text[:start].strip().strip('`').strip() not in ('', 'json'):
+            repairs.append('prose stripped')
+        repairs.append('syntax repaired')
+        return value
+
+    # Cut off (or broken past repair) part way through
+    for cleaned in broken:
+        elements = ActionStreamParser().feed(cleaned)
+        if elements:
+            raise PlanTruncated(f'reply cut off after {len(elements)} complete actions', elements)
+    raise PlanDecodeError('reply has no complete action')
+
+
+def validate_plan(value, repairs: List[str]) -> List[dict]:
+    if isinstance(value, list) and len(value) == 1 and isinstance(value[0], dict):
+        # parse_plan wraps a bare object, which may be an {"actions": [...]} wrapper
+        value = value[0]
+    if isinstance(value, dict):
+        for key in ('actions', 'steps', 'plan'):
+            if isinstance(value.get(key), list):
+                repairs.append(f'unwrapped "{key}"')
+                value = value[key]
+                break
+        else:
+            value = [value]
+    if not isinstance(value, list):
+        raise PlanDecodeError('plan is not a list of actions')
+    if not value:
+        raise PlanDecodeError('plan is empty')
+    return [validate_action(action, repairs) for action in value]
+
+
+def decode_plan(text: str) -> Tuple[List[dict], List[str]]:
+    """Decode and validate a plan reply; returns (actions, repairs made)
+
+    Raises PlanDecodeError when nothing usable can be recovered, and its
+    PlanTruncated subclass when the reply stops part way through the plan.
+    """
+    repairs: List[str] = []
+    try:
+        value = parse_plan(text)
+    except json.JSONDecodeError:
+        value = _repair(text, repairs)
+    return validate_plan(value, repairs), repairs
+
+
+def record(result: str):
+    """Count a decode outcome: clean, repaired, replanned, truncated or failed"""
+    metrics.plan_decode.labels(result).inc()
@@ -0,0 +1,205 @@
+"""
+LLM planning service for the AI Control backend
+Turns natural language commands into action sequences using one long-lived
+async OpenAI client shared by every websocket session
+"""
+
+import asyncio
+import hashlib
+import os
+import time
+from typing import AsyncIterator, List, Optional
+
+import httpx
+import openai
+
+import metrics
+from plan_decoder import ActionStreamParser, PlanDecodeError, decode_plan, record
+
+PLANNER_MODEL = os.getenv('PLANNER_MODEL', 'gpt-4o')
+
+SYSTEM_PROMPT = """You are an expert AI assistant that controls computers through natural language commands. You can:
+
+1. **Browser Control**: Open browsers, navigate URLs, search
+2. **Application Control**: Open/close apps, switch windows
+3. **Mouse & Keyboard**: Click, type, move cursor, keyboard shortcuts
+4. **File Operations**: Create, edit, save files
+5. **Coding Tasks**: Write code, debug, create projects
+6. **Problem Solving**: Research, analyze, execute complex multi-step tasks
+
+For EVERY command, break it down into atomic actions and return a JSON array of steps.
+
+Available action types:
+- open_url: {url: "https://..."} - Opens URL in default browser
+- open_app: {app: "Safari"/"Chrome"/"VSCode"/"Terminal"/etc} - Opens application
+- keyboard_type: {text: "text to type"} - Types text
+- keyboard_press: {key: "enter"/"tab"/"cmd+c"/etc} - Presses key/shortcut
+- mouse_click: {x: 100, y: 200} - Clicks at coordinates (requires screen analysis)
+- mouse_move: {x: 100, y: 200} - Moves mouse
+- scroll: {amount: 3} - Scrolls (positive=down, negative=up)
+- wait: {seconds: 2} - Waits before next action
+
+For complex tasks like "open YouTube and search for sad music":
+1. open_url with YouTube URL
+2. wait for page load
+3. mouse_click on search box (estimate coordinates)
+4. keyboard_type the search query
+5. keyboard_press enter
+
+Return ONLY valid JSON array: [{"type": "action_type", "params": {...}}, ...]
+
+Be intelligent and break down ANY task into executable steps."""
+
+# Changes whenever the prompt does, so cached plans from an older prompt are never reused
+PROMPT_VERSION = hashlib.sha256(SYSTEM_PROMPT.encode()).hexdigest()[:12]
+
+
+class PlannerUnavailable(Exception):
+    """Raised when no OpenAI API key is configured on the server"""
+
+
+def record_usage(usage):
+    """Count prompt/completion tokens reported by the API"""
+    if usage is None:
+        return
+    metrics.planning_tokens.labels('prompt').inc(usage.prompt_tokens or 0)
+    metrics.planning_tokens.labels('completion').inc(usage.completion_tokens or 0)
+
+
+def build_messages(command_text: str, history: Optional[List[dict]] = None) -> List[dict]:
+    """System prompt, then any earlier turns of the session, then the new command"""
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        *(history or ()),
+        {"role": "user", "content": command_text},
+    ]
+
+
+def replan_messages(reply: str, error: Exception) -> List[dict]:
+    """Follow-up turn asking the model to correct a plan we couldn't use"""
+    return [
+        {"role": "assistant", "content": reply},
+        {"role": "user", "content": f"That plan could not be used ({error}). "
+                                    "Reply with ONLY the corrected JSON array of actions."},
+    ]
+
+
+class PlanningService:
+    """Owns the pooled AsyncOpenAI client used for command planning"""
+
+    def __init__(self):
+        self.client: Optional[openai.AsyncOpenAI] = None
+        self.model = PLANNER_MODEL
+        # Overall deadline for one planning call, on top of the HTTP timeouts
+        self.timeout = float(os.getenv('PLANNER_TIMEOUT', '45'))
+        self.connect_timeout = float(os.getenv('PLANNER_CONNECT_TIMEOUT', '5'))
+        self.max_connections = int(os.getenv('PLANNER_MAX_CONNECTIONS', '20'))
+        self.max_retries = int(os.getenv('PLANNER_MAX_RETRIES', '1'))
+        # New planning calls allowed when a reply can't be repaired locally
+        self.max_replans = int(os.getenv('PLANNER_MAX_REPLANS', '1'))
+
+    async def start(self):
+        """Create the shared client; called once at app startup"""
+        api_key = os.getenv('OPENAI_API_KEY')
+        if not api_key or not api_key.startswith('sk-'):
+            print("⚠️ OPENAI_API_KEY not configured - command planning disabled")
+            return
+
+        http_client = openai.DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+                keepalive_expiry=60,
+            ),
+        )
+        self.client = openai.AsyncOpenAI(
+            api_key=api_key,
+            http_client=http_client,
+            timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+            max_retries=self.max_retries,
+        )
+
+    async def close(self):
+        """Release pooled connections; called at app shutdown"""
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
+
+    @property
+    def available(self) -> bool:
+        return self.client is not None
+
+    async def plan(self, command_text: str, history: Optional[List[dict]] = None) -> List[dict]:
+        """Plan a command and return its validated action list
+
+        Runs on the event loop without blocking it. Cancelling the awaiting
+        task aborts the in-flight HTTP request. A reply that can't be
+        repaired is sent back to the model with the error, up to
+        ``max_replans`` times. ``history`` is earlier turns of the session
+        (see session_memory.py).
+        """
+        if self.client is None:
+            raise PlannerUnavailable('OpenAI API key not configured on server. Please contact administrator.')
+
+        messages = build_messages(command_text, history)
+        for attempt in range(self.max_replans + 1):
+            started = time.perf_counter()
+            response = await asyncio.wait_for(
+                self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    temperature=0.7,
+                ),
+                timeout=self.timeout,
+            )
+            metrics.planning_latency.labels('complete').observe(time.perf_counter() - started)
+            record_usage(response.usage)
+
+            reply = response.choices[0].message.content or ''
+            try:
+                actions, repairs = decode_plan(reply)
+            except PlanDecodeError as e:
+                if attempt == self.max_replans:
+                    record('failed')
+                    raise
+                record('replanned')
+                messages = messages + replan_messages(reply, e)
+                continue
+            if repairs:
+                print(f"Repaired plan: {'; '.join(repairs)}")
+            record('repaired' if repairs else 'clean')
+            return actions
+
+    async def stream_plan(self, command_text: str, parser: ActionStreamParser,
+                          history: Optional[List[dict]] = None) -> AsyncIterator[dict]:
+        """Stream a plan, yielding each action as soon as the model has finished it
+
+        The full completion text stays available in ``parser.text`` for
+        callers that need to fall back to parsing the whole reply. Callers
+        own the overall deadline since it has to cover time spent between
+        yields as well.
+        """
+        if self.client is None:
+            raise PlannerUnavailable('OpenAI API key not configured on server. Please contact administrator.')
+
+        started = time.perf_counter()
+        stream = await self.client.chat.completions.create(
+            model=self.model,
+            messages=build_messages(command_text, history),
+            temperature=0.7,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        try:
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    record_usage(chunk.usage)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    for action in parser.feed(delta):
+                        yield action
+        finally:
+            metrics.planning_latency.labels('stream').observe(time.perf_counter() - started)
+            await stream.close()
@@ -0,0 +1,292 @@
+"""
+Session recording for after-the-fact review
+Relayed screen frames and action results are appended to per-session
+segment files, one JSON record per line:
+
+    {"t": <unix seconds>, "m": <message as JSON>}
+    {"t": <unix seconds>, "b64": "<base64>"}              undecodable binary messages
+
+Each segment has an index of (timestamp, byte offset) pairs, one every
+INDEX_INTERVAL seconds, so a time range maps to a byte range without
+reading the segment. Writes are batched and done on a worker thread;
+replay reads go through mmap.
+"""
+
+import asyncio
+import base64
+import mmap
+import os
+import struct
+import time
+from bisect import bisect_right
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import wire
+from connections import Payload, session_id
+
+# Messages worth keeping for review; deltas replay on top of the keyframe before them
+RECORDED_TYPES = {'screen_frame', 'screen_delta', 'action_result'}
+
+# One index entry per this many seconds of recording (and at every segment start)
+INDEX_INTERVAL = 0.5
+_INDEX_ENTRY = struct.Struct('<dQ')
+
+SEGMENT_SUFFIX = '.ndjson'
+INDEX_SUFFIX = '.idx'
+
+# Writer thread closes a session's files after this long without records
+IDLE_CLOSE_SECONDS = 60
+
+READ_CHUNK = 256 * 1024
+
+
+def encode_record(timestamp: float, payload: Payload) -> bytes:
+    if not isinstance(payload, str):
+        # msgpack or a binary frame from the agent; store the JSON a viewer would have received
+        try:
+            payload = wire.TEXT.dumps(wire.loads(payload))
+        except ValueError:
+            return b'{"t":%.3f,"b64":"%s"}\n' % (timestamp, base64.b64encode(payload))
+    # Relayed text is already a JSON document, so it is embedded without re-encoding
+    return b'{"t":%.3f,"m":%s}\n' % (timestamp, payload.encode())
+
+
+class _OpenSegment:
+    def __init__(self, directory: Path, started: float):
+        name = f"{int(started * 1000)}"
+        self.data = open(directory / f"{name}{SEGMENT_SUFFIX}", 'ab')
+        self.index = open(directory / f"{name}{INDEX_SUFFIX}", 'ab')
+        self.size = self.data.tell()
+        self.last_indexed = float('-inf')
+        self.last_write = time.monotonic()
+
+    def append(self, timestamp: float, record: bytes):
+        if timestamp - self.last_indexed >= INDEX_INTERVAL:
+            self.index.write(_INDEX_ENTRY.pack(timestamp, self.size))
+            self.last_indexed = timestamp
+        self.data.write(record)
+        self.size += len(record)
+        self.last_write = time.monotonic()
+
+    def flush(self):
+        self.data.flush()
+        self.index.flush()
+
+    def close(self):
+        self.data.close()
+        self.index.close()
+
+
+class SessionRecorder:
+    """Buffers records on the event loop and appends them to segment files off it"""
+
+    def __init__(self, directory: Optional[Path], segment_bytes: int = 64 * 1024 * 1024,
+                 flush_interval: float = 0.5, max_pending_bytes: int = 32 * 1024 * 1024):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.flush_interval = flush_interval
+        self.max_pending_bytes = max_pending_bytes
+        self._pending: List[Tuple[str, float, Payload]] = []
+        self._pending_bytes = 0
+        self._segments: Dict[str, _OpenSegment] = {}  # only touched by the writer thread
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+
+        self.records = 0
+        self.bytes_written = 0
+        self.dropped = 0
+        self.errors = 0
+
+    @classmethod
+    def from_env(cls) -> "SessionRecorder":
+        directory = os.getenv('RECORDING_DIR')
+        return cls(
+            Path(directory) if directory else None,
+            segment_bytes=int(os.getenv('RECORDING_SEGMENT_BYTES', str(64 * 1024 * 1024))),
+            flush_interval=float(os.getenv('RECORDING_FLUSH_INTERVAL', '0.5')),
+            max_pending_bytes=int(os.getenv('RECORDING_MAX_PENDING_BYTES', str(32 * 1024 * 1024))),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.directory is not None
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._stopping.clear()
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        """Write what is queued and close the segments
+
+        The loop is asked to finish rather than cancelled: cancelling it
+        wouldn't stop a write already running in its thread, which would
+        then race the final flush for the same files.
+        """
+        if self._task is None:
+            return
+        self._stopping.set()
+        await self._task
+        self._task = None
+        await asyncio.to_thread(self._close_all)
+
+    def record(self, access_code: str, payload: Payload, msg_type: str):
+        """Queue a relayed message; cheap enough to call on every frame"""
+        if self._task is None or self._stopping.is_set() or msg_type not in RECORDED_TYPES:
+            return
+        size = len(payload)
+        if msg_type != 'action_result' and self._pending_bytes + size > self.max_pending_bytes:
+            # The disk can't keep up; lose frames rather than memory or results
+            self.dropped += 1
+            return
+        self._pending.append((access_code, time.time(), payload))
+        self._pending_bytes += size
+
+    def _take(self) -> List[Tuple[str, float, Payload]]:
+        batch, self._pending, self._pending_bytes = self._pending, [], 0
+        return batch
+
+    async def _loop(self):
+        stopping = False
+        while not stopping:
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            # Read before taking the batch: once stopping, record() adds
+            # nothing more, so this batch is the last one
+            stopping = self._stopping.is_set()
+            batch = self._take()
+            try:
+                await asyncio.to_thread(self._write_batch, batch)
+            except Exception as e:
+                self.errors += 1
+                print(f"Recording write failed: {e}")
+
+    def _write_batch(self, batch: List[Tuple[str, float, Payload]]):
+        touched = set()
+        for access_code, timestamp, payload in batch:
+            session = session_id(access_code)
+            segment = self._segments.get(session)
+            if segment is not None and segment.size >= self.segment_bytes:
+                segment.close()
+                segment = None
+            if segment is None:
+                directory = self.directory / session
+                directory.mkdir(exist_ok=True)
+                segment = self._segments[session] = _OpenSegment(directory, timestamp)
+            record = encode_record(timestamp, payload)
+            segment.append(timestamp, record)
+            touched.add(session)
+            self.records += 1
+            self.bytes_written += len(record)
+
+        for session in touched:
+            self._segments[session].flush()
+        now = time.monotonic()
+        for session, segment in list(self._segments.items()):
+            if now - segment.last_write > IDLE_CLOSE_SECONDS:
+                segment.close()
+                del self._segments[session]
+
+    def _close_all(self):
+        for segment in self._segments.values():
+            segment.close()
+        self._segments.clear()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "records": self.records,
+            "bytes_written": self.bytes_written,
+            "pending_bytes": self._pending_bytes,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "open_segments": len(self._segments),
+        }
+
+    # Replay
+
+    def session_dir(self, access_code: str) -> Path:
+        return self.directory / session_id(access_code)
+
+    def segments(self, access_code: str) -> List[dict]:
+        """Segments of a session in time order, with their first and last indexed times"""
+        directory = self.session_dir(access_code)
+        if not directory.is_dir():
+            return []
+        segments = []
+        for data_path in sorted(directory.glob(f"*{SEGMENT_SUFFIX}"), key=lambda p: int(p.stem)):
+            times, _ = _read_index(data_path.with_suffix(INDEX_SUFFIX))
+            if not times:
+                continue
+            segments.append({
+                "segment": data_path.stem,
+                "start": times[0],
+                "end": times[-1],
+                "bytes": data_path.stat().st_size,
+            })
+        return segments
+
+    def spans(self, access_code: str, start: float, end: float) -> List[Tuple[Path, int, int]]:
+        """(segment path, first byte, end byte) covering records in [start, end]
+
+        Span edges fall on index entries, so a range may include up to
+        INDEX_INTERVAL seconds of records either side of what was asked for.
+        """
+        spans = []
+        for segment in self.segments(access_code):
+            if segment["end"] + INDEX_INTERVAL < start or segment["start"] > end:
+                continue
+            data_path = self.session_dir(access_code) / f"{segment['segment']}{SEGMENT_SUFFIX}"
+            times, offsets = _read_index(data_path.with_suffix(INDEX_SUFFIX))
+            first = max(bisect_right(times, start) - 1, 0)
+            last = bisect_right(times, end) - 1
+            if last < first:
+                continue
+            begin = offsets[first]
+            # The index can run ahead of the data while a batch is being flushed
+            stop = min(offsets[last + 1] if last + 1 < len(offsets) else segment["bytes"], segment["bytes"])
+            if stop > begin:
+                spans.append((data_path, begin, stop))
+        return spans
+
+
+def _read_index(index_path: Path) -> Tuple[List[float], List[int]]:
+    try:
+        with open(index_path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return [], []
+    # A crash can leave a partial trailing entry
+    data = data[:len(data) - len(data) % _INDEX_ENTRY.size]
+    times, offsets = [], []
+    for timestamp, offset in _INDEX_ENTRY.iter_unpack(data):
+        times.append(timestamp)
+        offsets.append(offset)
+    return times, offsets
+
+
+def read_spans(spans: List[Tuple[Path, int, int]], skip: int, length: int) -> Iterator[bytes]:
+    """Yield ``length`` bytes of the concatenated spans starting ``skip`` bytes in
+
+    Runs in Starlette's threadpool; each segment is memory-mapped, so only
+    the pages being sent are read from disk.
+    """
+    for path, begin, stop in spans:
+        span_length = stop - begin
+        if skip >= span_length:
+            skip -= span_length
+            continue
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            position = begin + skip
+            skip = 0
+            while position < stop and length > 0:
+                size = min(READ_CHUNK, stop - position, length)
+                yield mapped[position:position + size]
+                position += size
+                length -= size
+        if length <= 0:
+            return
@@ -0,0 +1,295 @@
+"""
+Session routing for running the websocket hub on several workers or nodes
+An agent and its viewers may land on different processes; the router
+forwards messages for a code to whichever worker holds the peer
+"""
+
+import asyncio
+import hashlib
+import os
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, Optional, Set, Tuple, Union
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # Only needed for SESSION_ROUTER=redis
+    aioredis = None
+
+Payload = Union[str, bytes]
+Deliver = Callable[[str, str, Payload, bool], Awaitable[None]]
+
+# Envelope flags
+_TEXT = 0x01
+_DROPPABLE = 0x02
+
+# How long to skip publishing frames to a topic nobody else listens on
+QUIET_SECONDS = 1.0
+
+# Pause before re-subscribing after the broker connection fails
+RESUBSCRIBE_DELAY = 1.0
+
+
+class LocalSubscription:
+    def __init__(self, broker: "LocalBroker"):
+        self.broker = broker
+        self.topics: Set[str] = set()
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    async def subscribe(self, topic: str):
+        self.topics.add(topic)
+        self.broker._subscribers.setdefault(topic, set()).add(self)
+
+    async def unsubscribe(self, topic: str):
+        self.topics.discard(topic)
+        subscribers = self.broker._subscribers.get(topic)
+        if subscribers is not None:
+            subscribers.discard(self)
+            if not subscribers:
+                del self.broker._subscribers[topic]
+
+    async def get(self) -> Tuple[str, bytes]:
+        return await self.queue.get()
+
+    async def close(self):
+        for topic in list(self.topics):
+            await self.unsubscribe(topic)
+
+
+class LocalBroker:
+    """In-process stand-in for Redis pub/sub
+
+    Several ConnectionManagers sharing one LocalBroker behave like workers
+    sharing a Redis server, so the pub/sub path can be exercised without one.
+    """
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[LocalSubscription]] = {}
+
+    async def publish(self, topic: str, data: bytes) -> int:
+        subscribers = self._subscribers.get(topic, ())
+        for subscription in subscribers:
+            subscription.queue.put_nowait((topic, data))
+        return len(subscribers)
+
+    def subscription(self) -> LocalSubscription:
+        return LocalSubscription(self)
+
+    async def close(self):
+        self._subscribers.clear()
+
+
+class RedisSubscription:
+    def __init__(self, client):
+        self.pubsub = client.pubsub()
+        self.topics: Set[str] = set()
+
+    async def subscribe(self, topic: str):
+        self.topics.add(topic)
+        await self.pubsub.subscribe(topic)
+
+    async def unsubscribe(self, topic: str):
+        self.topics.discard(topic)
+        await self.pubsub.unsubscribe(topic)
+
+    async def get(self) -> Tuple[str, bytes]:
+        while True:
+            if not self.topics:
+                await asyncio.sleep(0.2)
+                continue
+            message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            if message is not None and message["type"] == "message":
+                topic = message["channel"]
+                return (topic.decode() if isinstance(topic, bytes) else topic), message["data"]
+
+    async def close(self):
+        await self.pubsub.aclose()
+
+
+class RedisBroker:
+    """Redis pub/sub broker shared by every backend worker"""
+
+    def __init__(self, url: str):
+        if aioredis is None:
+            raise RuntimeError("SESSION_ROUTER=redis requires the 'redis' package")
+        self.client = aioredis.from_url(url)
+
+    async def publish(self, topic: str, data: bytes) -> int:
+        return await self.client.publish(topic, data)
+
+    def subscription(self) -> RedisSubscription:
+        return RedisSubscription(self.client)
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class InMemoryRouter:
+    """Single-process routing: every peer is local, nothing to forward"""
+
+    distributed = False
+
+    async def start(self, deliver: Deliver):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def join(self, access_code: str, role: str):
+        pass
+
+    async def leave(self, access_code: str, role: str):
+        pass
+
+    async def publish(self, access_code: str, role: str, payload: Payload, droppable: bool = False):
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": "memory"}
+
+
+class PubSubRouter:
+    """Forwards messages between workers over a pub/sub broker
+
+    Each worker subscribes to ``24ai:<role>:<code hash>`` while it holds a local
+    peer of that role, and publishes messages for peers it does not hold.
+    Envelopes carry the origin worker id so a worker ignores its own
+    messages, plus flags saying whether the payload is text and whether it
+    is a droppable frame.
+    """
+
+    distributed = True
+
+    def __init__(self, broker, prefix: str = "24ai"):
+        self.broker = broker
+        self.prefix = prefix
+        self.worker_id = uuid.uuid4().bytes[:8]
+        self.subscription = None
+        self._deliver: Optional[Deliver] = None
+        self._reader: Optional[asyncio.Task] = None
+        self._local_peers: Dict[str, int] = {}
+        self._topic_codes: Dict[str, Tuple[str, str]] = {}
+        self._quiet_until: Dict[str, float] = {}
+
+        self.published = 0
+        self.received = 0
+        self.skipped = 0
+        self.read_errors = 0
+
+    def topic(self, access_code: str, role: str) -> str:
+        # Hash the code so access codes never appear in broker channel names
+        digest = hashlib.sha256(access_code.encode()).hexdigest()[:16]
+        return f"{self.prefix}:{role}:{digest}"
+
+    async def start(self, deliver: Deliver):
+        self._deliver = deliver
+        self.subscription = self.broker.subscription()
+        self._reader = asyncio.create_task(self._read_loop())
+
+    async def stop(self):
+        if self._reader is not None:
+            self._reader.cancel()
+        if self.subscription is not None:
+            await self.subscription.close()
+        await self.broker.close()
+
+    async def join(self, access_code: str, role: str):
+        topic = self.topic(access_code, role)
+        count = self._local_peers.get(topic, 0)
+        self._local_peers[topic] = count + 1
+        if count == 0:
+            self._topic_codes[topic] = (access_code, role)
+            await self.subscription.subscribe(topic)
+
+    async def leave(self, access_code: str, role: str):
+        topic = self.topic(access_code, role)
+        count = self._local_peers.get(topic, 0) - 1
+        if count > 0:
+            self._local_peers[topic] = count
+            return
+        self._local_peers.pop(topic, None)
+        self._topic_codes.pop(topic, None)
+        await self.subscription.unsubscribe(topic)
+
+    async def publish(self, access_code: str, role: str, payload: Payload, droppable: bool = False):
+        topic = self.topic(access_code, role)
+        if droppable and self._quiet_until.get(topic, 0) > time.monotonic():
+            self.skipped += 1
+            return
+
+        flags = _DROPPABLE if droppable else 0
+        if isinstance(payload, str):
+            flags |= _TEXT
+            payload = payload.encode()
+        receivers = await self.broker.publish(topic, self.worker_id + bytes((flags,)) + payload)
+        self.published += 1
+
+        # Our own subscription counts as a receiver; if nobody else is
+        # listening, stop shipping frames there for a moment
+        remote = receivers - (1 if topic in self._local_peers else 0)
+        if remote <= 0:
+            self._quiet_until[topic] = time.monotonic() + QUIET_SECONDS
+        else:
+            self._quiet_until.pop(topic, None)
+
+    async def _resubscribe(self):
+        """Replace a failed subscription and listen on every topic we hold again"""
+        try:
+            await self.subscription.close()
+        except Exception:
+            pass
+        self.subscription = self.broker.subscription()
+        for topic in list(self._topic_codes):
+            await self.subscription.subscribe(topic)
+
+    async def _read_loop(self):
+        while True:
+            try:
+                topic, data = await self.subscription.get()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Broker connection dropped; without this the reader dies and
+                # this worker's peers stop hearing from the other workers
+                self.read_errors += 1
+                print(f"Routed read failed, re-subscribing: {e!r}")
+                await asyncio.sleep(RESUBSCRIBE_DELAY)
+                try:
+                    await self._resubscribe()
+                except Exception as e:
+                    print(f"Re-subscribe failed: {e!r}")
+                continue
+            if data[:8] == self.worker_id or topic not in self._topic_codes:
+                continue
+            access_code, role = self._topic_codes[topic]
+            flags = data[8]
+            payload = data[9:]
+            if flags & _TEXT:
+                payload = payload.decode()
+            self.received += 1
+            try:
+                await self._deliver(access_code, role, payload, bool(flags & _DROPPABLE))
+            except Exception as e:
+                print(f"Routed delivery failed: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "backend": "pubsub",
+            "worker_id": self.worker_id.hex(),
+            "topics": len(self._local_peers),
+            "published": self.published,
+            "received": self.received,
+            "skipped_frames": self.skipped,
+            "read_errors": self.read_errors,
+        }
+
+
+def create_router():
+    """Build the router selected by SESSION_ROUTER (memory or redis)"""
+    kind = os.getenv('SESSION_ROUTER', 'memory')
+    if kind == 'redis':
+        return PubSubRouter(RedisBroker(os.getenv('REDIS_URL', 'redis://localhost:6379/0')))
+    if kind == 'local':
+        # Exercises the pub/sub path inside one process
+        return PubSubRouter(LocalBroker())
+    return InMemoryRouter()
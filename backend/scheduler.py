@@ -0,0 +1,279 @@
+"""
+Command scheduling for the AI Control backend
+One active sequence per access code, with duplicate pending commands
+coalesced, and a global fair limit on concurrent LLM planning calls
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Deque, Dict, Optional
+
+from plan_cache import normalize_command
+
+# A repeat of the running command this soon after it is treated as a double-submit
+DUPLICATE_WINDOW = 2.0
+
+
+class FairLimiter:
+    """Global semaphore plus token bucket for LLM calls, granted round-robin across sessions
+
+    A session that submits many commands only gets one slot per turn, so a
+    single busy user can't starve everyone else.
+    """
+
+    def __init__(self, max_concurrent: int = 8, rate: float = 2.0, burst: int = 10):
+        self.max_concurrent = max_concurrent
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.active = 0
+        self._refilled_at = time.monotonic()
+        self._waiters: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    @classmethod
+    def from_env(cls) -> "FairLimiter":
+        return cls(
+            max_concurrent=int(os.getenv('PLANNER_MAX_CONCURRENT', '8')),
+            rate=float(os.getenv('PLANNER_RATE', '2')),
+            burst=int(os.getenv('PLANNER_BURST', '10')),
+        )
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _dispatch(self):
+        self._refill()
+        while self._waiters and self.active < self.max_concurrent:
+            if self.tokens < 1:
+                # Wake up when the next token is due
+                if self._timer is None:
+                    delay = (1 - self.tokens) / self.rate
+                    self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+                return
+
+            session, waiters = self._waiters.popitem(last=False)
+            future = waiters.popleft()
+            if waiters:
+                # Back of the line for this session's next request
+                self._waiters[session] = waiters
+            if future.done():
+                continue
+            self.tokens -= 1
+            self.active += 1
+            future.set_result(None)
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    async def acquire(self, session: str):
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(session, deque()).append(future)
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just as we were cancelled; hand the slot back
+                self.release()
+            raise
+
+    def would_wait(self) -> bool:
+        self._refill()
+        return bool(self._waiters) or self.active >= self.max_concurrent or self.tokens < 1
+
+    def release(self):
+        self.active -= 1
+        self._dispatch()
+
+    def stats(self) -> dict:
+        self._refill()
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_concurrent": self.max_concurrent,
+            "tokens": round(self.tokens, 2),
+        }
+
+
+@dataclass
+class QueuedCommand:
+    access_code: str
+    text: str
+    requester: object  # ClientChannel of the viewer that sent it
+    key: str = ''
+    submitted_at: float = field(default_factory=time.monotonic)
+    coalesced: int = 0
+    dispatched: bool = False
+
+
+class SessionQueue:
+    def __init__(self):
+        self.pending: Deque[QueuedCommand] = deque()
+        self.active: Optional[QueuedCommand] = None
+        self.task: Optional[asyncio.Task] = None
+        self.finished = asyncio.Event()
+
+
+class CommandScheduler:
+    """Per-access-code command queue with one active sequence at a time
+
+    ``run`` plans and dispatches one command and returns True if a sequence
+    was handed to the agent; the session then stays busy until the agent
+    reports ``sequence_complete`` (or the sequence times out).
+    """
+
+    def __init__(self, run: Callable[[QueuedCommand], Awaitable[bool]],
+                 notify: Callable[[object, dict], Awaitable[None]],
+                 max_pending: int = 5, sequence_timeout: float = 120):
+        self.run = run
+        self.notify = notify
+        self.max_pending = max_pending
+        self.sequence_timeout = sequence_timeout
+        self.sessions: Dict[str, SessionQueue] = {}
+
+        self.submitted = 0
+        self.coalesced = 0
+        self.superseded = 0
+        self.timeouts = 0
+
+    @classmethod
+    def from_env(cls, run, notify) -> "CommandScheduler":
+        return cls(
+            run, notify,
+            max_pending=int(os.getenv('SCHEDULER_MAX_PENDING', '5')),
+            sequence_timeout=float(os.getenv('SEQUENCE_TIMEOUT', '120')),
+        )
+
+    async def submit(self, access_code: str, text: str, requester, supersede: bool = False):
+        """Queue a command; duplicates of a pending command are merged into it"""
+        self.submitted += 1
+        session = self.sessions.setdefault(access_code, SessionQueue())
+        key = normalize_command(text)
+
+        active = session.active
+        if active is not None and active.key == key and (
+                not active.dispatched or time.monotonic() - active.submitted_at < DUPLICATE_WINDOW):
+            active.coalesced += 1
+            self.coalesced += 1
+            await self.notify(requester, {
+                'type': 'command_queued',
+                'command': text,
+                'position': 0,
+                'coalesced': True
+            })
+            return
+
+        for queued in session.pending:
+            if queued.key == key:
+                queued.coalesced += 1
+                self.coalesced += 1
+                await self.notify(requester, {
+                    'type': 'command_queued',
+                    'command': text,
+                    'position': self._position(session, queued),
+                    'coalesced': True
+                })
+                return
+
+        if supersede:
+            while session.pending:
+                await self._supersede(session.pending.popleft())
+        while len(session.pending) >= self.max_pending:
+            await self._supersede(session.pending.popleft())
+
+        queued = QueuedCommand(access_code, text, requester, key)
+        session.pending.append(queued)
+        if session.active is not None:
+            await self.notify(requester, {
+                'type': 'command_queued',
+                'command': text,
+                'position': self._position(session, queued)
+            })
+        self._pump(access_code, session)
+
+    async def _supersede(self, queued: QueuedCommand):
+        self.superseded += 1
+        await self.notify(queued.requester, {
+            'type': 'command_superseded',
+            'command': queued.text
+        })
+
+    def _position(self, session: SessionQueue, queued: QueuedCommand) -> int:
+        """Number of commands that will run before this one"""
+        return session.pending.index(queued) + (session.active is not None)
+
+    def _pump(self, access_code: str, session: SessionQueue):
+        if session.active is None and session.pending:
+            session.active = session.pending.popleft()
+            session.finished.clear()
+            session.task = asyncio.create_task(self._run_active(access_code, session))
+
+    async def _run_active(self, access_code: str, session: SessionQueue):
+        queued = session.active
+        try:
+            queued.dispatched = await self.run(queued)
+            if queued.dispatched:
+                try:
+                    await asyncio.wait_for(session.finished.wait(), self.sequence_timeout)
+                except asyncio.TimeoutError:
+                    self.timeouts += 1
+        finally:
+            session.active = None
+            session.task = None
+            if session.pending:
+                self._pump(access_code, session)
+                for waiting in list(session.pending):
+                    await self.notify(waiting.requester, {
+                        'type': 'command_queued',
+                        'command': waiting.text,
+                        'position': self._position(session, waiting)
+                    })
+            elif access_code in self.sessions and session.active is None:
+                del self.sessions[access_code]
+
+    def sequence_finished(self, access_code: str):
+        """Called when the agent reports the active sequence is done"""
+        session = self.sessions.get(access_code)
+        if session is not None:
+            session.finished.set()
+
+    def is_busy(self, access_code: str) -> bool:
+        """True while a command for this code is being planned or run"""
+        session = self.sessions.get(access_code)
+        return session is not None and session.active is not None
+
+    def drop_requester(self, access_code: str, requester):
+        """Forget commands from a viewer that disconnected
+
+        Pending commands are removed; a command still being planned for it is
+        cancelled. A sequence already running on the agent is left alone.
+        """
+        session = self.sessions.get(access_code)
+        if session is None:
+            return
+        session.pending = deque(q for q in session.pending if q.requester is not requester)
+        active = session.active
+        if active is not None and active.requester is requester and not active.dispatched and session.task is not None:
+            session.task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self.sessions),
+            "active": sum(1 for s in self.sessions.values() if s.active is not None),
+            "pending": sum(len(s.pending) for s in self.sessions.values()),
+            "submitted": self.submitted,
+            "coalesced": self.coalesced,
+            "superseded": self.superseded,
+            "timeouts": self.timeouts,
+        }
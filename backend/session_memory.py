@@ -0,0 +1,204 @@
+"""
+Per-session planning memory
+Keeps each access code's recent commands, the actions sent for them and
+how those actions went, and turns them into prompt context under a fixed
+token budget: the newest turns verbatim, older ones as one-line summaries,
+the rest dropped.
+"""
+
+import json
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional
+
+# Rough tokens per character for English prompts and JSON; no tokenizer needed
+CHARS_PER_TOKEN = 4
+
+# Longest text kept from a keyboard_type action or error message in a summary
+SNIPPET = 40
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _snippet(text, limit: int = SNIPPET) -> str:
+    text = str(text)
+    return text if len(text) <= limit else text[:limit - 1] + '…'
+
+
+def _describe(action: dict) -> str:
+    """Short form of one action for summaries, e.g. open_url youtube.com"""
+    params = action.get('params') or {}
+    kind = action.get('type', '?')
+    if kind == 'open_url':
+        return f"open_url {_snippet(str(params.get('url', '')).split('://')[-1])}"
+    if kind == 'keyboard_type':
+        return f"type {_snippet(params.get('text', ''))!r}"
+    if kind in ('mouse_click', 'mouse_move') and 'x' in params:
+        return f"{kind} ({params.get('x')},{params.get('y')})"
+    if params:
+        return f"{kind} {_snippet(' '.join(str(v) for v in params.values()))}"
+    return kind
+
+
+class Turn:
+    """One command and what came of it
+
+    ``actions`` may still be growing while a streamed plan is dispatched;
+    the turn is added before the first action goes out so that results
+    the agent reports straight away land on it.
+    """
+
+    __slots__ = ('command', 'actions', 'failures', 'completed', 'at')
+
+    def __init__(self, command: str, actions: List[dict]):
+        self.command = command
+        self.actions = actions
+        self.failures: List[str] = []
+        self.completed = False
+        self.at = time.time()
+
+    def outcome(self) -> str:
+        if self.failures:
+            return 'failed: ' + '; '.join(self.failures)
+        return 'done' if self.completed else 'not confirmed'
+
+    def full(self) -> List[dict]:
+        return [
+            {"role": "user", "content": self.command},
+            # Exactly what the planner would have produced, without whitespace
+            {"role": "assistant", "content": json.dumps(self.actions, separators=(',', ':'))},
+            {"role": "system", "content": f"Result of that plan: {self.outcome()}"},
+        ]
+
+    def short(self) -> str:
+        summary = '; '.join(_describe(action) for action in self.actions)
+        return f"- {_snippet(self.command, 80)!r} -> {summary} ({self.outcome()})"
+
+
+class SessionMemory:
+    """Recent turns per access code, rendered as chat messages within a token budget"""
+
+    def __init__(self, budget_tokens: int = 1500, full_turns: int = 3, max_turns: int = 20,
+                 max_sessions: int = 1000, ttl: float = 1800):
+        self.budget_tokens = budget_tokens
+        self.full_turns = full_turns
+        self.max_turns = max_turns
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, Deque[Turn]]" = OrderedDict()
+        self._touched: Dict[str, float] = {}
+        self.compacted = 0
+        self.evicted = 0
+
+    @classmethod
+    def from_env(cls) -> "SessionMemory":
+        return cls(
+            budget_tokens=int(os.getenv('SESSION_MEMORY_TOKENS', '1500')),
+            full_turns=int(os.getenv('SESSION_MEMORY_FULL_TURNS', '3')),
+            max_turns=int(os.getenv('SESSION_MEMORY_MAX_TURNS', '20')),
+            ttl=float(os.getenv('SESSION_MEMORY_TTL', '1800')),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget_tokens > 0
+
+    def _turns(self, access_code: str) -> Optional[Deque[Turn]]:
+        turns = self._sessions.get(access_code)
+        if turns is None:
+            return None
+        if time.monotonic() - self._touched[access_code] > self.ttl:
+            self.forget(access_code)
+            return None
+        return turns
+
+    def add_turn(self, access_code: str, command: str, actions: List[dict]):
+        """Remember a command and the actions sent for it, before they run"""
+        if not self.enabled:
+            return
+        turns = self._turns(access_code)
+        if turns is None:
+            turns = self._sessions[access_code] = deque(maxlen=self.max_turns)
+        turns.append(Turn(command, actions))
+        self._sessions.move_to_end(access_code)
+        self._touched[access_code] = time.monotonic()
+        while len(self._sessions) > self.max_sessions:
+            oldest, _ = self._sessions.popitem(last=False)
+            del self._touched[oldest]
+            self.evicted += 1
+
+    def record_result(self, access_code: str, message: dict):
+        """Note an action_result or sequence_complete against the latest turn"""
+        turns = self._turns(access_code)
+        if not turns:
+            return
+        turn = turns[-1]
+        if message.get('type') == 'sequence_complete':
+            turn.completed = True
+            return
+        result = message.get('result') or {}
+        if result.get('status') == 'error' and len(turn.failures) < 3:
+            turn.failures.append(f"step {message.get('step')}: {_snippet(result.get('message', ''))}")
+
+    def context(self, access_code: str) -> List[dict]:
+        """History messages to put between the system prompt and the new command
+
+        Newest turns first claim the budget in full (up to ``full_turns``);
+        older turns get a line each in one summary message while budget
+        remains. Whatever doesn't fit is left out.
+        """
+        turns = self._turns(access_code) if self.enabled else None
+        if not turns:
+            return []
+
+        budget = self.budget_tokens
+        full: List[List[dict]] = []
+        older = list(turns)
+        while older and len(full) < self.full_turns:
+            messages = older[-1].full()
+            cost = sum(estimate_tokens(m['content']) for m in messages)
+            if cost > budget:
+                break
+            full.append(messages)
+            budget -= cost
+            older.pop()
+
+        lines: List[str] = []
+        header = "Earlier in this session (oldest first):"
+        budget -= estimate_tokens(header)
+        for turn in reversed(older):
+            line = turn.short()
+            cost = estimate_tokens(line)
+            if cost > budget:
+                break
+            lines.append(line)
+            budget -= cost
+        if older:
+            self.compacted += 1
+
+        history: List[dict] = []
+        if lines:
+            history.append({"role": "system", "content": '\n'.join([header] + lines[::-1])})
+        for messages in reversed(full):
+            history.extend(messages)
+        return history
+
+    def has_history(self, access_code: str) -> bool:
+        return bool(self._turns(access_code)) if self.enabled else False
+
+    def forget(self, access_code: str):
+        """Drop a session's memory; called when its agent disconnects"""
+        if self._sessions.pop(access_code, None) is not None:
+            del self._touched[access_code]
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "turns": sum(len(turns) for turns in self._sessions.values()),
+            "budget_tokens": self.budget_tokens,
+            "compacted": self.compacted,
+            "evicted": self.evicted,
+        }
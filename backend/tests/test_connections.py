@@ -0,0 +1,250 @@
+import asyncio
+
+import connections
+from connections import ClientChannel
+
+
+class FakeWebSocket:
+    """Records what is sent; while ``gate`` is clear, sends block like a slow peer"""
+
+    def __init__(self):
+        self.sent = []
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data):
+        await self.gate.wait()
+        self.sent.append(data)
+
+    async def send_bytes(self, data):
+        await self.gate.wait()
+        self.sent.append(data)
+
+
+async def settle():
+    # Each send goes through wait_for, which takes a few loop iterations
+    for _ in range(50):
+        await asyncio.sleep(0)
+
+
+def test_control_messages_keep_their_order():
+    async def run():
+        websocket = FakeWebSocket()
+        channel = ClientChannel(websocket)
+        channel.start()
+        for i in range(5):
+            assert await channel.send(f'{{"type": "action_result", "step": {i}}}')
+        await settle()
+        assert websocket.sent == [f'{{"type": "action_result", "step": {i}}}' for i in range(5)]
+        channel.close()
+
+    asyncio.run(run())
+
+
+def test_newer_frame_replaces_one_not_yet_sent():
+    async def run():
+        websocket = FakeWebSocket()
+        websocket.gate.clear()
+        channel = ClientChannel(websocket)
+        channel.start()
+        await channel.send('first')
+        await settle()
+        # The writer is stuck sending 'first'; frames pile up behind it
+        await channel.send('frame 1', droppable=True)
+        await channel.send('frame 2', droppable=True)
+        assert channel.frames_dropped == 1
+
+        websocket.gate.set()
+        await settle()
+        assert websocket.sent == ['first', 'frame 2']
+        assert channel.frames_sent == 1
+        channel.close()
+
+    asyncio.run(run())
+
+
+def test_sender_waits_for_room_in_a_full_queue():
+    async def run():
+        websocket = FakeWebSocket()
+        websocket.gate.clear()
+        channel = ClientChannel(websocket, max_depth=2)
+        channel.start()
+        for i in range(3):
+            await channel.send(str(i))
+        await settle()
+        blocked = asyncio.create_task(channel.send('3'))
+        await settle()
+        assert not blocked.done()
+
+        websocket.gate.set()
+        await settle()
+        assert blocked.done() and blocked.result()
+        assert websocket.sent == ['0', '1', '2', '3']
+        channel.close()
+
+    asyncio.run(run())
+
+
+def test_closed_channel_refuses_messages():
+    async def run():
+        channel = ClientChannel(FakeWebSocket())
+        channel.start()
+        channel.close()
+        assert not await channel.send('late')
+
+    asyncio.run(run())
+
+
+def test_peek_message_type():
+    assert connections.peek_message_type('{"type": "screen_frame", "data": "..."}') == 'screen_frame'
+    assert connections.peek_message_type('{"data": "...", "type": "screen_frame"}') == ''
+
+
+def test_every_viewer_gets_the_same_message():
+    async def run():
+        manager = connections.ConnectionManager()
+        first, second = FakeWebSocket(), FakeWebSocket()
+        await manager.connect_web('code', first)
+        await manager.connect_web('code', second)
+        assert manager.viewer_count('code') == 2
+
+        await manager.relay_to_web('code', '{"type": "sequence_complete"}', 'sequence_complete')
+        await settle()
+        assert first.sent == second.sent == ['{"type": "sequence_complete"}']
+        assert first.sent[0] is second.sent[0]
+
+    asyncio.run(run())
+
+
+def test_viewer_skips_deltas_until_its_first_keyframe():
+    async def run():
+        websocket = FakeWebSocket()
+        channel = ClientChannel(websocket)
+        channel.start()
+        assert channel.needs_keyframe
+        await channel.send('delta 0', droppable=True, delta=True)
+        await channel.send('key', droppable=True)
+        await channel.send('delta 1', droppable=True, delta=True)
+        await settle()
+        assert websocket.sent == ['key', 'delta 1']
+        assert channel.deltas_skipped == 1 and channel.frames_dropped == 0
+        channel.close()
+
+    asyncio.run(run())
+
+
+def test_slow_viewer_drops_deltas_past_the_limit_until_a_keyframe():
+    async def run():
+        websocket = FakeWebSocket()
+        websocket.gate.clear()
+        channel = ClientChannel(websocket)
+        channel.start()
+        await channel.send('key 1', droppable=True)
+        await settle()
+        for i in range(connections.MAX_PENDING_DELTAS + 2):
+            await channel.send(f'delta {i}', droppable=True, delta=True)
+        assert channel.needs_keyframe
+        # A keyframe replaces every update still queued
+        await channel.send('key 2', droppable=True)
+        assert not channel.needs_keyframe
+
+        websocket.gate.set()
+        await settle()
+        assert websocket.sent == ['key 1', 'key 2']
+        channel.close()
+
+    asyncio.run(run())
+
+
+def test_keyframe_requests_are_rate_limited():
+    async def run():
+        manager = connections.ConnectionManager()
+        agent = FakeWebSocket()
+        await manager.connect_agent('code', agent)
+        await manager.connect_web('code', FakeWebSocket())
+        await manager.connect_web('code', FakeWebSocket())
+        # A delta reaching a viewer without a keyframe asks again, but not yet
+        await manager.relay_to_web('code', '{"type": "screen_delta"}', 'screen_delta')
+        await settle()
+        assert agent.sent == ['{"type": "request_keyframe"}']
+
+    asyncio.run(run())
+
+
+def test_relay_closes_a_stuck_viewer_instead_of_waiting():
+    async def run():
+        manager = connections.ConnectionManager()
+        stuck, fast = FakeWebSocket(), FakeWebSocket()
+        stuck.gate.clear()
+        stuck_channel = await manager.connect_web('code', stuck)
+        await manager.connect_web('code', fast)
+        stuck_channel.max_depth = 2
+
+        for i in range(4):
+            await manager.relay_to_web('code', f'{{"type": "action_result", "step": {i}}}', 'action_result')
+        await settle()
+        assert stuck_channel.closed and stuck_channel.overflowed
+        assert len(fast.sent) == 4
+
+    asyncio.run(run())
+
+
+def test_viewer_without_frames_gets_only_control_messages():
+    async def run():
+        manager = connections.ConnectionManager()
+        agent, commands = FakeWebSocket(), FakeWebSocket()
+        await manager.connect_agent('code', agent)
+        channel = await manager.connect_web('code', commands, wants_frames=False)
+        assert not channel.needs_keyframe
+
+        await manager.relay_to_web('code', '{"type": "screen_frame"}', 'screen_frame')
+        await manager.relay_to_web('code', '{"type": "screen_delta"}', 'screen_delta')
+        await manager.relay_to_web('code', '{"type": "command_result"}', 'command_result')
+        await settle()
+        assert commands.sent[1:] == ['{"type": "command_result"}']
+        assert '"frames": "none"' in commands.sent[0]
+        # Nothing to ask the agent for on its behalf
+        assert agent.sent == []
+
+    asyncio.run(run())
+
+
+def test_transcode_failure_only_skips_that_viewer():
+    def refuse(message):
+        raise ValueError('cannot encode')
+
+    async def run():
+        manager = connections.ConnectionManager()
+        broken, plain = FakeWebSocket(), FakeWebSocket()
+        await manager.connect_web('code', broken, connections.wire.Codec('broken', True, refuse, refuse))
+        await manager.connect_web('code', plain)
+        await settle()
+        sent_before = len(broken.sent)
+
+        await manager.relay_to_web('code', '{"type": "command_result"}', 'command_result')
+        await settle()
+        assert plain.sent == ['{"type": "command_result"}']
+        assert len(broken.sent) == sent_before
+
+    asyncio.run(run())
+
+
+
+def test_close_stops_the_writer_at_any_point_of_a_send():
+    async def run():
+        # wait_for returns the result instead of raising if the send finished
+        # as the cancel arrived; the writer must still notice it was closed
+        for steps in range(8):
+            channel = ClientChannel(FakeWebSocket())
+            channel.start()
+            await channel.send('message')
+            for _ in range(steps):
+                await asyncio.sleep(0)
+            channel.close()
+            await settle()
+            assert channel._task.done(), steps
+
+    asyncio.run(run())
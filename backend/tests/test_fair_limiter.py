@@ -0,0 +1,80 @@
+import asyncio
+
+from scheduler import FairLimiter
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_sessions_take_turns_for_a_slot():
+    async def run():
+        limiter = FairLimiter(max_concurrent=1, rate=1000, burst=100)
+        await limiter.acquire('holder')
+        granted = []
+
+        async def call(session):
+            await limiter.acquire(session)
+            granted.append(session)
+
+        # A busy session queues three calls before the others queue one each
+        tasks = [asyncio.create_task(call(s)) for s in ('busy', 'busy', 'busy', 'quiet', 'other')]
+        await settle()
+        assert limiter.waiting == 5 and limiter.would_wait()
+
+        for _ in tasks:
+            limiter.release()
+            await settle()
+        assert granted == ['busy', 'quiet', 'other', 'busy', 'busy']
+        assert limiter.active == 1 and limiter.waiting == 0
+
+    asyncio.run(run())
+
+
+def test_concurrency_limit():
+    async def run():
+        limiter = FairLimiter(max_concurrent=2, rate=1000, burst=100)
+        await limiter.acquire('a')
+        await limiter.acquire('b')
+        waiter = asyncio.create_task(limiter.acquire('c'))
+        await settle()
+        assert not waiter.done() and limiter.active == 2
+
+        limiter.release()
+        await settle()
+        assert waiter.done() and limiter.active == 2
+
+    asyncio.run(run())
+
+
+def test_token_bucket_delays_past_the_burst():
+    async def run():
+        limiter = FairLimiter(max_concurrent=10, rate=50, burst=1)
+        await limiter.acquire('a')
+        assert limiter.would_wait()
+        waiter = asyncio.create_task(limiter.acquire('b'))
+        await settle()
+        assert not waiter.done()
+        # The next token is due after 1 / rate seconds
+        await asyncio.wait_for(waiter, 1)
+        assert limiter.active == 2
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_gives_up_its_place():
+    async def run():
+        limiter = FairLimiter(max_concurrent=1, rate=1000, burst=100)
+        await limiter.acquire('a')
+        cancelled = asyncio.create_task(limiter.acquire('b'))
+        waiter = asyncio.create_task(limiter.acquire('c'))
+        await settle()
+        cancelled.cancel()
+        await settle()
+
+        limiter.release()
+        await settle()
+        assert waiter.done() and limiter.active == 1
+
+    asyncio.run(run())
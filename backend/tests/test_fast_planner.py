@@ -0,0 +1,76 @@
+import pytest
+
+from fast_planner import LOAD_WAIT, FastPlanner, refers_back
+
+
+def plan(command, history=None):
+    return FastPlanner().plan(command, history)
+
+
+@pytest.mark.parametrize('command, actions', [
+    ('open youtube', [{"type": "open_url", "params": {"url": "https://www.youtube.com"}}]),
+    ('go to example.com', [{"type": "open_url", "params": {"url": "https://example.com"}}]),
+    ('open VS Code', [{"type": "open_app", "params": {"app": "Visual Studio Code"}}]),
+    ('launch Google Chrome', [{"type": "open_app", "params": {"app": "Google Chrome"}}]),
+    ('open system preferences', [{"type": "open_app", "params": {"app": "System Settings"}}]),
+    ('type "hello, world"', [{"type": "keyboard_type", "params": {"text": "hello, world"}}]),
+    ('type "rock and roll"', [{"type": "keyboard_type", "params": {"text": "rock and roll"}}]),
+    ('press command+c', [{"type": "keyboard_press", "params": {"key": "cmd+c"}}]),
+    ('hit the enter key', [{"type": "keyboard_press", "params": {"key": "enter"}}]),
+    ('scroll down', [{"type": "scroll", "params": {"amount": 3}}]),
+    ('scroll up 5 times', [{"type": "scroll", "params": {"amount": -5}}]),
+    ('wait 1.5 seconds', [{"type": "wait", "params": {"seconds": 1.5}}]),
+    ('google cat videos', [{"type": "open_url", "params": {"url": "https://www.google.com/search?q=cat+videos"}}]),
+])
+def test_single_rules(command, actions):
+    assert plan(command) == actions
+
+
+@pytest.mark.parametrize('command', [
+    'write a script that renames my photos',
+    'open the report I was working on',
+    'press the big red button',
+    'click the login button',
+    # Unquoted text with a connector may be several steps
+    'type I love cats and dogs, then press enter',
+    'type rock and roll',
+    '',
+])
+def test_unparsed_commands_go_to_the_llm(command):
+    assert plan(command) is None
+
+
+def test_clauses_get_load_waits_between_them():
+    assert plan('open safari and type hello') == [
+        {"type": "open_app", "params": {"app": "Safari"}},
+        {"type": "wait", "params": {"seconds": LOAD_WAIT}},
+        {"type": "keyboard_type", "params": {"text": "hello"}},
+    ]
+
+
+def test_search_after_opening_a_site_goes_to_its_results():
+    assert plan('open youtube and search for lofi beats') == [
+        {"type": "open_url", "params": {"url": "https://www.youtube.com/results?search_query=lofi+beats"}},
+    ]
+
+
+def test_back_references_are_left_to_the_llm_with_history():
+    history = [{'command': 'open spotify'}]
+    assert plan('type that again', history) is None
+    assert plan('type that again') == [{"type": "keyboard_type", "params": {"text": "that again"}}]
+    # Quoted text is typed as is
+    assert plan('type "do it"', history) == [{"type": "keyboard_type", "params": {"text": "do it"}}]
+
+
+def test_refers_back():
+    assert refers_back('now pause it')
+    assert refers_back('open the same page')
+    assert not refers_back('open youtube')
+    assert not refers_back("type 'that'")
+
+
+def test_stats_count_hits_and_misses():
+    planner = FastPlanner()
+    planner.plan('scroll down')
+    planner.plan('summarise my inbox')
+    assert planner.stats() == {"hits": 1, "misses": 1, "hit_rate": 0.5}
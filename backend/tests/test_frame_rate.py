@@ -0,0 +1,149 @@
+import asyncio
+
+from frame_rate import AGENT_DEFAULT_FPS, DROP_LOW, FrameRateController
+
+
+class FakeViewer:
+    def __init__(self):
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.control_depth = 0
+        self.wants_frames = True
+
+
+class FakeRouter:
+    distributed = False
+
+
+class FakeManager:
+    def __init__(self):
+        self.agent_connections = {'code': object()}
+        self.active_connections = {}
+        self.agent_caps = {'code': set()}
+        self.router = FakeRouter()
+        self.sent = []
+
+    def agent_supports(self, access_code, cap):
+        return cap in self.agent_caps.get(access_code, ())
+
+    async def send_to_agent(self, access_code, message):
+        self.sent.append(message['fps'])
+        return True
+
+
+def controller(manager, busy=False, **options):
+    options.setdefault('hold', 0)
+    return FrameRateController(manager, lambda code: busy, interval=2, **options)
+
+
+def test_no_viewer_drops_to_min_rate():
+    async def run():
+        manager = FakeManager()
+        rate = controller(manager)
+        await rate.tick()
+        assert manager.sent == [1]
+
+    asyncio.run(run())
+
+
+def test_watched_session_keeps_default_rate_until_idle():
+    async def run():
+        manager = FakeManager()
+        manager.active_connections['code'] = {FakeViewer()}
+        rate = controller(manager)
+        await rate.tick()
+        assert manager.sent == [] and rate.sessions['code'].fps == AGENT_DEFAULT_FPS
+
+        rate.idle_after = 0
+        await rate.tick()
+        assert manager.sent == [2]
+
+    asyncio.run(run())
+
+
+def test_command_raises_rate_before_it_runs():
+    async def run():
+        manager = FakeManager()
+        manager.active_connections['code'] = {FakeViewer()}
+        rate = controller(manager)
+        await rate.command_started('code')
+        assert manager.sent == [10]
+
+    asyncio.run(run())
+
+
+def test_video_agents_get_higher_rates():
+    async def run():
+        manager = FakeManager()
+        manager.agent_caps['code'] = {'video'}
+        manager.active_connections['code'] = {FakeViewer()}
+        rate = controller(manager)
+        await rate.tick()
+        assert manager.sent == [15]
+        await rate.command_started('code')
+        assert manager.sent == [15, 30]
+
+    asyncio.run(run())
+
+
+def test_backs_off_under_drops_and_recovers_one_step_at_a_time():
+    async def run():
+        manager = FakeManager()
+        viewer = FakeViewer()
+        manager.active_connections['code'] = {viewer}
+        rate = controller(manager, busy=True)
+        await rate.tick()
+        assert manager.sent == [10]
+
+        # Half of what the agent sends is dropped
+        for _ in range(4):
+            viewer.frames_sent += 20
+            viewer.frames_dropped += 20
+            await rate.tick()
+        session = rate.sessions['code']
+        assert session.fps < 10 and session.fps == session.ceiling == manager.sent[-1]
+
+        backed_off = session.fps
+        # Clean intervals bring the smoothed drop ratio back under DROP_LOW
+        while session.drop_ratio >= DROP_LOW:
+            viewer.frames_sent += 40
+            await rate.tick()
+        assert session.ceiling < session.max_fps
+        while session.ceiling < session.max_fps:
+            viewer.frames_sent += 40
+            ceiling = session.ceiling
+            await rate.tick()
+            assert session.ceiling == ceiling + 1
+        assert session.fps > backed_off
+
+    asyncio.run(run())
+
+
+def test_quiet_screen_backs_off_one_step():
+    async def run():
+        manager = FakeManager()
+        viewer = FakeViewer()
+        manager.active_connections['code'] = {viewer}
+        rate = controller(manager, busy=True)
+        await rate.tick()
+
+        # Static screen: one frame per interval reaches the viewer, while
+        # results pile up in its control queue
+        viewer.control_depth = 100
+        for _ in range(3):
+            viewer.frames_sent += 1
+            await rate.tick()
+        assert manager.sent == [10, 9, 8, 7]
+
+    asyncio.run(run())
+
+
+def test_distributed_session_without_local_viewers_is_left_alone():
+    async def run():
+        manager = FakeManager()
+        manager.router.distributed = True
+        rate = controller(manager)
+        await rate.tick()
+        assert manager.sent == []
+
+    asyncio.run(run())
@@ -0,0 +1,106 @@
+import asyncio
+import json
+import time
+
+import connections
+from heartbeat import Heartbeat
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data):
+        self.sent.append(data)
+
+    async def send_bytes(self, data):
+        self.sent.append(data)
+
+
+async def settle():
+    for _ in range(50):
+        await asyncio.sleep(0)
+
+
+async def connect(manager, heartbeat, role='web'):
+    """A connection plus a stand-in for its receive loop, tracked by the heartbeat"""
+    websocket = FakeWebSocket()
+    if role == 'agent':
+        channel = await manager.connect_agent('code', websocket)
+    else:
+        channel = await manager.connect_web('code', websocket)
+
+    async def receive_loop():
+        heartbeat.track(channel)
+        await asyncio.Event().wait()
+
+    reader = asyncio.create_task(receive_loop())
+    await settle()
+    return channel, websocket, reader
+
+
+def test_only_quiet_connections_are_pinged():
+    async def run():
+        manager = connections.ConnectionManager()
+        heartbeat = Heartbeat(manager, interval=20, timeout=60)
+        quiet, quiet_socket, _ = await connect(manager, heartbeat)
+        busy, busy_socket, _ = await connect(manager, heartbeat)
+        quiet.last_seen -= 30
+
+        await heartbeat.beat()
+        await settle()
+        assert [json.loads(m)['type'] for m in quiet_socket.sent] == ['ping']
+        assert busy_socket.sent == []
+
+    asyncio.run(run())
+
+
+def test_silent_connection_is_reaped_and_its_reader_cancelled():
+    async def run():
+        manager = connections.ConnectionManager()
+        heartbeat = Heartbeat(manager, interval=20, timeout=60)
+        channel, _, reader = await connect(manager, heartbeat)
+        channel.last_seen -= 61
+
+        await heartbeat.beat()
+        await settle()
+        assert channel.reaped and channel.closed
+        assert reader.cancelled()
+        assert manager.viewer_count('code') == 0
+        assert heartbeat.stats()['tracked'] == 0 and heartbeat.reaped == 1
+
+    asyncio.run(run())
+
+
+def test_replaced_agent_socket_is_reaped():
+    async def run():
+        manager = connections.ConnectionManager()
+        heartbeat = Heartbeat(manager, interval=20, timeout=60)
+        old, _, old_reader = await connect(manager, heartbeat, 'agent')
+        new, _, _ = await connect(manager, heartbeat, 'agent')
+        assert old.closed
+
+        await heartbeat.beat()
+        await settle()
+        assert old_reader.cancelled()
+        # Reaping the old socket leaves the reconnected agent in place
+        assert manager.agent_connections['code'] is new
+        assert heartbeat.live() == 1
+
+    asyncio.run(run())
+
+
+def test_pong_sets_round_trip_time():
+    async def run():
+        manager = connections.ConnectionManager()
+        heartbeat = Heartbeat(manager)
+        channel, _, _ = await connect(manager, heartbeat)
+        heartbeat.pong(channel, {'type': 'pong', 'ts': time.time() - 0.05})
+        assert 0.05 <= channel.rtt < 1
+        heartbeat.pong(channel, {'type': 'pong', 'ts': 'bogus'})
+        assert channel.rtt is not None
+
+    asyncio.run(run())
@@ -0,0 +1,89 @@
+import pytest
+
+from plan_decoder import MAX_WAIT, ActionStreamParser, PlanDecodeError, PlanTruncated, decode_plan
+
+
+def test_clean_plan_needs_no_repairs():
+    actions, repairs = decode_plan('[{"type": "open_url", "params": {"url": "https://example.com"}}]')
+    assert actions == [{"type": "open_url", "params": {"url": "https://example.com"}}]
+    assert repairs == []
+
+
+def test_fenced_plan_is_clean():
+    actions, repairs = decode_plan('```json\n[{"type": "scroll", "params": {"amount": 3}}]\n```')
+    assert actions == [{"type": "scroll", "params": {"amount": 3}}]
+    assert repairs == []
+
+
+def test_trailing_commas_and_prose_are_repaired():
+    reply = 'Sure, here is the plan:\n[{"type": "scroll", "params": {"amount": 3,},},]\nLet me know!'
+    actions, repairs = decode_plan(reply)
+    assert actions == [{"type": "scroll", "params": {"amount": 3}}]
+    assert 'prose stripped' in repairs and 'syntax repaired' in repairs
+
+
+def test_brackets_in_prose_are_skipped():
+    reply = 'Sure [here is the plan]: [{"type": "scroll", "params": {"amount": 3}}] (see {notes})'
+    actions, repairs = decode_plan(reply)
+    assert actions == [{"type": "scroll", "params": {"amount": 3}}]
+    assert 'prose stripped' in repairs
+
+
+def test_cut_off_plan_after_bracketed_prose_is_truncated():
+    reply = 'Plan [2 steps]: [{"type": "scroll", "params": {"amount": 3}}, {"type": "wa'
+    with pytest.raises(PlanTruncated) as info:
+        decode_plan(reply)
+    assert info.value.actions == [{"type": "scroll", "params": {"amount": 3}}]
+
+
+def test_wrapper_aliases_and_flat_params_are_repaired():
+    reply = '{"actions": [{"type": "click", "x": "10", "y": 20.0}, {"action": "navigate", "url": "example.com"}]}'
+    actions, repairs = decode_plan(reply)
+    assert actions == [
+        {"type": "mouse_click", "params": {"x": 10, "y": 20}},
+        {"type": "open_url", "params": {"url": "https://example.com"}},
+    ]
+    assert 'unwrapped "actions"' in repairs
+    assert 'click renamed' in repairs
+    assert 'open_url scheme added' in repairs
+
+
+def test_long_wait_is_clamped():
+    actions, repairs = decode_plan('[{"type": "wait", "params": {"seconds": 600}}]')
+    assert actions == [{"type": "wait", "params": {"seconds": MAX_WAIT}}]
+    assert 'wait clamped' in repairs
+
+
+def test_truncated_reply_keeps_the_complete_actions():
+    reply = ('[{"type": "open_app", "params": {"app": "notes"}}, '
+             '{"type": "wait", "params": {"seconds": 2}}, {"type": "keyboard_type", "params": {"te')
+    with pytest.raises(PlanTruncated) as info:
+        decode_plan(reply)
+    assert info.value.actions == [
+        {"type": "open_app", "params": {"app": "notes"}},
+        {"type": "wait", "params": {"seconds": 2}},
+    ]
+    assert isinstance(info.value, PlanDecodeError)
+
+
+@pytest.mark.parametrize('reply', [
+    'I cannot help with that.',
+    '[{"type": "keyboard_ty',
+    '[{"type": "teleport", "params": {}}]',
+    '[{"type": "open_url", "params": {"url": "not a url"}}]',
+    '[{"type": "mouse_click", "params": {"x": 5}}]',
+    '[]',
+])
+def test_unusable_replies_raise(reply):
+    with pytest.raises(PlanDecodeError) as info:
+        decode_plan(reply)
+    assert not isinstance(info.value, PlanTruncated)
+
+
+def test_stream_parser_yields_actions_as_they_close():
+    parser = ActionStreamParser()
+    assert parser.feed('```json\n[{"type": "scroll", "params": {"amount": 1}}, {"type": "wa') == [
+        {"type": "scroll", "params": {"amount": 1}}]
+    assert not parser.done
+    assert parser.feed('it", "params": {"seconds": 1}}]') == [{"type": "wait", "params": {"seconds": 1}}]
+    assert parser.done
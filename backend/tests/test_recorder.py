@@ -0,0 +1,94 @@
+import asyncio
+import json
+
+from recorder import INDEX_INTERVAL, SessionRecorder, encode_record, read_spans
+
+
+def write(recorder, times, code='code'):
+    recorder._write_batch([
+        (code, t, json.dumps({'type': 'action_result', 'step': i})) for i, t in enumerate(times)
+    ])
+
+
+def replay(recorder, start, end, code='code', skip=0, length=None):
+    spans = recorder.spans(code, start, end)
+    total = sum(stop - begin for _, begin, stop in spans)
+    data = b''.join(read_spans(spans, skip, total - skip if length is None else length))
+    return [json.loads(line) for line in data.splitlines()]
+
+
+def test_encode_record_embeds_text_and_base64s_binary():
+    assert encode_record(1.5, '{"type": "x"}') == b'{"t":1.500,"m":{"type": "x"}}\n'
+    assert json.loads(encode_record(2, b'\xc1\xc1')) == {'t': 2, 'b64': 'wcE='}
+
+
+def test_range_replay_returns_the_records_in_range(tmp_path):
+    recorder = SessionRecorder(tmp_path)
+    times = [100 + i * 0.1 for i in range(40)]
+    write(recorder, times)
+    recorder._close_all()
+
+    records = replay(recorder, 101, 102)
+    replayed = [record['t'] for record in records]
+    # Span edges fall on index entries, so up to INDEX_INTERVAL either side comes along
+    assert all(101 - INDEX_INTERVAL <= t <= 102 + INDEX_INTERVAL for t in replayed)
+    assert [t for t in replayed if 101 <= t <= 102] == [round(t, 3) for t in times if 101 <= t <= 102]
+    assert replayed == sorted(replayed)
+    assert replay(recorder, 200, 300) == []
+
+
+def test_replay_spans_segments_and_honours_skip_and_length(tmp_path):
+    recorder = SessionRecorder(tmp_path, segment_bytes=300)
+    times = [100 + i for i in range(20)]
+    write(recorder, times)
+    recorder._close_all()
+
+    segments = recorder.segments('code')
+    assert len(segments) > 1
+    assert [s['start'] for s in segments] == sorted(s['start'] for s in segments)
+    assert [record['t'] for record in replay(recorder, 0, 1000)] == times
+
+    spans = recorder.spans('code', 0, 1000)
+    whole = b''.join(read_spans(spans, 0, 10 ** 6))
+    assert b''.join(read_spans(spans, 150, 400)) == whole[150:550]
+
+
+def test_sessions_are_kept_apart(tmp_path):
+    recorder = SessionRecorder(tmp_path)
+    write(recorder, [100, 101], code='one')
+    write(recorder, [100.5], code='two')
+    recorder._close_all()
+    assert [record['t'] for record in replay(recorder, 0, 1000, code='one')] == [100, 101]
+    assert [record['t'] for record in replay(recorder, 0, 1000, code='two')] == [100.5]
+
+
+def test_record_keeps_results_when_frames_are_shed(tmp_path):
+    async def run():
+        recorder = SessionRecorder(tmp_path, max_pending_bytes=200, flush_interval=60)
+        recorder.start()
+        recorder.record('code', '{"type": "ping"}', 'ping')
+        recorder.record('code', '{"type": "screen_frame", "data": "%s"}' % ('A' * 80), 'screen_frame')
+        recorder.record('code', '{"type": "screen_frame", "data": "%s"}' % ('A' * 80), 'screen_frame')
+        recorder.record('code', '{"type": "action_result", "data": "%s"}' % ('B' * 80), 'action_result')
+        assert recorder.dropped == 1
+        await recorder.stop()
+        assert recorder.records == 2
+        assert recorder.stats()['open_segments'] == 0
+
+    asyncio.run(run())
+
+
+def test_stop_writes_everything_queued(tmp_path):
+    async def run():
+        recorder = SessionRecorder(tmp_path, flush_interval=0.01)
+        recorder.start()
+        for i in range(100):
+            recorder.record('code', '{"type": "action_result", "step": %d}' % i, 'action_result')
+            if i % 10 == 0:
+                await asyncio.sleep(0.005)
+        await recorder.stop()
+        recorder.record('code', '{"type": "action_result"}', 'action_result')
+        assert recorder.records == 100
+        assert [record['m']['step'] for record in replay(recorder, 0, 10 ** 10)] == list(range(100))
+
+    asyncio.run(run())
@@ -0,0 +1,171 @@
+"""Two ConnectionManagers sharing a LocalBroker, standing in for two workers on one Redis"""
+
+import asyncio
+import json
+
+import connections
+import routing
+from routing import LocalBroker, LocalSubscription, PubSubRouter
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data):
+        self.sent.append(data)
+
+    async def send_bytes(self, data):
+        self.sent.append(data)
+
+    def types(self):
+        return [json.loads(data)['type'] for data in self.sent if isinstance(data, str)]
+
+
+async def settle():
+    # Let the router's read loop and the channel writers run
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+class FlakySubscription(LocalSubscription):
+    """Raises exceptions put on its queue, like a dropped broker connection"""
+
+    async def get(self):
+        item = await self.queue.get()
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+
+class FlakyBroker(LocalBroker):
+    def subscription(self):
+        return FlakySubscription(self)
+
+
+async def workers(broker=None):
+    broker = broker or LocalBroker()
+    first = connections.ConnectionManager(PubSubRouter(broker))
+    second = connections.ConnectionManager(PubSubRouter(broker))
+    await first.start()
+    await second.start()
+    return first, second
+
+
+def frame_message() -> str:
+    return json.dumps({'type': 'screen_frame', 'width': 4, 'height': 2, 'data': 'AAAA'})
+
+
+def test_frame_reaches_viewer_on_other_worker():
+    async def run():
+        first, second = await workers()
+        viewer = FakeWebSocket()
+        await first.connect_agent('code', FakeWebSocket())
+        await second.connect_web('code', viewer)
+        await settle()
+
+        await first.relay_to_web('code', frame_message(), 'screen_frame')
+        await settle()
+        assert viewer.types() == ['screen_frame']
+        await first.stop()
+        await second.stop()
+
+    asyncio.run(run())
+
+
+def test_sequence_complete_is_delivered_and_seen_as_agent_event():
+    async def run():
+        first, second = await workers()
+        events = []
+        second.on_agent_event = lambda code, msg_type, *payload: events.append((code, msg_type))
+        viewer = FakeWebSocket()
+        await first.connect_agent('code', FakeWebSocket())
+        await second.connect_web('code', viewer)
+        await settle()
+
+        await first.relay_to_web('code', json.dumps({'type': 'sequence_complete', 'success': True}),
+                                 'sequence_complete')
+        await settle()
+        assert 'sequence_complete' in viewer.types()
+        # The scheduler on the viewer's worker learns the sequence finished
+        assert ('code', 'sequence_complete') in events
+        await first.stop()
+        await second.stop()
+
+    asyncio.run(run())
+
+
+def test_keyframe_request_reaches_agent_on_other_worker():
+    async def run():
+        first, second = await workers()
+        agent = FakeWebSocket()
+        await first.connect_agent('code', agent)
+        await settle()
+
+        # Joining asks the agent for a keyframe, wherever it is held
+        await second.connect_web('code', FakeWebSocket())
+        await settle()
+        assert agent.types() == ['request_keyframe']
+        await first.stop()
+        await second.stop()
+
+    asyncio.run(run())
+
+
+def test_message_reaches_agent_on_other_worker():
+    async def run():
+        first, second = await workers()
+        agent = FakeWebSocket()
+        await first.connect_agent('code', agent)
+        await settle()
+
+        await second.send_to_agent('code', {'type': 'execute_action', 'step': 1})
+        await settle()
+        assert agent.types() == ['execute_action']
+        await first.stop()
+        await second.stop()
+
+    asyncio.run(run())
+
+
+def test_frames_are_not_published_to_a_code_without_remote_viewers():
+    async def run():
+        first, second = await workers()
+        await first.connect_agent('code', FakeWebSocket())
+        await settle()
+
+        await first.relay_to_web('code', frame_message(), 'screen_frame')
+        await first.relay_to_web('code', frame_message(), 'screen_frame')
+        assert first.router.skipped == 1
+        await first.stop()
+        await second.stop()
+
+    asyncio.run(run())
+
+
+def test_delivery_resumes_after_a_broker_read_error(monkeypatch):
+    monkeypatch.setattr(routing, 'RESUBSCRIBE_DELAY', 0)
+
+    async def run():
+        first, second = await workers(FlakyBroker())
+        viewer = FakeWebSocket()
+        await first.connect_agent('code', FakeWebSocket())
+        await second.connect_web('code', viewer)
+        await settle()
+
+        failed = second.router.subscription
+        failed.queue.put_nowait(ConnectionError('connection lost'))
+        await settle()
+        assert second.router.read_errors == 1
+        assert second.router.subscription is not failed
+
+        await first.relay_to_web('code', frame_message(), 'screen_frame')
+        await settle()
+        assert viewer.types() == ['screen_frame']
+        await first.stop()
+        await second.stop()
+
+    asyncio.run(run())
@@ -0,0 +1,75 @@
+import json
+
+from session_memory import SessionMemory, estimate_tokens
+
+
+def open_url(url):
+    return [{"type": "open_url", "params": {"url": url}}]
+
+
+def cost(history):
+    return sum(estimate_tokens(message['content']) for message in history)
+
+
+def test_no_history_without_turns():
+    memory = SessionMemory()
+    assert memory.context('code') == []
+    assert not memory.has_history('code')
+
+
+def test_latest_turn_is_replayed_in_full_with_its_outcome():
+    memory = SessionMemory()
+    memory.add_turn('code', 'open youtube', open_url('https://www.youtube.com'))
+    memory.record_result('code', {'type': 'action_result', 'step': 1,
+                                  'result': {'status': 'error', 'message': 'browser not found'}})
+    memory.record_result('code', {'type': 'sequence_complete'})
+
+    user, assistant, result = memory.context('code')
+    assert user == {"role": "user", "content": "open youtube"}
+    assert json.loads(assistant['content']) == open_url('https://www.youtube.com')
+    assert result['content'] == 'Result of that plan: failed: step 1: browser not found'
+
+
+def test_older_turns_are_summarised_within_the_budget():
+    memory = SessionMemory(budget_tokens=200, full_turns=2)
+    for i in range(10):
+        memory.add_turn('code', f'open site number {i}', open_url(f'https://site{i}.example.com/page'))
+
+    history = memory.context('code')
+    assert cost(history) <= 200
+    summary = history[0]['content']
+    assert history[0]['role'] == 'system' and summary.startswith('Earlier in this session')
+    # The two newest turns in full, after the summary
+    assert [m['content'] for m in history if m['role'] == 'user'] == ['open site number 8', 'open site number 9']
+    assert 'site7.example.com' in summary and 'site9' not in summary
+    # The oldest turns don't fit
+    assert 'site0.example.com' not in summary
+    assert memory.compacted == 1
+
+
+def test_turn_too_big_for_the_budget_is_left_out():
+    memory = SessionMemory(budget_tokens=30)
+    memory.add_turn('code', 'type this', [{"type": "keyboard_type", "params": {"text": 'x' * 500}}])
+    assert cost(memory.context('code')) <= 30
+
+
+def test_zero_budget_disables_memory():
+    memory = SessionMemory(budget_tokens=0)
+    memory.add_turn('code', 'open youtube', open_url('https://www.youtube.com'))
+    assert memory.context('code') == [] and not memory.has_history('code')
+
+
+def test_idle_sessions_expire_and_old_sessions_are_evicted():
+    memory = SessionMemory(max_sessions=2, ttl=-1)
+    memory.add_turn('code', 'open youtube', open_url('https://www.youtube.com'))
+    assert not memory.has_history('code')
+
+    memory = SessionMemory(max_sessions=2)
+    for code in ('a', 'b', 'c'):
+        memory.add_turn(code, 'scroll down', [{"type": "scroll", "params": {"amount": 3}}])
+    assert not memory.has_history('a') and memory.has_history('c')
+    assert memory.evicted == 1
+
+    memory.forget('c')
+    assert not memory.has_history('c')
+    assert memory.stats()['sessions'] == 1
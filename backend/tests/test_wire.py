@@ -0,0 +1,112 @@
+import base64
+import json
+from pathlib import Path
+
+import pytest
+
+import connections
+import wire
+
+
+def test_negotiate_takes_the_first_supported_codec():
+    assert wire.negotiate('brotli, json') is wire.JSON
+    assert wire.negotiate(None) is wire.JSON
+    assert wire.negotiate('nope') is wire.JSON
+    assert wire.negotiate(wire.preferred()).name == wire.preferred().split(',')[0]
+
+
+def test_json_codec_sends_bytes_as_base64():
+    message = wire.JSON.loads(wire.JSON.dumps({'type': 'screen_frame', 'data': b'\x00\xff'}))
+    assert base64.b64decode(message['data']) == b'\x00\xff'
+
+
+def test_text_passes_through_to_text_receivers():
+    raw = json.dumps({'type': 'action_result', 'step': 1})
+    cache = {}
+    assert connections.transcode(raw, wire.JSON, cache) is raw
+    assert connections.transcode(raw, wire.TEXT, cache) is raw
+    assert cache == {}
+
+
+@pytest.mark.skipif(wire.BINARY is None, reason='msgpack is not installed')
+def test_text_is_reencoded_once_for_msgpack_receivers():
+    raw = json.dumps({'type': 'action_result', 'step': 1})
+    cache = {}
+    first = connections.transcode(raw, wire.BINARY, cache)
+    assert connections.transcode(raw, wire.BINARY, cache) is first
+    assert wire.loads(first) == {'type': 'action_result', 'step': 1}
+    assert wire.peek_msgpack_type(first) == 'action_result'
+
+
+@pytest.mark.skipif(wire.BINARY is not None, reason='msgpack is installed')
+def test_binary_message_without_msgpack_is_rejected():
+    with pytest.raises(ValueError):
+        wire.loads(b'\x81\xa4type\xa4pong')
+
+
+def test_header_layout():
+    assert wire.FRAME_HEADER.format == '<2sBBIdHHBHHH'
+    assert wire.FRAME_HEADER.size == 27
+
+
+@pytest.mark.parametrize('fmt', ['jpeg', 'h264', 'vp8'])
+def test_keyframe_round_trip(fmt):
+    message = {'type': 'screen_frame', 'seq': 7, 'timestamp': 1234.5, 'format': fmt, 'key': True,
+               'width': 1280, 'height': 720, 'data': b'\xff\xd8 image \xff\xd9'}
+    packed = wire.pack_frame(message)
+    assert wire.is_frame(packed)
+    assert wire.peek_msgpack_type(packed) == 'screen_frame'
+    assert wire.unpack_frame(packed) == message
+
+
+def test_tile_delta_round_trip():
+    message = {'type': 'screen_delta', 'seq': 2 ** 32 - 1, 'timestamp': 0.25, 'format': 'jpeg',
+               'tiles': [[0, 0, 64, 64], [64, 128, 64, 32]], 'tile': 64, 'cols': 2, 'data': b'tile strip'}
+    packed = wire.pack_frame(message)
+    assert len(packed) == wire.FRAME_HEADER.size + 2 * 8 + len(b'tile strip')
+    assert wire.peek_msgpack_type(packed) == 'screen_delta'
+    assert wire.unpack_frame(packed) == message
+
+
+@pytest.mark.parametrize('fmt', ['h264', 'vp8'])
+def test_video_delta_round_trip(fmt):
+    message = {'type': 'screen_delta', 'seq': 3, 'timestamp': 9.0, 'format': fmt, 'tiles': [], 'data': b'\x00\x01'}
+    assert wire.unpack_frame(wire.pack_frame(message)) == message
+
+
+def test_empty_delta_has_no_data():
+    message = {'type': 'screen_delta', 'seq': 1, 'timestamp': 1.0, 'format': 'jpeg', 'tiles': []}
+    assert wire.unpack_frame(wire.pack_frame(message)) == message
+
+
+@pytest.mark.parametrize('payload', [
+    b'SF\x01',
+    wire.FRAME_HEADER.pack(b'SF', 2, 1, 0, 0.0, 0, 0, 1, 0, 0, 0),
+    wire.FRAME_HEADER.pack(b'SF', 1, 1, 0, 0.0, 0, 0, 9, 0, 0, 0),
+    wire.FRAME_HEADER.pack(b'SF', 1, 2, 0, 0.0, 0, 0, 1, 0, 0, 3),
+])
+def test_malformed_frames_raise(payload):
+    with pytest.raises(ValueError):
+        wire.unpack_frame(payload)
+
+
+def test_frames_are_transcoded_for_json_viewers():
+    message = {'type': 'screen_frame', 'seq': 1, 'timestamp': 2.0, 'format': 'jpeg', 'key': True,
+               'width': 2, 'height': 2, 'data': b'jpeg bytes'}
+    packed = wire.pack_frame(message)
+    assert connections.transcode(packed, wire.JSON, {}, binary_frames=True) is packed
+    decoded = json.loads(connections.transcode(packed, wire.JSON, {}))
+    assert base64.b64decode(decoded.pop('data')) == b'jpeg bytes'
+    assert decoded == {k: v for k, v in message.items() if k != 'data'}
+
+
+def test_peek_msgpack_type():
+    # {"type": "pong", "t": 1} as msgpack, written out by hand
+    assert wire.peek_msgpack_type(b'\x82\xa4type\xa4pong\xa1t\x01') == 'pong'
+    assert wire.peek_msgpack_type(b'\x81\xa2id\x01') == ''
+    assert wire.peek_msgpack_type(b'') == ''
+
+
+def test_agent_and_backend_copies_match():
+    agent_copy = Path(__file__).resolve().parents[2] / 'desktop-agent' / 'wire.py'
+    assert agent_copy.read_text() == Path(wire.__file__).read_text()
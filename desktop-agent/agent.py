@@ -11,22 +11,70 @@ import asyncio
 import json
 import pyautogui
 import websockets
-import mss
 import base64
-import io
-from PIL import Image
 import subprocess
 import platform
 from pathlib import Path
 import time
 
+import wire
+from capture import CaptureWorker, LatestFrame, capture_sources, snapshot
+from delta import DeltaEncoder
+from quality import QualityController
+from region import CaptureRegion
+from resize import DEFAULT_MODE, RESIZE_MODES
+from video import VideoEncoder, available as video_available
+
+# Seconds between agent_stats messages
+STATS_INTERVAL = 5
+
+# Highest set_fps honoured once streaming JPEG after a video fallback
+JPEG_MAX_FPS = 10
+
+# open_app names, lower-cased -> what each OS launches; anything else is
+# passed through as given. The fast planner sends macOS application names
+# ("Visual Studio Code"), which macOS launches as is; the LLM may also send
+# short names ("vscode")
+APP_NAMES = {
+    'Darwin': {
+        'safari': 'Safari', 'chrome': 'Google Chrome', 'firefox': 'Firefox', 'edge': 'Microsoft Edge',
+        'terminal': 'Terminal', 'vscode': 'Visual Studio Code', 'finder': 'Finder', 'notes': 'Notes',
+        'calculator': 'Calculator', 'calendar': 'Calendar', 'mail': 'Mail', 'messages': 'Messages',
+        'music': 'Music', 'spotify': 'Spotify', 'slack': 'Slack', 'zoom': 'zoom.us', 'textedit': 'TextEdit',
+        'settings': 'System Settings',
+    },
+    'Windows': {
+        'chrome': 'chrome', 'google chrome': 'chrome', 'firefox': 'firefox', 'edge': 'msedge',
+        'microsoft edge': 'msedge', 'terminal': 'cmd', 'vscode': 'code', 'visual studio code': 'code',
+        'finder': 'explorer', 'notes': 'notepad', 'calculator': 'calc',
+        'spotify': 'spotify:', 'slack': 'slack:', 'zoom': 'zoommtg:', 'textedit': 'notepad',
+        'zoom.us': 'zoommtg:', 'settings': 'ms-settings:', 'system settings': 'ms-settings:',
+        'system preferences': 'ms-settings:',
+    },
+    'Linux': {
+        'chrome': 'google-chrome', 'google chrome': 'google-chrome', 'edge': 'microsoft-edge',
+        'microsoft edge': 'microsoft-edge', 'terminal': 'x-terminal-emulator', 'vscode': 'code',
+        'visual studio code': 'code', 'finder': 'xdg-open ~', 'calculator': 'gnome-calculator',
+        'zoom.us': 'zoom', 'textedit': 'gedit', 'notepad': 'gedit', 'settings': 'gnome-control-center',
+        'system settings': 'gnome-control-center', 'system preferences': 'gnome-control-center',
+    },
+}
+
 class AIControlAgent:
     def __init__(self):
         self.config = self.load_config()
         self.websocket = None
         self.running = False
         self.fps = 5  # Frames per second for screen capture
+        self.fps_max = 30  # Upper bound on what the backend may ask for
+        self.codec = wire.JSON  # Until the backend confirms a faster one
+        self.binary_frames = False  # Screen frames as wire.pack_frame, once the backend confirms
+        self.capture = None  # CaptureWorker while connected
+        self.quality = None  # QualityController steering it, unless disabled
+        self.region = CaptureRegion(cursor=pyautogui.position)  # what is captured, set by viewers
         self.system = platform.system()
+        self.streamed_sequences = {}  # sequence_id -> queue of actions still arriving
+        self.sequence_tasks = set()
         
     def load_config(self):
         """Load agent configuration with default fallback"""
@@ -58,25 +106,6 @@ class AIControlAgent:
             print(f"📦 Using default Railway configuration: {default_config}")
             return default_config
     
-    async def capture_screen(self):
-        """Capture screen and return as base64 encoded image"""
-        with mss.mss() as sct:
-            monitor = sct.monitors[1]  # Primary monitor
-            screenshot = sct.grab(monitor)
-            
-            # Convert to PIL Image
-            img = Image.frombytes('RGB', screenshot.size, screenshot.rgb)
-            
-            # Resize for bandwidth optimization
-            img.thumbnail((1280, 720), Image.Resampling.LANCZOS)
-            
-            # Convert to base64
-            buffer = io.BytesIO()
-            img.save(buffer, format='JPEG', quality=85)
-            img_str = base64.b64encode(buffer.getvalue()).decode()
-            
-            return img_str
-    
     async def execute_action(self, action):
         """Execute a single action"""
         action_type = action.get('type')
@@ -122,8 +151,10 @@ class AIControlAgent:
             
             elif action_type == 'open_app':
                 app_name = params.get('app')
+                app_name = APP_NAMES.get(self.system, {}).get(str(app_name).lower(), app_name)
                 if self.system == 'Windows':
-                    subprocess.Popen(app_name, shell=True)
+                    # start finds apps through App Paths and URI schemes, not just PATH
+                    subprocess.Popen(['start', '', app_name], shell=True)
                 elif self.system == 'Darwin':
                     subprocess.Popen(['open', '-a', app_name])
                 else:
@@ -146,49 +177,182 @@ class AIControlAgent:
         except Exception as e:
             return {'status': 'error', 'message': str(e)}
     
+    async def send(self, message):
+        """Send a message encoded with the negotiated codec"""
+        await self.websocket.send(self.codec.dumps(message))
+    
+    async def run_step(self, step, total, action):
+        """Execute one step of a sequence and report the result"""
+        print(f"\n📋 Step {step}/{total or '?'}: {action.get('type')}")
+        self.region.command_activity()
+        result = await self.execute_action(action)
+        
+        # Send progress update
+        await self.send({
+            'type': 'action_result',
+            'step': step,
+            'total': total,
+            'action': action,
+            'result': result
+        })
+        
+        # Small delay between actions for stability
+        await asyncio.sleep(0.3)
+        return result
+    
     async def execute_sequence(self, actions):
         """Execute a sequence of actions"""
         results = []
         
         for i, action in enumerate(actions):
-            print(f"\n📋 Step {i+1}/{len(actions)}: {action.get('type')}")
-            result = await self.execute_action(action)
-            results.append(result)
-            
-            # Send progress update
-            await self.websocket.send(json.dumps({
-                'type': 'action_result',
-                'step': i + 1,
-                'total': len(actions),
-                'action': action,
-                'result': result
-            }))
-            
-            # Small delay between actions for stability
-            await asyncio.sleep(0.3)
+            results.append(await self.run_step(i + 1, len(actions), action))
+        
+        # Send completion
+        await self.send({
+            'type': 'sequence_complete',
+            'results': results
+        })
+        
+        return results
+    
+    async def execute_streamed_sequence(self, sequence_id, queue):
+        """Execute actions as the backend streams them, starting before the plan is complete"""
+        results = []
+        
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                step, action = item
+                # The total is unknown until the backend finishes planning
+                results.append(await self.run_step(step, None, action))
+        finally:
+            self.streamed_sequences.pop(sequence_id, None)
         
         # Send completion
-        await self.websocket.send(json.dumps({
+        await self.send({
             'type': 'sequence_complete',
+            'sequence_id': sequence_id,
             'results': results
-        }))
+        })
         
         return results
     
-    async def screen_stream_loop(self):
-        """Continuously capture and send screen frames"""
+    def handle_sequence_message(self, data):
+        """Route sequence_start / sequence_action / sequence_end messages"""
+        sequence_id = data.get('sequence_id')
+        
+        if data['type'] == 'sequence_start':
+            queue = asyncio.Queue()
+            self.streamed_sequences[sequence_id] = queue
+            print(f"\n🚀 Receiving streamed sequence {sequence_id}")
+            task = asyncio.create_task(self.execute_streamed_sequence(sequence_id, queue))
+            self.sequence_tasks.add(task)
+            task.add_done_callback(self.sequence_tasks.discard)
+            return
+        
+        queue = self.streamed_sequences.get(sequence_id)
+        if queue is None:
+            return
+        
+        if data['type'] == 'sequence_action':
+            queue.put_nowait((data.get('step'), data.get('action', {})))
+        else:
+            print(f"📦 Sequence {sequence_id} planned: {data.get('total')} actions")
+            queue.put_nowait(None)
+    
+    async def send_frame(self, frame):
+        message = frame.message()
+        # Frames captured before the hello still carry base64 and go through the codec
+        if self.binary_frames and not isinstance(message.get('data'), str):
+            payload = wire.pack_frame(message)
+        else:
+            payload = self.codec.dumps(message)
+        await self.websocket.send(payload)
+        if self.quality is not None:
+            transport = getattr(self.websocket, 'transport', None)
+            buffered = transport.get_write_buffer_size() if transport is not None else 0
+            self.quality.frame_sent(frame.timestamp, len(payload), buffered)
+    
+    def create_video_encoder(self):
+        """H.264/VP8 encoder if "video" names a codec PyAV can encode, else None for JPEG"""
+        codec = self.config.get('video')
+        if not codec:
+            return None
+        if not video_available(codec):
+            print(f"⚠️ No {codec} encoder (is PyAV installed? pip install av), streaming JPEG")
+            return None
+        return VideoEncoder(codec, bitrate=int(self.config.get('video_bitrate', 1500)),
+                            keyframe_interval=float(self.config.get('keyframe_interval', 10)))
+    
+    def apply_fps(self):
+        if self.quality is not None:
+            self.quality.set_fps_ceiling(self.fps)
+        else:
+            self.capture.set_fps(self.fps)
+    
+    async def stats_loop(self):
+        """Run the quality controller and report capture settings to viewers"""
+        interval = self.quality.interval if self.quality is not None else STATS_INTERVAL
+        last_report = time.monotonic()
         while self.running:
+            await asyncio.sleep(interval)
+            if self.quality is not None:
+                self.quality.tick()
+            if time.monotonic() - last_report >= STATS_INTERVAL:
+                last_report = time.monotonic()
+                stats = self.quality.stats() if self.quality is not None else {}
+                try:
+                    await self.send({'type': 'agent_stats', **stats, 'capture': self.capture.stats()})
+                except websockets.exceptions.ConnectionClosed:
+                    return
+    
+    async def screen_stream_loop(self, slot):
+        """Send each frame the capture thread finishes; only the newest is kept while a send is in flight"""
+        while self.running:
+            frame = await slot.get()
             try:
-                screen_data = await self.capture_screen()
-                await self.websocket.send(json.dumps({
-                    'type': 'screen_frame',
-                    'data': screen_data,
-                    'timestamp': asyncio.get_event_loop().time()
-                }))
-                await asyncio.sleep(1 / self.fps)
+                # Video chunks the capture thread chained while a send was in flight go out in order
+                for part in frame.chain():
+                    await self.send_frame(part)
+            except websockets.exceptions.ConnectionClosed:
+                return
             except Exception as e:
-                print(f"Screen capture error: {e}")
-                await asyncio.sleep(1)
+                print(f"Screen send error: {e}")
+    
+    async def send_snapshot(self):
+        """Full-quality still for the viewer's Screenshot button, captured off the event loop"""
+        try:
+            # Same region as the live view, at full resolution
+            jpeg, (width, height) = await asyncio.to_thread(snapshot, box=self.region.box)
+            await self.send({
+                'type': 'snapshot',
+                'data': jpeg if self.codec.binary else base64.b64encode(jpeg).decode(),
+                'width': width,
+                'height': height,
+            })
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        except Exception as e:
+            print(f"Snapshot failed: {e}")
+    
+    async def send_capture_sources(self):
+        """Monitors and windows for the viewer's source picker, listed off the event loop"""
+        try:
+            sources = await asyncio.to_thread(capture_sources)
+            await self.send({'type': 'capture_sources', **sources, 'region': self.region.describe()})
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        except Exception as e:
+            print(f"Listing capture sources failed: {e}")
+    
+    async def stop_capture(self):
+        if self.capture is not None:
+            self.capture.stop()
+            await asyncio.to_thread(self.capture.join, 2)
+            self.capture = None
+            self.quality = None
     
     async def connect(self, access_code):
         """Connect to the web interface via WebSocket"""
@@ -201,7 +365,11 @@ class AIControlAgent:
             print(f"⚠️ WebSocket URL was invalid, using Railway default: {base_ws_url}")
         
         # Build complete WebSocket URL with query parameters
-        ws_url = f"{base_ws_url}?code={access_code}&client_type=agent"
+        codec = self.config.get('codec') or wire.preferred()
+        # Advertising video lets the backend raise the frame rate towards 30 fps
+        video = self.create_video_encoder()
+        caps = 'stream_actions,video' if video is not None else 'stream_actions'
+        ws_url = f"{base_ws_url}?code={access_code}&client_type=agent&caps={caps}&codec={codec}&frames=binary"
         
         print(f"🔌 Connecting to Railway backend: {ws_url}")
         
@@ -212,34 +380,107 @@ class AIControlAgent:
                 
                 print(f"✅ Connected successfully to Railway cloud!")
                 print(f"💻 System: {self.system}")
-                print(f"📹 Screen capture: {self.fps} FPS")
+                print(f"📹 Screen capture: {self.fps} FPS{f', {video.codec} video' if video is not None else ''}")
                 print(f"🤖 AI-powered command execution enabled")
                 print(f"☁️ Backend: Railway (24/7 uptime)")
                 print(f"⏳ Waiting for commands...")
                 
-                # Start screen streaming in background
-                stream_task = asyncio.create_task(self.screen_stream_loop())
+                # Capture on its own thread; frames reach the socket through a one-slot buffer
+                slot = LatestFrame(asyncio.get_running_loop())
+                # Only changed tiles are sent between keyframes unless "delta_frames" is off
+                delta = None
+                if self.config.get('delta_frames', True):
+                    delta = DeltaEncoder(keyframe_interval=float(self.config.get('keyframe_interval', 10)))
+                resize_mode = self.config.get('resize', DEFAULT_MODE)
+                if resize_mode not in RESIZE_MODES:
+                    print(f"⚠️ Unknown resize mode {resize_mode!r}, using {DEFAULT_MODE}")
+                    resize_mode = DEFAULT_MODE
+                self.capture = CaptureWorker(slot, self.fps, binary=self.codec.binary, delta=delta,
+                                             resize_mode=resize_mode, video=video, region=self.region)
+                # Quality, resolution and fps follow the uplink unless "adaptive_quality" is off
+                if self.config.get('adaptive_quality', True):
+                    self.quality = QualityController.from_config(self.capture, self.config)
+                self.capture.start()
+                stream_task = asyncio.create_task(self.screen_stream_loop(slot))
+                stats_task = asyncio.create_task(self.stats_loop())
                 
                 try:
                     # Listen for commands
                     async for message in websocket:
-                        data = json.loads(message)
+                        data = wire.loads(message)
+                        
+                        if data.get('type') == 'hello':
+                            # Backend confirmed a codec; use it from now on
+                            self.codec = wire.get(data.get('codec'))
+                            self.binary_frames = data.get('frames') == 'binary'
+                            # Binary frames and codecs carry the JPEG as-is; JSON needs base64
+                            self.capture.binary = self.codec.binary or self.binary_frames
+                            print(f"🔧 Wire codec: {self.codec.name}, frames: {data.get('frames', 'json')}")
                         
-                        if data.get('type') == 'execute_sequence':
+                        elif data.get('type') == 'execute_sequence':
                             actions = data.get('actions', [])
                             print(f"\n🚀 Received sequence with {len(actions)} actions")
                             await self.execute_sequence(actions)
                         
+                        elif data.get('type') in ('sequence_start', 'sequence_action', 'sequence_end'):
+                            self.handle_sequence_message(data)
+                        
                         elif data.get('type') == 'command':
                             # Legacy single command support
                             result = await self.execute_action(data.get('command'))
-                            await websocket.send(json.dumps({
+                            await self.send({
                                 'type': 'command_result',
                                 'result': result
-                            }))
+                            })
+                        
+                        elif data.get('type') == 'ping':
+                            # Backend heartbeat; echo the timestamp for RTT
+                            await self.send({
+                                'type': 'pong',
+                                'ts': data.get('ts')
+                            })
+                        
+                        elif data.get('type') == 'request_snapshot':
+                            task = asyncio.create_task(self.send_snapshot())
+                            self.sequence_tasks.add(task)
+                            task.add_done_callback(self.sequence_tasks.discard)
+                        
+                        elif data.get('type') == 'request_keyframe':
+                            # A viewer joined or missed a delta and needs the whole screen
+                            self.capture.request_keyframe()
+                        
+                        elif data.get('type') == 'list_capture_sources':
+                            task = asyncio.create_task(self.send_capture_sources())
+                            self.sequence_tasks.add(task)
+                            task.add_done_callback(self.sequence_tasks.discard)
+                        
+                        elif data.get('type') == 'set_capture_region':
+                            # Monitor, window, rectangle or follow mode; see region.py
+                            try:
+                                self.region.set(data)
+                            except ValueError as e:
+                                await self.send({'type': 'capture_region', 'error': str(e), **self.region.describe()})
+                                continue
+                            self.capture.request_keyframe()
+                            print(f"Capture region: {self.region.mode}")
+                            await self.send({'type': 'capture_region', **self.region.describe()})
+                        
+                        elif data.get('type') == 'video_unsupported':
+                            # A viewer has no decoder for the codec; everyone gets JPEG from now on
+                            if self.capture.video is not None:
+                                print(f"⚠️ A viewer can't decode {self.capture.video.codec}, streaming JPEG")
+                                self.capture.disable_video()
+                                self.fps_max = JPEG_MAX_FPS
+                                self.fps = min(self.fps, self.fps_max)
+                                self.apply_fps()
                         
                         elif data.get('type') == 'set_fps':
-                            self.fps = data.get('fps', 5)
+                            # Sent by the backend as viewing conditions change
+                            try:
+                                self.fps = min(self.fps_max, max(0.5, float(data.get('fps', 5))))
+                            except (TypeError, ValueError):
+                                continue
+                            self.apply_fps()
                             print(f"FPS updated to: {self.fps}")
                             
                 except websockets.exceptions.ConnectionClosed:
@@ -247,6 +488,8 @@ class AIControlAgent:
                 finally:
                     self.running = False
                     stream_task.cancel()
+                    stats_task.cancel()
+                    await self.stop_capture()
                     
         except Exception as e:
             print(f"❌ Connection failed: {e}")
@@ -0,0 +1,61 @@
+"""
+Microbenchmark for the agent's downscale modes
+Milliseconds per frame for each resize mode (resize.py), from a raw BGRA
+capture at common desktop resolutions down to the live-view size. Uses
+synthetic captures, so no display or mss is needed.
+
+    cd desktop-agent
+    python bench/resize_bench.py --target 1280x720 --number 10
+"""
+
+import argparse
+import os
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+import resize  # noqa: E402
+
+RESOLUTIONS = {
+    "1080p": (1920, 1080),
+    "1440p": (2560, 1440),
+    "4K": (3840, 2160),
+    "5K Retina": (5120, 2880),
+}
+
+
+class Shot:
+    """Stands in for an mss ScreenShot"""
+
+    def __init__(self, size):
+        self.size = size
+        self.bgra = os.urandom(size[0] * size[1] * 4)
+
+
+def parse_size(value: str):
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time each resize mode at common desktop resolutions")
+    parser.add_argument("--target", type=parse_size, default=(1280, 720), help="live-view size, WxH")
+    parser.add_argument("--number", type=int, default=10, help="frames per measurement")
+    args = parser.parse_args()
+
+    if resize.np is None:
+        print("NumPy not installed: 'box' falls back to 'reduce'\n")
+    print(f"{'desktop':<12}{'mode':<10}{'ms/frame':>10}{'output':>12}")
+    for name, size in RESOLUTIONS.items():
+        shot = Shot(size)
+        for mode in resize.RESIZE_MODES:
+            output = resize.downscale(shot, args.target, mode).size
+            seconds = min(timeit.repeat(lambda: resize.downscale(shot, args.target, mode),
+                                        number=args.number, repeat=3)) / args.number
+            print(f"{name:<12}{mode:<10}{seconds * 1000:>10.1f}{'%dx%d' % output:>12}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+"""
+Screen capture pipeline for the desktop agent
+Grabbing, resizing and JPEG encoding run on a dedicated thread with one
+long-lived mss grabber, paced by a deadline clock so the frame rate holds
+however long each frame takes to produce. Finished frames go into a
+one-slot buffer that the websocket task reads; a frame nobody picked up
+in time is taken back and its content folded into the next one.
+
+With delta encoding on (see delta.py) unchanged screens cost a keepalive
+a second instead of a full JPEG per frame. With a video encoder (see
+video.py) frames are H.264 or VP8 chunks instead; those depend on every
+chunk before them, so unsent ones are chained to the next rather than
+replaced.
+
+What is grabbed, the primary monitor by default, comes from a
+CaptureRegion (see region.py).
+
+mss, Pillow's resize and its JPEG encoder all release the GIL while they
+work, so the event loop keeps receiving commands during a capture.
+"""
+
+import asyncio
+import base64
+import io
+import threading
+import time
+from typing import List, Optional, Union
+
+import mss
+from PIL import Image
+
+from delta import Box, DeltaEncoder, atlas_columns
+from region import CaptureRegion, list_windows
+from resize import DEFAULT_MODE, downscale
+from video import VideoEncoder
+
+# Longest sleep after a failed grab before trying again
+ERROR_BACKOFF = 1.0
+
+# Unsent video chunks kept before giving up on them and starting over from a keyframe
+MAX_VIDEO_BACKLOG = 30
+
+
+class Frame:
+    """An encoded keyframe or delta, ready to be put in a message"""
+
+    __slots__ = ('kind', 'data', 'tiles', 'size', 'tile', 'timestamp', 'seq', 'format', 'previous')
+
+    def __init__(self, kind: str, data: Optional[Union[bytes, str]], tiles: List[Box], size, tile: int,
+                 timestamp: float, seq: int, format: str = 'jpeg', previous: Optional['Frame'] = None):
+        self.kind = kind  # 'key' or 'delta'
+        self.data = data
+        self.tiles = tiles
+        self.size = size
+        self.tile = tile
+        self.timestamp = timestamp  # time.monotonic() when grabbed
+        self.seq = seq
+        self.format = format  # 'jpeg', or the video codec
+        self.previous = previous  # unsent video chunk this one depends on
+
+    def chain(self) -> List['Frame']:
+        """This frame and the unsent ones before it, oldest first"""
+        frames = []
+        frame = self
+        while frame is not None:
+            frames.append(frame)
+            frame = frame.previous
+        frames.reverse()
+        return frames
+
+    def message(self) -> dict:
+        if self.kind == 'key':
+            message = {
+                'type': 'screen_frame',
+                'data': self.data,
+                'key': True,
+                'width': self.size[0],
+                'height': self.size[1],
+                'seq': self.seq,
+                'timestamp': self.timestamp,
+            }
+        elif self.format != 'jpeg':
+            message = {'type': 'screen_delta', 'data': self.data, 'seq': self.seq, 'timestamp': self.timestamp}
+        else:
+            message = {'type': 'screen_delta', 'tiles': self.tiles, 'seq': self.seq, 'timestamp': self.timestamp}
+            if self.data is not None:
+                message.update(data=self.data, tile=self.tile, cols=atlas_columns(len(self.tiles)))
+        if self.format != 'jpeg':
+            message['format'] = self.format
+        return message
+
+
+class LatestFrame:
+    """One-slot handoff from the capture thread to the event loop"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self._lock = threading.Lock()
+        self._frame: Optional[Frame] = None
+        self._ready = asyncio.Event()
+        self.replaced = 0
+
+    def put(self, frame: Frame):
+        """Called from the capture thread; never blocks on the consumer"""
+        with self._lock:
+            if self._frame is not None:
+                self.replaced += 1
+            self._frame = frame
+        self.loop.call_soon_threadsafe(self._ready.set)
+
+    def reclaim(self) -> Optional[Frame]:
+        """Take back a frame the consumer hasn't picked up, so the next one can cover it"""
+        with self._lock:
+            frame, self._frame = self._frame, None
+        if frame is not None:
+            self.replaced += 1
+        return frame
+
+    async def get(self) -> Frame:
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            with self._lock:
+                frame, self._frame = self._frame, None
+            if frame is not None:
+                return frame
+
+
+def encode_jpeg(img: Image.Image, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def snapshot(max_size=(3840, 2160), quality: int = 92, box: Optional[dict] = None):
+    """High-quality still of ``box`` (default the primary monitor) as (JPEG bytes, size)
+
+    Blocking and much slower than a live frame (LANCZOS, high quality); run
+    it in a worker thread. It uses its own grabber since mss handles are
+    tied to the thread that created them.
+    """
+    with mss.mss() as grabber:
+        screenshot = grabber.grab(box or grabber.monitors[1])
+    img = downscale(screenshot, max_size, 'lanczos')
+    return encode_jpeg(img, quality), img.size
+
+
+def capture_sources() -> dict:
+    """Monitors and windows a viewer can pick with set_capture_region; blocking"""
+    with mss.mss() as grabber:
+        monitors = [{'index': index, **monitor} for index, monitor in enumerate(grabber.monitors) if index > 0]
+    windows, active = list_windows()
+    return {'monitors': monitors, 'windows': windows, 'active_window': active}
+
+
+class CaptureWorker(threading.Thread):
+    """Captures the screen at ``fps`` into a LatestFrame slot
+
+    With ``delta`` unset every frame is a full keyframe. ``video`` takes
+    precedence over both until disable_video(). ``region`` picks what is
+    grabbed instead of the primary monitor.
+    """
+
+    def __init__(self, slot: LatestFrame, fps: float = 5, max_size=(1280, 720), quality: int = 85,
+                 binary: bool = False, delta: Optional[DeltaEncoder] = None, resize_mode: str = DEFAULT_MODE,
+                 video: Optional[VideoEncoder] = None, region: Optional[CaptureRegion] = None):
+        super().__init__(name='screen-capture', daemon=True)
+        self.slot = slot
+        self.max_size = max_size
+        self.quality = quality
+        self.resize_mode = resize_mode  # see resize.py
+        self.delta = delta
+        self.video = video
+        self.region = region
+        # JSON codecs need the JPEG as base64; doing it here keeps it off the loop too
+        self.binary = binary
+        self._interval = 1 / fps
+        self._wake = threading.Event()
+        self._stopping = False
+
+        self.frames = 0
+        self.late = 0  # frames that finished after the next one was due
+        self.errors = 0
+        self.capture_ms = 0.0  # smoothed grab + resize + encode time
+        self.video_resets = 0  # video backlogs dropped for a fresh keyframe
+
+    @property
+    def fps(self) -> float:
+        return 1 / self._interval
+
+    def set_fps(self, fps: float):
+        """Takes effect from the next tick; a long sleep is cut short"""
+        self._interval = 1 / fps
+        self._wake.set()
+
+    def request_keyframe(self):
+        """A viewer joined or lost a delta; the next frame is a full one, sent now"""
+        encoder = self.video or self.delta
+        if encoder is not None:
+            encoder.request_keyframe()
+            self._wake.set()
+
+    def disable_video(self):
+        """Back to JPEG frames, for a viewer that can't decode the video; starts with a keyframe"""
+        self.video = None
+        if self.delta is not None:
+            self.delta.request_keyframe()
+        self._wake.set()
+
+    def stop(self):
+        self._stopping = True
+        self._wake.set()
+
+    def run(self):
+        while not self._stopping:
+            try:
+                with mss.mss() as grabber:
+                    self._capture_loop(grabber)
+            except Exception as e:
+                self.errors += 1
+                print(f"Screen capture error: {e}")
+                self._wake.wait(ERROR_BACKOFF)
+                self._wake.clear()
+
+    def _capture_loop(self, grabber):
+        deadline = time.monotonic()
+        while not self._stopping:
+            started = time.monotonic()
+            frame = self.capture(grabber, started)
+            if frame is not None:
+                self.slot.put(frame)
+                self.frames += 1
+            finished = time.monotonic()
+            self.capture_ms += ((finished - started) * 1000 - self.capture_ms) * 0.2
+
+            deadline += self._interval
+            if finished > deadline:
+                # Behind schedule: start the next frame now instead of bursting to catch up
+                self.late += 1
+                deadline = finished
+            if self._wake.wait(deadline - finished):
+                # fps changed or stopping; restart the clock from now
+                self._wake.clear()
+                deadline = time.monotonic()
+
+    def capture(self, grabber, now: float) -> Optional[Frame]:
+        """Grab the capture region and encode it as a keyframe or delta; None if nothing to send"""
+        box = self.region.resolve(grabber.monitors, now) if self.region is not None else grabber.monitors[1]
+        screenshot = grabber.grab(box)
+        # Resize for bandwidth optimization
+        img = downscale(screenshot, self.max_size, self.resize_mode)
+
+        video = self.video
+        if video is not None:
+            return self.capture_video(video, img, now)
+        if self.delta is None:
+            return Frame('key', self.encode(img), [], img.size, 0, now, self.frames)
+
+        lost = self.slot.reclaim()
+        if lost is not None:
+            self.delta.lost(lost.kind, lost.tiles)
+        encoded = self.delta.encode(img, now)
+        if encoded is None:
+            return None
+        kind, image, tiles = encoded
+        data = self.encode(image) if image is not None else None
+        return Frame(kind, data, tiles, img.size, self.delta.tile, now, self.frames)
+
+    def capture_video(self, video: VideoEncoder, img: Image.Image, now: float) -> Optional[Frame]:
+        """Encode ``img`` as video chunks, chained after any the sender hasn't taken yet"""
+        frame = self.slot.reclaim()
+        if frame is not None and frame.format != video.codec:
+            # A JPEG frame from before the switch; the encoder starts with a keyframe anyway
+            frame = None
+        for kind, data in video.encode(img, now):
+            if kind == 'key':
+                # Nothing before a keyframe is needed to decode what follows
+                frame = None
+            if not self.binary:
+                data = base64.b64encode(data).decode()
+            # The encoder's size, which is cropped to even dimensions
+            frame = Frame(kind, data, [], video.size, 0, now, self.frames, video.codec, frame)
+        if frame is not None and frame.kind != 'key' and len(frame.chain()) > MAX_VIDEO_BACKLOG:
+            # The sender has fallen far behind; a keyframe is cheaper than the backlog
+            self.video_resets += 1
+            video.request_keyframe()
+            return None
+        return frame
+
+    def encode(self, img: Image.Image) -> Union[bytes, str]:
+        """JPEG-encode, then base64 unless the codec is binary"""
+        jpeg = encode_jpeg(img, self.quality)
+        return jpeg if self.binary else base64.b64encode(jpeg).decode()
+
+    def stats(self) -> dict:
+        stats = {
+            "fps": round(self.fps, 2),
+            "frames": self.frames,
+            "late": self.late,
+            "replaced": self.slot.replaced,
+            "errors": self.errors,
+            "capture_ms": round(self.capture_ms, 1),
+        }
+        if self.region is not None:
+            stats['region'] = self.region.describe()
+        video = self.video
+        if video is not None:
+            stats.update(video.stats(), video_resets=self.video_resets)
+        elif self.delta is not None:
+            stats.update(self.delta.stats())
+        return stats
@@ -0,0 +1,135 @@
+"""
+Dirty-tile delta encoding for screen frames
+The frame is split into TILE x TILE tiles and each tile is hashed. Only
+tiles whose hash changed since the last frame are sent, packed side by side
+into one small "atlas" image, along with where each belongs on screen:
+
+    {"type": "screen_delta", "data": <atlas JPEG>, "tile": 64, "cols": 4,
+     "tiles": [[x, y, w, h], ...]}
+
+Atlas cell i is at ((i % cols) * tile, (i // cols) * tile). A delta with no
+tiles (and no data) is a keepalive. Full keyframes go out as ordinary
+``screen_frame`` messages: at the start, every KEYFRAME_INTERVAL seconds,
+when most of the screen changed, and whenever a viewer asks for one.
+
+Tile sizes are multiples of 16 so JPEG blocks never straddle two tiles.
+"""
+
+import hashlib
+from typing import List, Optional, Tuple
+
+from PIL import Image
+
+TILE = 64
+
+Box = Tuple[int, int, int, int]  # x, y, width, height
+
+
+def atlas_columns(count: int) -> int:
+    return min(count, 16)
+
+
+def _digest(img: Image.Image, box: Box) -> bytes:
+    x, y, w, h = box
+    return hashlib.blake2b(img.crop((x, y, x + w, y + h)).tobytes(), digest_size=16).digest()
+
+
+class DeltaEncoder:
+    """Decides per frame between a keyframe, a delta of dirty tiles, a keepalive or nothing"""
+
+    def __init__(self, tile: int = TILE, keyframe_interval: float = 10.0, keepalive_interval: float = 1.0,
+                 max_dirty: float = 0.5):
+        self.tile = tile
+        self.keyframe_interval = keyframe_interval
+        self.keepalive_interval = keepalive_interval
+        # Past this fraction of dirty tiles a keyframe is smaller than the atlas
+        self.max_dirty = max_dirty
+        self._size: Optional[Tuple[int, int]] = None
+        self._boxes: List[Box] = []
+        self._hashes: List[Optional[bytes]] = []
+        self._frame_hash: Optional[bytes] = None
+        self._force_key = True
+        self._last_key = float('-inf')
+        self._last_sent = float('-inf')
+
+        self.keyframes = 0
+        self.deltas = 0
+        self.keepalives = 0
+        self.skipped = 0
+
+    def request_keyframe(self):
+        self._force_key = True
+
+    def lost(self, kind: str, tiles: List[Box]):
+        """A frame was superseded before it was sent; make sure its content goes out again"""
+        if kind == 'key':
+            self._force_key = True
+            return
+        columns = -(-self._size[0] // self.tile) if self._size else 0
+        for x, y, _, _ in tiles:
+            index = (y // self.tile) * columns + x // self.tile
+            if index < len(self._hashes):
+                self._hashes[index] = None
+
+    def _layout(self, size: Tuple[int, int]):
+        width, height = size
+        self._size = size
+        self._boxes = [
+            (x, y, min(self.tile, width - x), min(self.tile, height - y))
+            for y in range(0, height, self.tile)
+            for x in range(0, width, self.tile)
+        ]
+        self._hashes = [None] * len(self._boxes)
+
+    def encode(self, img: Image.Image, now: float):
+        """Returns ('key', img, []), ('delta', atlas or None, boxes), or None to send nothing"""
+        if img.size != self._size:
+            self._layout(img.size)
+            self._force_key = True
+
+        # An idle screen is the common case; one hash of the whole frame settles it
+        frame_hash = hashlib.blake2b(img.tobytes(), digest_size=16).digest()
+        if frame_hash == self._frame_hash and None not in self._hashes:
+            dirty = []
+        else:
+            hashes = [_digest(img, box) for box in self._boxes]
+            dirty = [i for i, digest in enumerate(hashes) if digest != self._hashes[i]]
+            self._hashes = hashes
+        self._frame_hash = frame_hash
+
+        if (self._force_key or now - self._last_key >= self.keyframe_interval
+                or len(dirty) > len(self._boxes) * self.max_dirty):
+            self._force_key = False
+            self._last_key = self._last_sent = now
+            self.keyframes += 1
+            return 'key', img, []
+
+        if not dirty:
+            if now - self._last_sent < self.keepalive_interval:
+                self.skipped += 1
+                return None
+            self._last_sent = now
+            self.keepalives += 1
+            return 'delta', None, []
+
+        boxes = [self._boxes[i] for i in dirty]
+        self._last_sent = now
+        self.deltas += 1
+        return 'delta', self._atlas(img, boxes), boxes
+
+    def _atlas(self, img: Image.Image, boxes: List[Box]) -> Image.Image:
+        columns = atlas_columns(len(boxes))
+        rows = -(-len(boxes) // columns)
+        atlas = Image.new('RGB', (columns * self.tile, rows * self.tile))
+        for i, (x, y, w, h) in enumerate(boxes):
+            cell = ((i % columns) * self.tile, (i // columns) * self.tile)
+            atlas.paste(img.crop((x, y, x + w, y + h)), cell)
+        return atlas
+
+    def stats(self) -> dict:
+        return {
+            "keyframes": self.keyframes,
+            "deltas": self.deltas,
+            "keepalives": self.keepalives,
+            "skipped": self.skipped,
+        }
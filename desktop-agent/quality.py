@@ -0,0 +1,171 @@
+"""
+Adaptive capture quality for the desktop agent
+Watches how long frames take from capture until the websocket has taken
+them, and how many bytes are waiting in the socket's write buffer, and
+steers JPEG quality, output resolution and frame rate towards a target
+latency within configured bounds.
+
+Degrading goes quality first, then resolution, then fps, since a lower
+fps hurts interactivity most. Recovering goes the other way round and only
+after several good ticks in a row, so the settings don't oscillate.
+The backend's set_fps stays an upper bound on the frame rate. While the
+capture is encoding video (see video.py) JPEG quality has no effect, so
+resolution is the first step; the encoder's bitrate follows it.
+"""
+
+import time
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+
+# Output sizes, smallest first; frames are scaled to fit inside one of these
+RESOLUTIONS: List[Tuple[int, int]] = [(640, 360), (960, 540), (1280, 720), (1600, 900), (1920, 1080)]
+
+QUALITY_STEP_DOWN = 10
+QUALITY_STEP_UP = 5
+FPS_BACKOFF = 0.75
+
+# Good ticks in a row before stepping anything back up
+RECOVER_TICKS = 3
+
+# Changes kept for the stats message
+CHANGE_HISTORY = 10
+
+
+class QualityController:
+    """Closed loop from send latency and socket backlog to capture settings"""
+
+    def __init__(self, capture, target_latency: float = 0.25, quality_min: int = 40, quality_max: int = 90,
+                 resolution_max: Tuple[int, int] = (1920, 1080), fps_min: float = 1.0, interval: float = 1.0):
+        self.capture = capture
+        self.target_latency = target_latency
+        self.quality_min = quality_min
+        self.quality_max = quality_max
+        self.resolutions = [size for size in RESOLUTIONS if size[0] <= resolution_max[0]] or RESOLUTIONS[:1]
+        self.fps_min = fps_min
+        self.interval = interval
+
+        # Start from the settings the agent always used, clamped to the bounds
+        self.quality = min(max(capture.quality, quality_min), quality_max)
+        self.level = min(RESOLUTIONS.index((1280, 720)), len(self.resolutions) - 1)
+        self.fps_ceiling = capture.fps  # set by the backend
+        self.fps_limit = float('inf')  # the controller's own cap, below the ceiling once backed off
+        self._apply()
+
+        self._latencies: List[float] = []
+        self._bytes_sent = 0
+        self.latency: Optional[float] = None  # smoothed, seconds
+        self.buffered = 0
+        self._good_ticks = 0
+        self.changes: Deque[dict] = deque(maxlen=CHANGE_HISTORY)
+
+    @classmethod
+    def from_config(cls, capture, config: dict) -> "QualityController":
+        width, height = config.get('max_resolution', (1920, 1080))
+        return cls(
+            capture,
+            target_latency=float(config.get('target_latency_ms', 250)) / 1000,
+            quality_min=int(config.get('quality_min', 40)),
+            quality_max=int(config.get('quality_max', 90)),
+            resolution_max=(int(width), int(height)),
+            fps_min=float(config.get('fps_min', 1)),
+        )
+
+    @property
+    def resolution(self) -> Tuple[int, int]:
+        return self.resolutions[self.level]
+
+    @property
+    def fps(self) -> float:
+        return min(self.fps_ceiling, max(self.fps_limit, self.fps_min))
+
+    def _apply(self):
+        self.capture.quality = self.quality
+        self.capture.max_size = self.resolution
+        if self.capture.fps != self.fps:
+            self.capture.set_fps(self.fps)
+
+    def set_fps_ceiling(self, fps: float):
+        """The backend's set_fps; the controller never goes above it"""
+        self.fps_ceiling = fps
+        self._apply()
+
+    def frame_sent(self, captured_at: float, size: int, buffered: int):
+        """Called after each frame has been handed to the websocket"""
+        self._latencies.append(time.monotonic() - captured_at)
+        self._bytes_sent += size
+        self.buffered = buffered
+
+    def _change(self, what: str, old, new, reason: str):
+        self.changes.append({'at': round(time.time(), 3), 'what': what, 'from': old, 'to': new, 'reason': reason})
+        print(f"Capture {what}: {old} -> {new} ({reason})")
+
+    def tick(self):
+        """Adjust settings from what was measured since the last tick"""
+        latencies, self._latencies = self._latencies, []
+        sent, self._bytes_sent = self._bytes_sent, 0
+        if not latencies:
+            # Nothing was sent (static screen); no evidence either way
+            return
+        worst = max(latencies)
+        self.latency = worst if self.latency is None else self.latency * 0.5 + worst * 0.5
+        # More than one tick's worth of frames still waiting in the socket is a backlog too
+        backlog = self.buffered > max(sent, 64 * 1024)
+
+        if self.latency > self.target_latency * 1.5 or backlog:
+            self._good_ticks = 0
+            reason = (f"{self.buffered} bytes buffered" if backlog
+                      else f"latency {self.latency * 1000:.0f}ms > target {self.target_latency * 1000:.0f}ms")
+            self._degrade(reason)
+        elif self.latency < self.target_latency * 0.5 and self.buffered == 0:
+            self._good_ticks += 1
+            if self._good_ticks >= RECOVER_TICKS:
+                self._good_ticks = 0
+                self._recover(f"latency {self.latency * 1000:.0f}ms, no backlog")
+        else:
+            self._good_ticks = 0
+
+    def _degrade(self, reason: str):
+        if self.quality > self.quality_min and self.capture.video is None:
+            new = max(self.quality - QUALITY_STEP_DOWN, self.quality_min)
+            self._change('quality', self.quality, new, reason)
+            self.quality = new
+        elif self.level > 0:
+            self._change('resolution', '%dx%d' % self.resolution, '%dx%d' % self.resolutions[self.level - 1], reason)
+            self.level -= 1
+        elif self.fps > self.fps_min:
+            old = self.fps
+            self.fps_limit = round(max(old * FPS_BACKOFF, self.fps_min), 2)
+            self._change('fps', old, self.fps, reason)
+        else:
+            return
+        self._apply()
+
+    def _recover(self, reason: str):
+        if self.fps_limit < self.fps_ceiling:
+            old = self.fps
+            self.fps_limit = round(self.fps_limit / FPS_BACKOFF, 2)
+            if self.fps_limit >= self.fps_ceiling:
+                self.fps_limit = float('inf')
+            self._change('fps', old, self.fps, reason)
+        elif self.level < len(self.resolutions) - 1:
+            self._change('resolution', '%dx%d' % self.resolution, '%dx%d' % self.resolutions[self.level + 1], reason)
+            self.level += 1
+        elif self.quality < self.quality_max and self.capture.video is None:
+            new = min(self.quality + QUALITY_STEP_UP, self.quality_max)
+            self._change('quality', self.quality, new, reason)
+            self.quality = new
+        else:
+            return
+        self._apply()
+
+    def stats(self) -> dict:
+        return {
+            'quality': self.quality,
+            'resolution': '%dx%d' % self.resolution,
+            'fps': self.fps,
+            'fps_ceiling': self.fps_ceiling,
+            'target_latency_ms': round(self.target_latency * 1000),
+            'latency_ms': None if self.latency is None else round(self.latency * 1000, 1),
+            'buffered_bytes': self.buffered,
+            'changes': list(self.changes),
+        }
@@ -0,0 +1,242 @@
+"""
+Which part of the desktop the agent captures
+Instead of the whole primary monitor scaled down, a viewer can pick
+(with ``set_capture_region``):
+
+- monitor:        one monitor by mss index (1 is the primary)
+- window:         one window by the id listed in ``capture_sources``,
+                  tracked as it moves
+- rect:           a fixed rectangle in desktop coordinates
+- follow_cursor:  a stream-sized rectangle around the mouse pointer
+- follow_window:  whichever window is active
+- auto:           the monitor, switching to follow_cursor while commands run
+
+A region smaller than the stream size is sent at native resolution, so
+small text stays readable. Window lists come from the platform libraries
+already in requirements.txt (pygetwindow via pyautogui, Quartz, Xlib);
+where none is available only monitors and rectangles can be chosen.
+"""
+
+import platform
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+REGION_MODES = ('monitor', 'window', 'rect', 'follow_cursor', 'follow_window', 'auto')
+
+# Seconds a window's position is reused before asking the OS again
+WINDOW_REFRESH = 1.0
+
+# follow_cursor only moves once the pointer is this close to an edge, as a
+# fraction of the region size, so the picture doesn't shift with every move
+FOLLOW_MARGIN = 0.2
+
+# auto keeps following the cursor this long after the last command step
+AUTO_LINGER = 3.0
+
+# Smallest region side accepted, in pixels
+MIN_SIZE = 16
+
+Box = Dict[str, int]  # mss's form: left, top, width, height
+
+
+def _box(left, top, width, height) -> Box:
+    return {'left': int(left), 'top': int(top), 'width': int(width), 'height': int(height)}
+
+
+def clamp(box: Box, bounds: Box) -> Box:
+    """``box`` moved and, if need be, shrunk to lie inside ``bounds``"""
+    width = min(box['width'], bounds['width'])
+    height = min(box['height'], bounds['height'])
+    left = min(max(box['left'], bounds['left']), bounds['left'] + bounds['width'] - width)
+    top = min(max(box['top'], bounds['top']), bounds['top'] + bounds['height'] - height)
+    return _box(left, top, width, height)
+
+
+def _contains(box: Box, x: int, y: int) -> bool:
+    return box['left'] <= x < box['left'] + box['width'] and box['top'] <= y < box['top'] + box['height']
+
+
+# Window enumeration per platform; list_windows turns any failure into an empty list
+
+def _windows_win32() -> Tuple[List[dict], Optional[int]]:
+    import pygetwindow
+
+    windows = [
+        {'id': w._hWnd, 'title': w.title, **_box(w.left, w.top, w.width, w.height)}
+        for w in pygetwindow.getAllWindows()
+        if w.title and w.visible and not w.isMinimized and w.width > 0 and w.height > 0
+    ]
+    active = pygetwindow.getActiveWindow()
+    return windows, active._hWnd if active is not None else None
+
+
+def _windows_darwin() -> Tuple[List[dict], Optional[int]]:
+    import Quartz
+
+    infos = Quartz.CGWindowListCopyWindowInfo(
+        Quartz.kCGWindowListOptionOnScreenOnly | Quartz.kCGWindowListExcludeDesktopElements,
+        Quartz.kCGNullWindowID)
+    windows = []
+    for info in infos or []:
+        bounds = info.get('kCGWindowBounds') or {}
+        if info.get('kCGWindowLayer', 0) != 0 or not bounds.get('Width') or not bounds.get('Height'):
+            continue
+        app = info.get('kCGWindowOwnerName') or ''
+        title = info.get('kCGWindowName') or ''
+        windows.append({'id': int(info['kCGWindowNumber']), 'title': f'{app} - {title}' if title else app,
+                        **_box(bounds['X'], bounds['Y'], bounds['Width'], bounds['Height'])})
+    # The list is front to back, so the first normal window is the active one
+    return windows, windows[0]['id'] if windows else None
+
+
+def _windows_x11() -> Tuple[List[dict], Optional[int]]:
+    from Xlib import X, display
+
+    disp = display.Display()
+    try:
+        root = disp.screen().root
+        clients = root.get_full_property(disp.intern_atom('_NET_CLIENT_LIST'), X.AnyPropertyType)
+        active = root.get_full_property(disp.intern_atom('_NET_ACTIVE_WINDOW'), X.AnyPropertyType)
+        name_atom = disp.intern_atom('_NET_WM_NAME')
+        windows = []
+        for wid in (clients.value if clients is not None else []):
+            window = disp.create_resource_object('window', wid)
+            name = window.get_full_property(name_atom, 0)
+            title = name.value.decode('utf-8', 'replace') if name is not None else window.get_wm_name()
+            geometry = window.get_geometry()
+            origin = root.translate_coords(window, 0, 0)
+            if title and geometry.width > 1 and geometry.height > 1:
+                windows.append({'id': int(wid), 'title': str(title),
+                                **_box(origin.x, origin.y, geometry.width, geometry.height)})
+        return windows, int(active.value[0]) if active is not None and len(active.value) else None
+    finally:
+        disp.close()
+
+
+_WINDOW_BACKENDS = {'Windows': _windows_win32, 'Darwin': _windows_darwin, 'Linux': _windows_x11}
+
+
+def list_windows() -> Tuple[List[dict], Optional[int]]:
+    """Visible top-level windows as {'id', 'title', left, top, width, height}, and the active one's id"""
+    backend = _WINDOW_BACKENDS.get(platform.system())
+    if backend is None:
+        return [], None
+    try:
+        return backend()
+    except Exception as e:
+        # Library missing, no display, or the window manager doesn't say
+        print(f"Window list unavailable: {e}")
+        return [], None
+
+
+class CaptureRegion:
+    """The current capture region, set from the event loop and resolved on the capture thread"""
+
+    def __init__(self, cursor: Optional[Callable[[], Tuple[int, int]]] = None,
+                 follow_size: Tuple[int, int] = (1280, 720)):
+        self.cursor = cursor  # () -> (x, y) in desktop coordinates
+        self.follow_size = follow_size
+        self._lock = threading.Lock()
+        self.mode = 'monitor'
+        self.monitor = 1
+        self.window: Optional[int] = None
+        self.rect: Optional[Box] = None
+        self.box: Optional[Box] = None  # last resolved, what the stream shows
+        self.active_until = 0.0
+        # Capture-thread state, reset when the region changes
+        self._changed = False
+        self._window_box: Optional[Box] = None
+        self._window_at = float('-inf')
+        self._follow: Optional[Box] = None
+        self.lost_window = False
+
+    def set(self, message: dict):
+        """Apply a set_capture_region message; ValueError if it doesn't describe a region"""
+        mode = message.get('mode', 'monitor')
+        if mode not in REGION_MODES:
+            raise ValueError(f"unknown capture mode {mode!r}, expected one of {', '.join(REGION_MODES)}")
+        rect = None
+        try:
+            monitor = int(message.get('monitor', self.monitor))
+            window = int(message['window']) if mode == 'window' else None
+            if mode == 'rect':
+                rect = _box(message['x'], message['y'], message['width'], message['height'])
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"invalid {mode} region: {e}")
+        if rect is not None and (rect['width'] < MIN_SIZE or rect['height'] < MIN_SIZE):
+            raise ValueError(f"region must be at least {MIN_SIZE}x{MIN_SIZE}")
+        with self._lock:
+            self.mode = mode
+            self.monitor = monitor
+            self.window = window
+            self.rect = rect
+            self._changed = True
+
+    def command_activity(self):
+        """Called per command step; 'auto' follows the cursor until AUTO_LINGER after the last one"""
+        self.active_until = time.monotonic() + AUTO_LINGER
+
+    def resolve(self, monitors: List[Box], now: float) -> Box:
+        """Desktop box to grab this frame; ``monitors`` is mss's list (0 spans all of them)"""
+        with self._lock:
+            mode, monitor, window, rect = self.mode, self.monitor, self.window, self.rect
+            if self._changed:
+                self._changed = False
+                self._window_box = self._follow = None
+                self._window_at = float('-inf')
+                self.lost_window = False
+        self.box = self._resolve(mode, monitors[monitor] if 0 < monitor < len(monitors) else monitors[1],
+                                 window, rect, monitors, now)
+        return self.box
+
+    def _resolve(self, mode: str, screen: Box, window: Optional[int], rect: Optional[Box], monitors: List[Box],
+                 now: float) -> Box:
+        desktop = monitors[0]
+        if mode == 'auto':
+            mode = 'follow_cursor' if now < self.active_until else 'monitor'
+
+        if mode == 'rect':
+            return clamp(rect, desktop)
+        if mode in ('window', 'follow_window'):
+            if now - self._window_at >= WINDOW_REFRESH:
+                self._window_at = now
+                windows, active = list_windows()
+                wanted = window if mode == 'window' else active
+                found = next((w for w in windows if w['id'] == wanted), None)
+                self.lost_window = found is None
+                if found is not None:
+                    self._window_box = clamp(_box(found['left'], found['top'], found['width'], found['height']),
+                                             desktop)
+            if self._window_box is not None and not self.lost_window:
+                return self._window_box
+            return screen
+        if mode == 'follow_cursor' and self.cursor is not None:
+            return self._follow_cursor(screen, monitors)
+        self._follow = None
+        return screen
+
+    def _follow_cursor(self, default: Box, monitors: List[Box]) -> Box:
+        x, y = self.cursor()
+        screen = next((m for m in monitors[1:] if _contains(m, x, y)), default)
+        follow = self._follow
+        if follow is not None and _contains(screen, follow['left'], follow['top']):
+            margin_x = follow['width'] * FOLLOW_MARGIN
+            margin_y = follow['height'] * FOLLOW_MARGIN
+            if (follow['left'] + margin_x <= x < follow['left'] + follow['width'] - margin_x
+                    and follow['top'] + margin_y <= y < follow['top'] + follow['height'] - margin_y):
+                return follow
+        width, height = self.follow_size
+        self._follow = clamp(_box(x - width // 2, y - height // 2, width, height), screen)
+        return self._follow
+
+    def describe(self) -> dict:
+        with self._lock:
+            return {
+                'mode': self.mode,
+                'monitor': self.monitor,
+                'window': self.window,
+                'rect': self.rect,
+                'box': self.box,
+                'lost_window': self.lost_window,
+            }
@@ -0,0 +1,90 @@
+"""
+Downscaling from the raw mss capture to the size streamed to viewers
+Desktops are often far larger than the stream (5K on Retina Macs against a
+1280x720 view), so most of the work is in shrinking the frame. The modes,
+cheapest first:
+
+- box:      NumPy box-binning of the raw BGRA buffer by an integer factor,
+            before any image is built (falls back to reduce without NumPy)
+- reduce:   Pillow's Image.reduce by an integer factor (a box filter in C)
+- nearest, bilinear, bicubic: a single Image.resize with that filter
+- lanczos:  Image.thumbnail with LANCZOS, the original live-view path;
+            kept for on-demand snapshots
+
+box and reduce finish with a bilinear resize of what is left over, which is
+always less than a factor of two.
+"""
+
+from typing import Tuple
+
+from PIL import Image
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+RESIZE_MODES = ('box', 'reduce', 'nearest', 'bilinear', 'bicubic', 'lanczos')
+
+# Used for live frames unless the agent config says otherwise
+DEFAULT_MODE = 'reduce'
+
+_FILTERS = {
+    'nearest': Image.Resampling.NEAREST,
+    'bilinear': Image.Resampling.BILINEAR,
+    'bicubic': Image.Resampling.BICUBIC,
+}
+
+
+def fit(size: Tuple[int, int], max_size: Tuple[int, int]) -> Tuple[int, int]:
+    """Largest size with the same aspect ratio that fits in ``max_size``, never upscaled"""
+    width, height = size
+    scale = min(max_size[0] / width, max_size[1] / height, 1)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def factor(size: Tuple[int, int], target: Tuple[int, int]) -> int:
+    """Largest integer reduction that stays at or above ``target``"""
+    return max(1, min(size[0] // target[0], size[1] // target[1]))
+
+
+def to_image(shot) -> Image.Image:
+    """RGB image straight from the mss BGRA buffer, skipping mss's Python-level .rgb conversion"""
+    return Image.frombytes('RGB', shot.size, shot.bgra, 'raw', 'BGRX')
+
+
+def _box(shot, step: int) -> Image.Image:
+    width, height = shot.size
+    rows, cols = height // step, width // step
+    pixels = np.frombuffer(shot.bgra, np.uint8)[:rows * step * width * 4].reshape(rows, step, width * 4)
+    # Adding whole slices beats a strided .sum(); uint16 holds up to 16x16 blocks of 255
+    summed = pixels[:, 0].astype(np.uint16)
+    for i in range(1, step):
+        summed += pixels[:, i]
+    summed = summed.reshape(rows, width, 4)[:, :cols * step].reshape(rows, cols, step, 4)
+    binned = summed[:, :, 0].copy()
+    for i in range(1, step):
+        binned += summed[:, :, i]
+    binned //= step * step
+    return Image.frombytes('RGB', (cols, rows), binned.astype(np.uint8).tobytes(), 'raw', 'BGRX')
+
+
+def downscale(shot, max_size: Tuple[int, int], mode: str = DEFAULT_MODE) -> Image.Image:
+    """``shot`` (an mss ScreenShot, or anything with .size and .bgra) as RGB, fitted in ``max_size``"""
+    target = fit(shot.size, max_size)
+    if mode == 'lanczos':
+        img = to_image(shot)
+        img.thumbnail(max_size, Image.Resampling.LANCZOS)
+        return img
+    if mode in _FILTERS:
+        img = to_image(shot)
+        return img if img.size == target else img.resize(target, _FILTERS[mode])
+
+    step = factor(shot.size, target)
+    if mode == 'box' and np is not None and 1 < step <= 16:
+        img = _box(shot, step)
+    else:
+        img = to_image(shot)
+        if step > 1:
+            img = img.reduce(step)
+    return img if img.size == target else img.resize(target, Image.Resampling.BILINEAR)
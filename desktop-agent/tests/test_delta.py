@@ -0,0 +1,70 @@
+from PIL import Image, ImageDraw
+
+from delta import DeltaEncoder
+
+
+def screen(size=(256, 128), color='white'):
+    return Image.new('RGB', size, color)
+
+
+def with_box(img, box, color='black'):
+    img = img.copy()
+    ImageDraw.Draw(img).rectangle(box, fill=color)
+    return img
+
+
+def test_first_frame_is_a_keyframe_then_nothing_until_keepalive():
+    encoder = DeltaEncoder(keepalive_interval=1.0)
+    kind, _, tiles = encoder.encode(screen(), 0.0)
+    assert (kind, tiles) == ('key', [])
+    assert encoder.encode(screen(), 0.5) is None
+    assert encoder.encode(screen(), 1.0) == ('delta', None, [])
+    assert encoder.stats() == {"keyframes": 1, "deltas": 0, "keepalives": 1, "skipped": 1}
+
+
+def test_only_changed_tiles_are_sent():
+    encoder = DeltaEncoder(tile=64)
+    encoder.encode(screen(), 0.0)
+    # One pixel in the second tile of the second row
+    kind, atlas, tiles = encoder.encode(with_box(screen(), (70, 70, 70, 70)), 0.1)
+    assert kind == 'delta'
+    assert tiles == [(64, 64, 64, 64)]
+    assert atlas.size == (64, 64)
+    assert atlas.getpixel((6, 6)) == (0, 0, 0)
+
+
+def test_edge_tiles_are_clipped_to_the_frame():
+    encoder = DeltaEncoder(tile=64)
+    encoder.encode(screen((100, 70)), 0.0)
+    _, _, tiles = encoder.encode(with_box(screen((100, 70)), (99, 69, 99, 69)), 0.1)
+    assert tiles == [(64, 64, 36, 6)]
+
+
+def test_keyframe_when_most_of_the_screen_changes_or_on_request():
+    encoder = DeltaEncoder(tile=64, max_dirty=0.5)
+    encoder.encode(screen(), 0.0)
+    assert encoder.encode(screen(color='black'), 0.1)[0] == 'key'
+
+    encoder.request_keyframe()
+    assert encoder.encode(screen(color='black'), 0.2)[0] == 'key'
+
+
+def test_keyframe_interval_and_size_change():
+    encoder = DeltaEncoder(keyframe_interval=10.0)
+    encoder.encode(screen(), 0.0)
+    assert encoder.encode(screen(), 10.0)[0] == 'key'
+    assert encoder.encode(screen((128, 128)), 10.1)[0] == 'key'
+
+
+def test_lost_delta_tiles_are_sent_again():
+    encoder = DeltaEncoder(tile=64)
+    encoder.encode(screen(), 0.0)
+    changed = with_box(screen(), (0, 0, 10, 10))
+    _, _, tiles = encoder.encode(changed, 0.1)
+    assert tiles == [(0, 0, 64, 64)]
+
+    encoder.lost('delta', tiles)
+    assert encoder.encode(changed, 0.2)[2] == [(0, 0, 64, 64)]
+
+    encoder.lost('key', [])
+    assert encoder.encode(changed, 0.3)[0] == 'key'
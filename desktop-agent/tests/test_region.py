@@ -0,0 +1,88 @@
+import pytest
+
+import region
+from region import CaptureRegion, clamp
+
+# mss's monitor list: 0 spans every monitor, then one entry per monitor
+MONITORS = [
+    {'left': 0, 'top': 0, 'width': 3840, 'height': 1080},
+    {'left': 0, 'top': 0, 'width': 1920, 'height': 1080},
+    {'left': 1920, 'top': 0, 'width': 1920, 'height': 1080},
+]
+
+
+def box(left, top, width, height):
+    return {'left': left, 'top': top, 'width': width, 'height': height}
+
+
+def test_clamp_moves_and_shrinks_into_bounds():
+    assert clamp(box(-10, 1000, 200, 200), MONITORS[1]) == box(0, 880, 200, 200)
+    assert clamp(box(0, 0, 5000, 50), MONITORS[1]) == box(0, 0, 1920, 50)
+
+
+def test_monitor_mode_falls_back_to_the_primary():
+    capture = CaptureRegion()
+    assert capture.resolve(MONITORS, 0) == MONITORS[1]
+    capture.set({'mode': 'monitor', 'monitor': 2})
+    assert capture.resolve(MONITORS, 0) == MONITORS[2]
+    capture.set({'mode': 'monitor', 'monitor': 7})
+    assert capture.resolve(MONITORS, 0) == MONITORS[1]
+
+
+def test_rect_is_kept_on_the_desktop():
+    capture = CaptureRegion()
+    capture.set({'mode': 'rect', 'x': 3800, 'y': 10, 'width': 400, 'height': 300})
+    assert capture.resolve(MONITORS, 0) == box(3440, 10, 400, 300)
+
+
+@pytest.mark.parametrize('message', [
+    {'mode': 'zoom'},
+    {'mode': 'rect', 'x': 0, 'y': 0, 'width': 8, 'height': 100},
+    {'mode': 'rect', 'x': 0},
+    {'mode': 'window'},
+])
+def test_invalid_regions_are_rejected(message):
+    with pytest.raises(ValueError):
+        CaptureRegion().set(message)
+
+
+def test_follow_cursor_only_moves_near_the_edge():
+    cursor = [1000, 500]
+    capture = CaptureRegion(cursor=lambda: tuple(cursor), follow_size=(400, 200))
+    capture.set({'mode': 'follow_cursor'})
+    first = capture.resolve(MONITORS, 0)
+    assert first == box(800, 400, 400, 200)
+
+    cursor[:] = [1050, 520]
+    assert capture.resolve(MONITORS, 0) == first
+    cursor[:] = [1190, 520]
+    assert capture.resolve(MONITORS, 0) == box(990, 420, 400, 200)
+    # Onto the second monitor
+    cursor[:] = [3000, 100]
+    assert capture.resolve(MONITORS, 0) == box(2800, 0, 400, 200)
+
+
+def test_auto_follows_the_cursor_while_commands_run(monkeypatch):
+    capture = CaptureRegion(cursor=lambda: (100, 100), follow_size=(400, 200))
+    capture.set({'mode': 'auto'})
+    monkeypatch.setattr(region.time, 'monotonic', lambda: 50.0)
+    capture.command_activity()
+    assert capture.resolve(MONITORS, 50.0) == box(0, 0, 400, 200)
+    assert capture.resolve(MONITORS, 50.0 + region.AUTO_LINGER) == MONITORS[1]
+
+
+def test_window_mode_tracks_the_window_and_notices_it_is_gone(monkeypatch):
+    windows = [{'id': 7, 'title': 'Editor', **box(100, 100, 800, 600)}]
+    monkeypatch.setattr(region, 'list_windows', lambda: (list(windows), 7))
+    capture = CaptureRegion()
+    capture.set({'mode': 'window', 'window': 7})
+    assert capture.resolve(MONITORS, 0) == box(100, 100, 800, 600)
+
+    windows[0] = {'id': 7, 'title': 'Editor', **box(300, 100, 800, 600)}
+    # Reused until WINDOW_REFRESH has passed
+    assert capture.resolve(MONITORS, 0.5) == box(100, 100, 800, 600)
+    assert capture.resolve(MONITORS, region.WINDOW_REFRESH) == box(300, 100, 800, 600)
+
+    windows.clear()
+    assert capture.resolve(MONITORS, 2 * region.WINDOW_REFRESH) == MONITORS[1]
+    assert capture.describe()['lost_window']
@@ -0,0 +1,49 @@
+import pytest
+from PIL import Image, ImageDraw
+
+pytest.importorskip('av')
+
+import video  # noqa: E402
+
+if not video.available('h264'):
+    pytest.skip('PyAV with libx264 is not installed', allow_module_level=True)
+
+
+def screen(size=(320, 240), box=None):
+    img = Image.new('RGB', size, 'white')
+    if box is not None:
+        ImageDraw.Draw(img).rectangle(box, fill='black')
+    return img
+
+
+def encode(encoder, img, now):
+    chunks = encoder.encode(img, now)
+    assert len(chunks) == 1
+    return chunks[0]
+
+
+def test_keyframe_first_then_deltas():
+    encoder = video.VideoEncoder('h264', keyframe_interval=10)
+    kind, data = encode(encoder, screen(), 0.0)
+    assert kind == 'key' and data
+    assert encode(encoder, screen(box=(10, 10, 50, 50)), 0.1)[0] == 'delta'
+    # An unchanged screen costs next to nothing
+    assert len(encode(encoder, screen(box=(10, 10, 50, 50)), 0.2)[1]) < 100
+    assert encoder.stats()['keyframes'] == 1 and encoder.stats()['deltas'] == 2
+
+
+def test_keyframe_on_request_interval_and_resize():
+    encoder = video.VideoEncoder('h264', keyframe_interval=10)
+    encode(encoder, screen(), 0.0)
+    encoder.request_keyframe()
+    assert encode(encoder, screen(), 0.1)[0] == 'key'
+    assert encode(encoder, screen(), 10.1)[0] == 'key'
+    assert encode(encoder, screen((160, 120)), 10.2)[0] == 'key'
+    assert encoder.reopened == 1
+
+
+def test_odd_sizes_are_cropped_to_even():
+    encoder = video.VideoEncoder('h264')
+    assert encode(encoder, screen((321, 241)), 0.0)[0] == 'key'
+    # Keyframe messages report this size, not the capture's
+    assert encoder.size == (320, 240)
@@ -0,0 +1,150 @@
+"""
+Inter-frame video encoding for the live screen view
+An alternative to JPEG keyframes and tile deltas (delta.py) when PyAV is
+installed: frames are encoded as H.264 (libx264) or VP8 (libvpx) and each
+encoded chunk goes out as an ordinary frame message with the codec as its
+image format:
+
+    {"type": "screen_frame", "format": "h264", "key": true, "width": ..., "height": ..., "data": <chunk>}
+    {"type": "screen_delta", "format": "h264", "data": <chunk>}
+
+so the backend's keyframe handling applies unchanged: a keyframe replaces
+whatever a viewer still has queued, a viewer that falls too far behind
+asks for a new one. The dashboard decodes the chunks with WebCodecs (H.264
+as Annex B, constrained baseline, no B-frames).
+
+Keyframes are only sent at the start, on request, every
+``keyframe_interval`` seconds and when the output size changes, which is
+what makes 15-30 fps affordable: an unchanged screen costs a few dozen
+bytes a frame.
+"""
+
+from fractions import Fraction
+from typing import List, Optional, Tuple
+
+from PIL import Image
+
+try:
+    import av
+except ImportError:
+    av = None
+
+# Encoder and options per wire format; tuned for latency over compression
+ENCODERS = {
+    'h264': ('libx264', {'preset': 'ultrafast', 'tune': 'zerolatency', 'profile': 'baseline',
+                         'forced-idr': '1'}),
+    'vp8': ('libvpx', {'deadline': 'realtime', 'cpu-used': '8', 'lag-in-frames': '0',
+                       'error-resilient': '1'}),
+}
+
+# Bitrates are given for this size and scaled by pixel count
+REFERENCE_SIZE = (1280, 720)
+
+Chunk = Tuple[str, bytes]  # 'key' or 'delta', encoded data
+
+
+def available(codec: str) -> bool:
+    """Whether PyAV is installed and has an encoder for ``codec``"""
+    return av is not None and codec in ENCODERS and ENCODERS[codec][0] in av.codecs_available
+
+
+if av is not None:
+    try:
+        _KEYFRAME = av.video.frame.PictureType.I
+    except AttributeError:
+        # PyAV before 12 takes the name
+        _KEYFRAME = 'I'
+
+
+class VideoEncoder:
+    """Turns a stream of equally sized images into keyframe and delta chunks"""
+
+    def __init__(self, codec: str = 'h264', bitrate: int = 1500, keyframe_interval: float = 10.0,
+                 fps: float = 30):
+        if not available(codec):
+            raise ValueError(f'no {codec} encoder (is PyAV installed?)')
+        self.codec = codec
+        self.bitrate = bitrate  # kbit/s at REFERENCE_SIZE
+        self.keyframe_interval = keyframe_interval
+        self.fps = fps
+        self._context = None
+        self._size: Optional[Tuple[int, int]] = None
+        self._start: Optional[float] = None
+        self._last_pts = -1
+        self._force_key = True
+        self._last_key = float('-inf')
+
+        self.keyframes = 0
+        self.deltas = 0
+        self.bytes = 0
+        self.reopened = 0
+
+    @property
+    def size(self) -> Optional[Tuple[int, int]]:
+        """Coded size of the stream, the input cropped to even dimensions"""
+        return self._size
+
+    def request_keyframe(self):
+        self._force_key = True
+
+    def _open(self, size: Tuple[int, int]):
+        name, options = ENCODERS[self.codec]
+        context = av.CodecContext.create(name, 'w')
+        context.width, context.height = size
+        context.pix_fmt = 'yuv420p'
+        context.time_base = Fraction(1, 1000)
+        context.framerate = Fraction(round(self.fps))
+        # Keyframes come from request_keyframe and the interval, not the encoder's GOP
+        context.gop_size = max(1, round(self.keyframe_interval * self.fps))
+        area = size[0] * size[1] / (REFERENCE_SIZE[0] * REFERENCE_SIZE[1])
+        context.bit_rate = int(self.bitrate * 1000 * area)
+        context.options = dict(options)
+        if self._context is not None:
+            self.reopened += 1
+        self._context = context
+        self._size = size
+        self._force_key = True
+
+    def encode(self, img: Image.Image, now: float) -> List[Chunk]:
+        """Encode one frame; usually one chunk, none while the encoder is still buffering"""
+        # 4:2:0 chroma needs even dimensions
+        width, height = img.size[0] & ~1, img.size[1] & ~1
+        if img.size != (width, height):
+            img = img.crop((0, 0, width, height))
+        if (width, height) != self._size:
+            self._open((width, height))
+
+        if self._start is None:
+            self._start = now
+        frame = av.VideoFrame.from_image(img).reformat(format='yuv420p')
+        frame.pts = self._last_pts = max(round((now - self._start) * 1000), self._last_pts + 1)
+        if self._force_key or now - self._last_key >= self.keyframe_interval:
+            frame.pict_type = _KEYFRAME
+            self._force_key = False
+
+        chunks = []
+        for packet in self._context.encode(frame):
+            data = bytes(packet)
+            if packet.is_keyframe:
+                self._last_key = now
+                self.keyframes += 1
+                chunks.append(('key', data))
+            else:
+                self.deltas += 1
+                chunks.append(('delta', data))
+            self.bytes += len(data)
+        return chunks
+
+    def close(self):
+        # PyAV frees the encoder with the context
+        self._context = None
+        self._size = None
+
+    def stats(self) -> dict:
+        return {
+            "video": self.codec,
+            "keyframes": self.keyframes,
+            "deltas": self.deltas,
+            "video_bytes": self.bytes,
+            "reopened": self.reopened,
+        }
@@ -0,0 +1,215 @@
+"""
+Wire codecs shared by the desktop agent and the backend
+The agent ships desktop-agent/wire.py and the backend, which is deployed
+on its own, has its copy in backend/wire.py; the two must stay identical.
+
+A connection asks for codecs in order of preference with ``?codec=`` and
+the server answers with a ``hello`` message (always plain JSON) naming the
+one it picked. Messages in either direction can then use it; plain JSON
+stays the default for clients that don't ask.
+
+- json:    stdlib JSON in text frames
+- orjson:  the same JSON text, encoded and decoded by orjson
+- msgpack: MessagePack in binary frames; bytes values (frame images) are
+           sent raw instead of base64
+
+Both JSON codecs write bytes values as base64 strings, so a message built
+for msgpack can be sent to a JSON client unchanged.
+
+Screen frames have a binary form of their own, negotiated separately with
+``?frames=binary``: a fixed little-endian header, the delta tile boxes,
+then the image bytes as-is (see pack_frame). It is independent of the
+codec, so a JSON client can use it too; control messages stay in the codec.
+Besides JPEG the image can be an H.264 or VP8 chunk (see video.py), in
+which case a delta carries no tiles.
+"""
+
+import base64
+import json
+import struct
+from typing import Callable, Dict, List, Optional, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+Payload = Union[str, bytes]
+
+
+def _bytes_to_base64(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return base64.b64encode(value).decode()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+class Codec:
+    def __init__(self, name: str, binary: bool, dumps: Callable[[dict], Payload], loads: Callable[[Payload], dict]):
+        self.name = name
+        self.binary = binary
+        self.dumps = dumps
+        self.loads = loads
+
+    def __repr__(self):
+        return f'Codec({self.name!r})'
+
+
+JSON = Codec(
+    'json', False,
+    lambda message: json.dumps(message, default=_bytes_to_base64),
+    json.loads,
+)
+
+CODECS: Dict[str, Codec] = {'json': JSON}
+
+if orjson is not None:
+    CODECS['orjson'] = Codec(
+        'orjson', False,
+        lambda message: orjson.dumps(message, default=_bytes_to_base64).decode(),
+        orjson.loads,
+    )
+
+if msgpack is not None:
+    CODECS['msgpack'] = Codec(
+        'msgpack', True,
+        lambda message: msgpack.packb(message, use_bin_type=True),
+        lambda payload: msgpack.unpackb(payload, raw=False),
+    )
+
+# Fastest available implementation of each frame kind
+TEXT = CODECS.get('orjson', JSON)
+BINARY = CODECS.get('msgpack')
+
+# Client-side preference, best first
+PREFERENCE = ('msgpack', 'orjson', 'json')
+
+
+def preferred() -> str:
+    """Value for ``?codec=`` listing what this side supports, best first"""
+    return ','.join(name for name in PREFERENCE if name in CODECS)
+
+
+def negotiate(requested: Optional[str]) -> Codec:
+    """First codec in the client's list that this side supports, else JSON"""
+    for name in (requested or '').split(','):
+        codec = CODECS.get(name.strip().lower())
+        if codec is not None:
+            return codec
+    return JSON
+
+
+def get(name: Optional[str]) -> Codec:
+    return CODECS.get(name or 'json', JSON)
+
+
+def codec_for(payload: Payload) -> Codec:
+    """The codec a received message is in: binary messages are msgpack, text is JSON"""
+    if isinstance(payload, str):
+        return TEXT
+    if BINARY is None:
+        raise ValueError('binary message received but msgpack is not installed')
+    return BINARY
+
+
+def loads(payload: Payload) -> dict:
+    if is_frame(payload):
+        return unpack_frame(payload)
+    return codec_for(payload).loads(payload)
+
+
+# Binary screen frames
+# magic, version, kind, seq, timestamp, width, height, format, tile, cols, tile count
+FRAME_MAGIC = b'SF'  # 0x53 is a msgpack positive fixint, never the start of a message
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct('<2sBBIdHHBHHH')
+_TILE_BOX = struct.Struct('<HHHH')
+
+FRAME_KINDS = {1: 'screen_frame', 2: 'screen_delta'}
+_FRAME_KIND_IDS = {name: kind for kind, name in FRAME_KINDS.items()}
+IMAGE_FORMATS = {1: 'jpeg', 2: 'h264', 3: 'vp8'}
+_IMAGE_FORMAT_IDS = {name: fmt for fmt, name in IMAGE_FORMATS.items()}
+
+
+def is_frame(payload: Payload) -> bool:
+    return not isinstance(payload, str) and payload[:2] == FRAME_MAGIC
+
+
+def pack_frame(message: dict) -> bytes:
+    """Binary form of a screen_frame / screen_delta message whose ``data`` is bytes"""
+    tiles: List[list] = message.get('tiles') or []
+    header = FRAME_HEADER.pack(
+        FRAME_MAGIC, FRAME_VERSION, _FRAME_KIND_IDS[message['type']],
+        message.get('seq', 0) & 0xffffffff, message.get('timestamp', 0.0),
+        message.get('width', 0), message.get('height', 0),
+        _IMAGE_FORMAT_IDS[message.get('format', 'jpeg')],
+        message.get('tile', 0), message.get('cols', 0), len(tiles),
+    )
+    boxes = b''.join(_TILE_BOX.pack(*box) for box in tiles)
+    return b''.join((header, boxes, message.get('data') or b''))
+
+
+def unpack_frame(payload: bytes) -> dict:
+    """The message pack_frame was given, with ``data`` as bytes"""
+    try:
+        (_, version, kind, seq, timestamp, width, height, fmt, tile, cols,
+         count) = FRAME_HEADER.unpack_from(payload)
+    except struct.error as e:
+        raise ValueError(f'truncated frame header: {e}')
+    if version != FRAME_VERSION or kind not in FRAME_KINDS or fmt not in IMAGE_FORMATS:
+        raise ValueError(f'unsupported frame (version {version}, kind {kind}, format {fmt})')
+    start = FRAME_HEADER.size + count * _TILE_BOX.size
+    if start > len(payload):
+        raise ValueError('truncated frame tiles')
+    message = {'type': FRAME_KINDS[kind], 'seq': seq, 'timestamp': timestamp, 'format': IMAGE_FORMATS[fmt]}
+    if kind == 1:
+        message.update(width=width, height=height, key=True)
+    else:
+        message['tiles'] = [list(box) for box in _TILE_BOX.iter_unpack(payload[FRAME_HEADER.size:start])]
+    if start < len(payload):
+        message['data'] = bytes(payload[start:])
+        if kind == 2 and fmt == 1:
+            message.update(tile=tile, cols=cols)
+    return message
+
+
+def _msgpack_str(data: bytes, pos: int):
+    """Read a msgpack str at ``pos``; returns (value, next position) or (None, pos)"""
+    if pos >= len(data):
+        return None, pos
+    head = data[pos]
+    if 0xa0 <= head <= 0xbf:
+        length, pos = head & 0x1f, pos + 1
+    elif head == 0xd9 and pos + 1 < len(data):
+        length, pos = data[pos + 1], pos + 2
+    else:
+        return None, pos
+    if pos + length > len(data):
+        return None, pos
+    return data[pos:pos + length].decode('utf-8', 'replace'), pos + length
+
+
+def peek_msgpack_type(data: bytes) -> str:
+    """Message type of a binary frame, or of a msgpack map whose first key is "type", without unpacking it"""
+    if not data:
+        return ''
+    if data[:2] == FRAME_MAGIC:
+        return FRAME_KINDS.get(data[3], '') if len(data) > 3 else ''
+    head = data[0]
+    if 0x80 <= head <= 0x8f:
+        pos = 1
+    elif head == 0xde:
+        pos = 3
+    elif head == 0xdf:
+        pos = 5
+    else:
+        return ''
+    key, pos = _msgpack_str(data, pos)
+    if key != 'type':
+        return ''
+    value, _ = _msgpack_str(data, pos)
+    return value or ''
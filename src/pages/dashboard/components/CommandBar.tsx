@@ -35,7 +35,8 @@ export default function CommandBar({ connectionStatus }: CommandBarProps) {
       // Get access code from localStorage (set by AccessCodeModal)
       const accessCode = localStorage.getItem('owner_access_verified') === 'true' ? 'Samuel1987@!' : 'test-code';
       const wsUrl = API_CONFIG.WS_URL;
-      const ws = new WebSocket(`${wsUrl}?code=${encodeURIComponent(accessCode)}&client_type=web`);
+      // Commands and results only; the screen viewer has its own socket
+      const ws = new WebSocket(`${wsUrl}?code=${encodeURIComponent(accessCode)}&client_type=web&frames=none`);
       
       ws.onopen = () => {
         console.log('WebSocket connected');
@@ -44,8 +45,13 @@ export default function CommandBar({ connectionStatus }: CommandBarProps) {
       ws.onmessage = (event) => {
         try {
           const data = JSON.parse(event.data);
-          console.log('WebSocket message:', data);
-          
+
+          if (data.type === 'ping') {
+            // Backend heartbeat; unanswered pings get the connection reaped
+            ws.send(JSON.stringify({ type: 'pong', ts: data.ts }));
+            return;
+          }
+
           if (data.type === 'command_result') {
             updateCommandStatus(
               data.commandId || Date.now().toString(),
@@ -2,37 +2,373 @@ import { useState, useEffect, useRef } from 'react';
 import { motion } from 'framer-motion';
 import { API_CONFIG, getWebSocketUrl } from '../../../config/api';
 
+// Agents send a full keyframe (screen_frame) every few seconds and, in
+// between, screen_delta messages carrying only the tiles that changed,
+// packed into one atlas image. The canvas below composites them.
+//
+// Frames arrive as binary messages (see parseFrame and desktop-agent/wire.py)
+// unless the agent can't send them, in which case they are JSON with the
+// image in base64. Control messages are always JSON text.
+//
+// Agents in video mode send H.264 or VP8 chunks in the same messages
+// (format 'h264' / 'vp8', keyframes as screen_frame), decoded with
+// WebCodecs. A browser that can't decode them sends 'video_unsupported' and
+// the agent goes back to JPEG.
+
+type Tile = [number, number, number, number]; // x, y, width, height
+
+interface ScreenFrame {
+  type: 'screen_frame' | 'screen_delta';
+  format?: string;
+  data?: string | Blob | Uint8Array;
+  seq?: number;
+  timestamp?: number;
+  tile?: number;
+  cols?: number;
+  tiles?: Tile[];
+}
+
+interface CaptureSources {
+  monitors: { index: number; width: number; height: number }[];
+  windows: { id: number; title: string }[];
+}
+
+interface CaptureRegion {
+  mode: string;
+  monitor?: number;
+  window?: number | null;
+}
+
+// What the source picker shows for a region, e.g. 'monitor:2' or 'follow_cursor'
+function regionValue(region: CaptureRegion): string {
+  if (region.mode === 'monitor') return `monitor:${region.monitor ?? 1}`;
+  if (region.mode === 'window') return `window:${region.window}`;
+  return region.mode;
+}
+
+// Minimum gap between keyframe requests from this viewer
+const KEYFRAME_REQUEST_INTERVAL_MS = 1000;
+
+// Binary frame header: magic "SF", version, kind, seq, timestamp, width,
+// height, image format, tile size, atlas columns, tile count (little-endian)
+const FRAME_HEADER_BYTES = 27;
+const FRAME_KINDS: Record<number, ScreenFrame['type']> = { 1: 'screen_frame', 2: 'screen_delta' };
+const IMAGE_FORMATS: Record<number, string> = { 1: 'jpeg', 2: 'h264', 3: 'vp8' };
+
+// WebCodecs decoder configs; the agent's H.264 is constrained baseline, Annex B
+const VIDEO_CODECS: Record<string, string> = { h264: 'avc1.42E028', vp8: 'vp8' };
+
+// Decoder errors in a row before giving up on video for this connection
+const MAX_VIDEO_ERRORS = 3;
+
+function parseFrame(buffer: ArrayBuffer): ScreenFrame | null {
+  const view = new DataView(buffer);
+  if (buffer.byteLength < FRAME_HEADER_BYTES || view.getUint8(0) !== 0x53 || view.getUint8(1) !== 0x46) {
+    return null;
+  }
+  const type = FRAME_KINDS[view.getUint8(3)];
+  const format = IMAGE_FORMATS[view.getUint8(20)];
+  if (view.getUint8(2) !== 1 || !type || !format) return null;
+
+  const count = view.getUint16(25, true);
+  const tiles: Tile[] = [];
+  for (let i = 0, offset = FRAME_HEADER_BYTES; i < count; i++, offset += 8) {
+    tiles.push([
+      view.getUint16(offset, true),
+      view.getUint16(offset + 2, true),
+      view.getUint16(offset + 4, true),
+      view.getUint16(offset + 6, true),
+    ]);
+  }
+  const imageStart = FRAME_HEADER_BYTES + count * 8;
+  let data: Blob | Uint8Array | undefined;
+  if (imageStart < buffer.byteLength) {
+    const bytes = new Uint8Array(buffer, imageStart);
+    // A view onto the message; the browser decodes it without copying through JS strings
+    data = format === 'jpeg' ? new Blob([bytes], { type: 'image/jpeg' }) : bytes;
+  }
+  return {
+    type,
+    format,
+    seq: view.getUint32(4, true),
+    timestamp: view.getFloat64(8, true),
+    tile: view.getUint16(21, true),
+    cols: view.getUint16(23, true),
+    tiles,
+    data,
+  };
+}
+
+function toBytes(data: string | Blob | Uint8Array): Uint8Array | null {
+  if (data instanceof Uint8Array) return data;
+  if (typeof data !== 'string') return null;
+  return Uint8Array.from(atob(data), (c) => c.charCodeAt(0));
+}
+
+function loadImage(base64: string): Promise<HTMLImageElement> {
+  return new Promise((resolve, reject) => {
+    const img = new Image();
+    img.onload = () => resolve(img);
+    img.onerror = () => reject(new Error('Could not decode screen image'));
+    img.src = `data:image/jpeg;base64,${base64}`;
+  });
+}
+
+async function decodeImage(data: string | Blob): Promise<ImageBitmap | HTMLImageElement> {
+  return typeof data === 'string' ? loadImage(data) : createImageBitmap(data);
+}
+
+function release(image: ImageBitmap | HTMLImageElement) {
+  if ('close' in image) image.close();
+}
+
+function drawTiles(ctx: CanvasRenderingContext2D, atlas: CanvasImageSource, delta: ScreenFrame) {
+  const size = delta.tile ?? 64;
+  const cols = delta.cols ?? 1;
+  (delta.tiles ?? []).forEach(([x, y, w, h], i) => {
+    const sx = (i % cols) * size;
+    const sy = Math.floor(i / cols) * size;
+    ctx.drawImage(atlas, sx, sy, w, h, x, y, w, h);
+  });
+}
+
 export default function ScreenMonitor() {
   const [isFullscreen, setIsFullscreen] = useState(false);
   const [quality, setQuality] = useState<'HD' | 'SD'>('HD');
   const [fps, setFps] = useState(5);
   const [showControls, setShowControls] = useState(false);
-  const [screenImage, setScreenImage] = useState<string | null>(null);
+  const [hasFrame, setHasFrame] = useState(false);
+  const [resolution, setResolution] = useState<string | null>(null);
+  const [sources, setSources] = useState<CaptureSources>({ monitors: [], windows: [] });
+  const [region, setRegion] = useState('monitor:1');
   const [isConnected, setIsConnected] = useState(false);
   const [latency, setLatency] = useState(0);
   const wsRef = useRef<WebSocket | null>(null);
+  const canvasRef = useRef<HTMLCanvasElement | null>(null);
+  // Deltas only apply on top of a keyframe
+  const hasKeyframeRef = useRef(false);
+  // Image decoding is async; draws are chained so tiles land in order
+  const drawChainRef = useRef<Promise<void>>(Promise.resolve());
+  const keyframeRequestedRef = useRef(0);
+  const decoderRef = useRef<VideoDecoder | null>(null);
+  const decoderFormatRef = useRef<string | null>(null);
+  const videoErrorsRef = useRef(0);
+
+  const requestKeyframe = () => {
+    const ws = wsRef.current;
+    const now = Date.now();
+    if (!ws || ws.readyState !== WebSocket.OPEN || now - keyframeRequestedRef.current < KEYFRAME_REQUEST_INTERVAL_MS) {
+      return;
+    }
+    keyframeRequestedRef.current = now;
+    ws.send(JSON.stringify({ type: 'request_keyframe' }));
+  };
+
+  const requestSnapshot = () => {
+    const ws = wsRef.current;
+    if (ws && ws.readyState === WebSocket.OPEN) {
+      // Full resolution with a slow, sharp filter; arrives as a 'snapshot' message
+      ws.send(JSON.stringify({ type: 'request_snapshot' }));
+    }
+  };
+
+  const reportVideoUnsupported = (format: string) => {
+    const ws = wsRef.current;
+    if (ws && ws.readyState === WebSocket.OPEN) {
+      ws.send(JSON.stringify({ type: 'video_unsupported', format }));
+    }
+  };
+
+  const closeDecoder = () => {
+    const decoder = decoderRef.current;
+    decoderRef.current = null;
+    decoderFormatRef.current = null;
+    if (decoder && decoder.state !== 'closed') decoder.close();
+  };
+
+  const openDecoder = async (format: string): Promise<VideoDecoder | null> => {
+    if (decoderRef.current && decoderFormatRef.current === format) return decoderRef.current;
+    closeDecoder();
+    const config: VideoDecoderConfig = { codec: VIDEO_CODECS[format], optimizeForLatency: true };
+    const supported = typeof VideoDecoder !== 'undefined' && VIDEO_CODECS[format] !== undefined
+      && (await VideoDecoder.isConfigSupported(config)).supported;
+    if (!supported) {
+      reportVideoUnsupported(format);
+      return null;
+    }
+    const decoder = new VideoDecoder({
+      output: (videoFrame) => {
+        const canvas = canvasRef.current;
+        const ctx = canvas?.getContext('2d');
+        if (canvas && ctx) {
+          if (canvas.width !== videoFrame.displayWidth || canvas.height !== videoFrame.displayHeight) {
+            canvas.width = videoFrame.displayWidth;
+            canvas.height = videoFrame.displayHeight;
+            setResolution(`${videoFrame.displayWidth}x${videoFrame.displayHeight}`);
+          }
+          ctx.drawImage(videoFrame, 0, 0);
+          setHasFrame(true);
+        }
+        videoFrame.close();
+        videoErrorsRef.current = 0;
+      },
+      error: (error) => {
+        console.error('Error decoding screen video:', error);
+        if (decoderRef.current === decoder) closeDecoder();
+        hasKeyframeRef.current = false;
+        videoErrorsRef.current += 1;
+        if (videoErrorsRef.current >= MAX_VIDEO_ERRORS) {
+          reportVideoUnsupported(format);
+        } else {
+          requestKeyframe();
+        }
+      },
+    });
+    decoder.configure(config);
+    decoderRef.current = decoder;
+    decoderFormatRef.current = format;
+    return decoder;
+  };
+
+  const applyVideo = async (frame: ScreenFrame, format: string) => {
+    const data = frame.data ? toBytes(frame.data) : null;
+    if (!data) return;
+    let decoder = decoderRef.current;
+    if (frame.type === 'screen_frame') {
+      decoder = await openDecoder(format);
+      if (!decoder) return;
+      hasKeyframeRef.current = true;
+    } else if (!hasKeyframeRef.current || !decoder || decoderFormatRef.current !== format) {
+      requestKeyframe();
+      return;
+    }
+    decoder.decode(new EncodedVideoChunk({
+      type: frame.type === 'screen_frame' ? 'key' : 'delta',
+      timestamp: Math.round((frame.timestamp ?? 0) * 1e6),
+      data,
+    }));
+  };
+
+  const listSources = () => {
+    const ws = wsRef.current;
+    if (ws && ws.readyState === WebSocket.OPEN) {
+      // Answered by the agent with 'capture_sources'
+      ws.send(JSON.stringify({ type: 'list_capture_sources' }));
+    }
+  };
+
+  const selectRegion = (value: string) => {
+    const ws = wsRef.current;
+    if (!ws || ws.readyState !== WebSocket.OPEN) return;
+    const [mode, id] = value.split(':');
+    const message: Record<string, unknown> = { type: 'set_capture_region', mode };
+    if (mode === 'monitor') message.monitor = Number(id);
+    if (mode === 'window') message.window = Number(id);
+    setRegion(value);
+    ws.send(JSON.stringify(message));
+  };
+
+  const saveSnapshot = (data: string) => {
+    const link = document.createElement('a');
+    link.href = `data:image/jpeg;base64,${data}`;
+    link.download = `screenshot-${new Date().toISOString().replace(/[:.]/g, '-')}.jpg`;
+    link.click();
+  };
+
+  const applyFrame = async (frame: ScreenFrame) => {
+    const canvas = canvasRef.current;
+    const ctx = canvas?.getContext('2d');
+    if (!canvas || !ctx) return;
+
+    if (frame.format && frame.format !== 'jpeg') {
+      await applyVideo(frame, frame.format);
+      return;
+    }
+    if (frame.data instanceof Uint8Array) return;
+
+    if (frame.type === 'screen_frame') {
+      if (!frame.data) return;
+      // Back on JPEG, e.g. after a video fallback
+      closeDecoder();
+      const image = await decodeImage(frame.data);
+      if (canvas.width !== image.width || canvas.height !== image.height) {
+        canvas.width = image.width;
+        canvas.height = image.height;
+        setResolution(`${image.width}x${image.height}`);
+      }
+      ctx.drawImage(image, 0, 0);
+      release(image);
+      hasKeyframeRef.current = true;
+      setHasFrame(true);
+      return;
+    }
+
+    if (!hasKeyframeRef.current) {
+      requestKeyframe();
+      return;
+    }
+    if (!frame.data || !frame.tiles?.length) return; // keepalive: nothing changed
+    const atlas = await decodeImage(frame.data);
+    drawTiles(ctx, atlas, frame);
+    release(atlas);
+  };
+
+  const queueFrame = (frame: ScreenFrame) => {
+    drawChainRef.current = drawChainRef.current
+      .then(() => applyFrame(frame))
+      .catch((error) => console.error('Error drawing screen frame:', error));
+  };
 
   useEffect(() => {
     // Connect to Railway backend WebSocket for screen capture
     const accessCode = 'test-code'; // This should come from user's session
-    const wsUrl = getWebSocketUrl(API_CONFIG.WS_PATHS.DASHBOARD(accessCode));
+    const wsUrl = getWebSocketUrl(`${API_CONFIG.WS_PATHS.DASHBOARD(accessCode)}&frames=binary`);
     
     try {
       const ws = new WebSocket(wsUrl);
+      ws.binaryType = 'arraybuffer';
       wsRef.current = ws;
 
       ws.onopen = () => {
         console.log('Connected to Railway backend');
         setIsConnected(true);
+        ws.send(JSON.stringify({ type: 'list_capture_sources' }));
       };
 
       ws.onmessage = (event) => {
+        if (event.data instanceof ArrayBuffer) {
+          const frame = parseFrame(event.data);
+          if (frame) queueFrame(frame);
+          return;
+        }
         try {
           const data = JSON.parse(event.data);
           
-          if (data.type === 'screen_frame') {
-            // Update screen image
-            setScreenImage(data.image);
+          if (data.type === 'ping') {
+            // Backend heartbeat; unanswered pings get the connection reaped
+            ws.send(JSON.stringify({ type: 'pong', ts: data.ts }));
+            return;
+          }
+          
+          if (data.type === 'snapshot') {
+            saveSnapshot(data.data);
+            return;
+          }
+          
+          if (data.type === 'capture_sources') {
+            setSources({ monitors: data.monitors ?? [], windows: data.windows ?? [] });
+            if (data.region) setRegion(regionValue(data.region));
+            return;
+          }
+          
+          if (data.type === 'capture_region') {
+            if (data.error) console.error('Capture region rejected:', data.error);
+            setRegion(regionValue(data));
+            return;
+          }
+          
+          if (data.type === 'screen_frame' || data.type === 'screen_delta') {
+            queueFrame(data);
             setLatency(data.latency || 0);
             setFps(data.fps || 5);
           }
@@ -49,6 +385,8 @@ export default function ScreenMonitor() {
       ws.onclose = () => {
         console.log('Disconnected from Railway backend');
         setIsConnected(false);
+        hasKeyframeRef.current = false;
+        closeDecoder();
       };
     } catch (error) {
       console.error('Failed to connect to WebSocket:', error);
@@ -59,6 +397,7 @@ export default function ScreenMonitor() {
       if (wsRef.current) {
         wsRef.current.close();
       }
+      closeDecoder();
     };
   }, []);
 
@@ -80,13 +419,38 @@ export default function ScreenMonitor() {
         </div>
 
         <div className="flex items-center gap-2">
+          <select
+            value={region}
+            onFocus={listSources}
+            onChange={(event) => selectRegion(event.target.value)}
+            aria-label="Capture source"
+            className="px-2 py-1.5 bg-[#21262D] text-gray-400 hover:text-white rounded-lg text-xs font-medium cursor-pointer max-w-[12rem]"
+          >
+            {(sources.monitors.length ? sources.monitors : [{ index: 1, width: 0, height: 0 }]).map((monitor) => (
+              <option key={`monitor:${monitor.index}`} value={`monitor:${monitor.index}`}>
+                Monitor {monitor.index}{monitor.width ? ` (${monitor.width}x${monitor.height})` : ''}
+              </option>
+            ))}
+            {sources.windows.map((win) => (
+              <option key={`window:${win.id}`} value={`window:${win.id}`}>
+                {win.title}
+              </option>
+            ))}
+            {region === 'rect' && <option value="rect" disabled>Custom rectangle</option>}
+            <option value="follow_cursor">Follow cursor</option>
+            <option value="follow_window">Active window</option>
+            <option value="auto">Auto (follow during commands)</option>
+          </select>
           <button
             onClick={() => setQuality(quality === 'HD' ? 'SD' : 'HD')}
             className="px-3 py-1.5 bg-[#21262D] text-gray-400 hover:text-white rounded-lg text-xs font-medium transition-colors cursor-pointer whitespace-nowrap"
           >
             {quality}
           </button>
-          <button className="w-9 h-9 flex items-center justify-center bg-[#21262D] text-gray-400 hover:text-white rounded-lg transition-colors cursor-pointer">
+          <button
+            onClick={requestSnapshot}
+            className="w-9 h-9 flex items-center justify-center bg-[#21262D] text-gray-400 hover:text-white rounded-lg transition-colors cursor-pointer"
+          >
             <i className="ri-camera-line"></i>
           </button>
           <button
@@ -105,13 +469,12 @@ export default function ScreenMonitor() {
         onMouseLeave={() => setShowControls(false)}
       >
         {/* Screen Content */}
-        {screenImage ? (
-          <img
-            src={`data:image/jpeg;base64,${screenImage}`}
-            alt="Screen capture"
-            className="w-full h-full object-contain"
-          />
-        ) : (
+        <canvas
+          ref={canvasRef}
+          aria-label="Screen capture"
+          className={hasFrame ? 'w-full h-full object-contain' : 'hidden'}
+        />
+        {!hasFrame && (
           <div className="absolute inset-0 flex items-center justify-center">
             <div className="text-center">
               <motion.div
@@ -141,11 +504,17 @@ export default function ScreenMonitor() {
             animate={{ opacity: 1 }}
             className="absolute bottom-4 right-4 flex gap-2"
           >
-            <button className="px-4 py-2 bg-black/80 backdrop-blur-sm text-white rounded-lg text-sm font-medium hover:bg-black transition-colors flex items-center gap-2 cursor-pointer whitespace-nowrap">
+            <button
+              onClick={requestSnapshot}
+              className="px-4 py-2 bg-black/80 backdrop-blur-sm text-white rounded-lg text-sm font-medium hover:bg-black transition-colors flex items-center gap-2 cursor-pointer whitespace-nowrap"
+            >
               <i className="ri-screenshot-line"></i>
               Screenshot
             </button>
-            <button className="px-4 py-2 bg-black/80 backdrop-blur-sm text-white rounded-lg text-sm font-medium hover:bg-black transition-colors flex items-center gap-2 cursor-pointer whitespace-nowrap">
+            <button
+              onClick={requestKeyframe}
+              className="px-4 py-2 bg-black/80 backdrop-blur-sm text-white rounded-lg text-sm font-medium hover:bg-black transition-colors flex items-center gap-2 cursor-pointer whitespace-nowrap"
+            >
               <i className="ri-refresh-line"></i>
               Refresh
             </button>
@@ -170,7 +539,7 @@ export default function ScreenMonitor() {
           </div>
         </div>
         <div className="text-gray-500">
-          Resolution: 1920x1080
+          Resolution: {resolution ?? '—'}
         </div>
       </div>
     </div>